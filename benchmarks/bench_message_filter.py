@@ -0,0 +1,103 @@
+"""
+Replays a stream of message events, mostly chatter not meant for the bot plus some edits, bot
+messages and joins, through the slackbot message callback. Compares events per second against
+the callback it replaced, which logged and split every message before checking it.
+
+Run with: python -m benchmarks.bench_message_filter
+"""
+import argparse
+import logging
+import random
+import time
+
+from slackbot import (
+    LOGGER,
+    message_processor,
+)
+
+BOT_ID = 'UBOT00001'
+
+
+class NullProcessor:
+    def __init__(self):
+        self.handled = 0
+
+    def process_message_text(self, message_tokens, context_dict):
+        self.handled += 1
+        return []
+
+
+def old_message_processor(bot_id, processor):
+    at_bot = '<@{}>'.format(bot_id)
+
+    def callback(**payload):
+        LOGGER.debug('Got message: {}'.format(payload))
+
+        data = payload['data']
+        text = data.get('text')
+        if text:
+            tokens = text.strip().split()
+            if tokens[0] == at_bot:
+                context = {
+                    'channel': data['channel'],
+                    'thread_ts': data['ts'],
+                    'user_id': data['user'],
+                    'rtm_client': payload['rtm_client'],
+                    'web_client': payload['web_client'],
+                }
+                processor.process_message_text(tokens[1:], context)
+
+    return callback
+
+
+def make_events(count: int, command_share: float, seed: int = 42):
+    rng = random.Random(seed)
+    words = 'the build is red again can someone look at the deploy after lunch thanks lgtm ship it'.split()
+    events = []
+    for i in range(count):
+        data = {'type': 'message', 'channel': f'C{rng.randrange(20)}', 'user': f'U{rng.randrange(500):08d}',
+                'ts': f'{1600000000 + i}.000100', 'team': 'T00000001'}
+        roll = rng.random()
+        if roll < command_share:
+            data['text'] = f'<@{BOT_ID}> add printer-{rng.randrange(10)}'
+        elif roll < command_share + 0.03:
+            data.update(subtype='message_changed', message={'text': 'edited'})
+        elif roll < command_share + 0.05:
+            data.update(subtype='bot_message', bot_id='B00000001', text=f'Build {i} passed')
+            del data['user']
+        elif roll < command_share + 0.06:
+            data.update(subtype='channel_join', text=f'<@{data["user"]}> has joined the channel')
+        else:
+            data['text'] = ' '.join(rng.choices(words, k=rng.randrange(3, 30)))
+        events.append({'data': data, 'rtm_client': None, 'web_client': None})
+    return events
+
+
+def replay(callback, events) -> float:
+    start = time.perf_counter()
+    for payload in events:
+        callback(**payload)
+    return len(events) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--command-share', type=float, default=0.01, help='fraction of events that are commands')
+    args = parser.parse_args()
+
+    # As in production, where debug logging is off
+    logging.getLogger('van').setLevel(logging.INFO)
+    events = make_events(args.events, args.command_share)
+    old_processor = NullProcessor()
+    old_rate = replay(old_message_processor(BOT_ID, old_processor), events)
+    new_processor = NullProcessor()
+    new_rate = replay(message_processor(BOT_ID, None, new_processor), events)
+
+    print(f'{args.events} events, {old_processor.handled} commands (old), {new_processor.handled} commands (new)')
+    print(f'old callback {old_rate:12.0f} events/s')
+    print(f'new callback {new_rate:12.0f} events/s')
+
+
+if __name__ == '__main__':
+    main()
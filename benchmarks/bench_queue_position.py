@@ -0,0 +1,51 @@
+"""
+Compares finding a user's position in a long queue with ResourceQueue against walking an
+OrderedDict, as the queue grows. Also times adding to and removing from the middle of the queue.
+
+Run with: python -m benchmarks.bench_queue_position
+"""
+import argparse
+import random
+import time
+from collections import OrderedDict
+
+from van.resource_queue import ResourceQueue
+
+
+def walk_position(queue: OrderedDict, user_id: str):
+    for position, queued_user_id in enumerate(queue):
+        if queued_user_id == user_id:
+            return position
+    return None
+
+
+def per_call_us(function, args_list) -> float:
+    start = time.perf_counter()
+    for args in args_list:
+        function(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    for queue_len in (100, 10000, 100000):
+        user_ids = [f'U{i:08d}' for i in range(queue_len)]
+        ordered_dict = OrderedDict((user_id, user_id) for user_id in user_ids)
+        resource_queue = ResourceQueue(user_ids)
+        lookups = [(user_id,) for user_id in rng.choices(user_ids, k=args.lookups)]
+
+        walk = per_call_us(lambda user_id: walk_position(ordered_dict, user_id), lookups)
+        indexed = per_call_us(resource_queue.position, lookups)
+        churn = per_call_us(
+            lambda user_id: (resource_queue.remove(user_id), resource_queue.append(user_id)), lookups
+        )
+        print(f'{queue_len:7} queued: walk {walk:10.1f}us, position {indexed:5.1f}us, '
+              f'remove and re-add {churn:5.1f}us per user')
+
+
+if __name__ == '__main__':
+    main()
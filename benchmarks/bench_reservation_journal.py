@@ -0,0 +1,90 @@
+"""
+Measures ResourceReservation mutation throughput with the journal off, with batched fsyncs
+and with an fsync per change, and the time to replay a large journal on startup.
+
+Run with: python -m benchmarks.bench_reservation_journal
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from van.res_reservation import ResourceReservation
+from van.reservation_journal import ReservationJournal
+
+
+def _mutate_once(reservation: ResourceReservation, rng: random.Random) -> None:
+    resource = f'resource-{rng.randrange(1000)}'
+    user_id = f'U{rng.randrange(5000):08d}'
+    if rng.random() < 0.6:
+        reservation.queue(resource, user_id)
+    else:
+        reservation.remove(resource, user_id)
+
+
+def mutate(reservation: ResourceReservation, count: int, seed: int = 42) -> float:
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(count):
+        _mutate_once(reservation, rng)
+    return time.perf_counter() - start
+
+
+def fill_journal(reservation: ResourceReservation, records: int, seed: int = 42) -> None:
+    """
+    Mutates the reservations until `records` changes have been journaled. Mutations that change
+    nothing (e.g. removing a user who isn't queued) aren't journaled, so take more than `records`.
+    """
+    changes = 0
+
+    def count_change(*args) -> None:
+        nonlocal changes
+        changes += 1
+
+    reservation.listeners.append(count_change)
+    rng = random.Random(seed)
+    while changes < records:
+        _mutate_once(reservation, rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mutations', type=int, default=20000)
+    parser.add_argument('--fsync-mutations', type=int, default=500, help='mutations to run with an fsync each')
+    parser.add_argument('--replay-records', type=int, default=1000000, help='records in the journal to replay')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        elapsed = mutate(ResourceReservation(), args.mutations)
+        print(f'{"in memory only":24} {args.mutations / elapsed:10.0f} mutations/s')
+
+        for label, sync_interval, count in (
+            ('journal, batched fsync', 0.05, args.mutations),
+            ('journal, fsync each', 0, args.fsync_mutations),
+        ):
+            journal = ReservationJournal(os.path.join(tmp_dir, label), sync_interval=sync_interval)
+            elapsed = mutate(ResourceReservation(journal=journal), count)
+            journal.close()
+            print(f'{label:24} {count / elapsed:10.0f} mutations/s')
+
+        replay_dir = os.path.join(tmp_dir, 'replay')
+        journal = ReservationJournal(replay_dir, compact_every=args.replay_records + 1)
+        fill_journal(ResourceReservation(journal=journal), args.replay_records)
+        journal.close()
+        with open(journal.journal_path, 'rb') as journal_file:
+            records = sum(1 for _ in journal_file)
+        size = os.path.getsize(journal.journal_path)
+
+        start = time.perf_counter()
+        journal = ReservationJournal(replay_dir)
+        reservation = ResourceReservation(journal=journal)
+        elapsed = time.perf_counter() - start
+        journal.close()
+        queued = sum(len(queue) for queue in reservation.get_resources().values())
+        print(f'replay {records} records ({size / 1024 / 1024:.1f}MiB): {elapsed:.2f}s, '
+              f'{records / elapsed:.0f} records/s, {queued} users queued')
+
+
+if __name__ == '__main__':
+    main()
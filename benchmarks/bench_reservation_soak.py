@@ -0,0 +1,55 @@
+"""
+Soak test for ResourceReservation: millions of random adds and removes across a large number of
+resource names (as typos and one-off names would be), printing the memory in use as it goes.
+Memory should level off once the number of queued users does, rather than grow with the number
+of names ever used.
+
+Run with: python -m benchmarks.bench_reservation_soak
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from van.res_reservation import ResourceReservation
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ops', type=int, default=2000000)
+    parser.add_argument('--names', type=int, default=1000000, help='number of distinct resource names used')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--report-every', type=int, default=200000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    reservation = ResourceReservation()
+    user_ids = [f'U{i:08d}' for i in range(args.users)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    for op in range(1, args.ops + 1):
+        user_id = rng.choice(user_ids)
+        queued = reservation.get_user_resources(user_id)
+        roll = rng.random()
+        if roll < 0.45 or not queued:
+            # Names are built fresh each time, as they would be when parsed from a message
+            reservation.queue(f'Resource-{rng.randrange(args.names)}', user_id)
+        elif roll < 0.95:
+            reservation.remove(rng.choice(queued), user_id)
+        elif roll < 0.99:
+            reservation.remove_all(rng.choice(queued))
+        else:
+            # Removing from resources nobody is queued for must not create them
+            reservation.remove(f'resource-{rng.randrange(args.names)}', user_id)
+        if op % args.report_every == 0:
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            queued_count = sum(len(queue) for queue in reservation.get_resources().values())
+            print(f'{op:9} ops  {len(reservation.get_resources()):6} resources  {queued_count:6} queued  '
+                  f'{current / 1024 / 1024:7.2f}MB  {time.perf_counter() - start:6.1f}s')
+    tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    main()
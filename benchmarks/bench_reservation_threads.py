@@ -0,0 +1,74 @@
+"""
+Stress test for ResourceReservation shared between threads: each thread makes random changes,
+with some reading snapshots of all the resources as status does. Reports the throughput as the
+number of threads grows and checks that the queues, the user index and the snapshots agree
+afterwards.
+
+Run with: python -m benchmarks.bench_reservation_threads
+"""
+import argparse
+import random
+import threading
+import time
+
+from van.res_reservation import ResourceReservation
+
+
+def make_changes(reservation: ResourceReservation, seed: int, ops: int, resources, user_ids) -> None:
+    rng = random.Random(seed)
+    for _ in range(ops):
+        roll = rng.random()
+        if roll < 0.45:
+            reservation.queue(rng.choice(resources), rng.choice(user_ids))
+        elif roll < 0.9:
+            reservation.remove(rng.choice(resources), rng.choice(user_ids))
+        elif roll < 0.95:
+            reservation.get_user_resources(rng.choice(user_ids))
+        else:
+            sum(len(queue) for queue in reservation.get_resources().values())
+
+
+def check(reservation: ResourceReservation) -> None:
+    queues = {resource: list(queue) for resource, queue in reservation.resources.items()}
+    snapshot = reservation.get_resources()
+    assert {resource: list(queue) for resource, queue in snapshot.items()} == queues
+    assert list(snapshot) == list(queues)
+    index = {}
+    for resource, user_ids in queues.items():
+        assert user_ids and len(set(user_ids)) == len(user_ids)
+        for user_id in user_ids:
+            index.setdefault(user_id, set()).add(resource)
+    assert {user_id: set(resources) for user_id, resources in reservation.user_resources.items()} == index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ops', type=int, default=400000, help='total changes, split between the threads')
+    parser.add_argument('--resources', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+
+    resources = [f'resource-{i}' for i in range(args.resources)]
+    user_ids = [f'U{i:08d}' for i in range(args.users)]
+    for thread_count in (1, 2, 4, 8, 16):
+        reservation = ResourceReservation()
+        threads = [
+            threading.Thread(
+                target=make_changes,
+                args=(reservation, seed, args.ops // thread_count, resources, user_ids),
+            )
+            for seed in range(thread_count)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        check(reservation)
+        print(f'{thread_count:3} threads: {args.ops / elapsed:10.0f} ops/s, '
+              f'{len(reservation.get_resources())} resources reserved, invariants hold')
+
+
+if __name__ == '__main__':
+    main()
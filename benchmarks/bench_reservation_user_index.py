@@ -0,0 +1,52 @@
+"""
+Compares finding and releasing every resource a user is queued for using the per-user index
+against scanning every resource, as the number of resources grows.
+
+Run with: python -m benchmarks.bench_reservation_user_index
+"""
+import argparse
+import random
+import time
+
+from van.res_reservation import ResourceReservation
+
+
+def scan_user_resources(reservation: ResourceReservation, user_id: str):
+    return [resource for resource, queue in reservation.get_resources().items() if user_id in queue]
+
+
+def build(resource_count: int, user_count: int, queue_len: int, seed: int = 42) -> ResourceReservation:
+    rng = random.Random(seed)
+    reservation = ResourceReservation()
+    for i in range(resource_count):
+        for user_id in rng.sample(range(user_count), queue_len):
+            reservation.queue(f'resource-{i}', f'U{user_id:08d}')
+    return reservation
+
+
+def per_call_us(function, args_list) -> float:
+    start = time.perf_counter()
+    for args in args_list:
+        function(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--queue-len', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    for resource_count in (100, 1000, 10000):
+        reservation = build(resource_count, args.users, args.queue_len)
+        user_ids = [(reservation, f'U{i:08d}') for i in random.Random(1).sample(range(args.users), args.lookups)]
+        scan = per_call_us(scan_user_resources, user_ids)
+        indexed = per_call_us(lambda reservation, user_id: reservation.get_user_resources(user_id), user_ids)
+        remove = per_call_us(lambda reservation, user_id: reservation.remove_user(user_id), user_ids)
+        print(f'{resource_count:6} resources: scan {scan:9.1f}us, index {indexed:6.1f}us, '
+              f'remove from all {remove:6.1f}us per user')
+
+
+if __name__ == '__main__':
+    main()
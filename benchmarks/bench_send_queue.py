@@ -0,0 +1,56 @@
+"""
+Sends a burst of responses to a fake WebClient that rate limits each channel the way Slack
+does, posting directly and through the SendQueue. Reports lost posts, 429 responses, the time
+to post the whole burst and the send latencies.
+
+Run with: python -m benchmarks.bench_send_queue
+"""
+import argparse
+import time
+
+from benchmarks.fakes import FakeWebClient
+from van.send_queue import SendQueue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--posts-per-second', type=float, default=20, help='limit per channel of the fake Slack')
+    parser.add_argument('--retry-after', default='0.5')
+    args = parser.parse_args()
+
+    channels = [f'C{i}' for i in range(args.channels)]
+    burst = [(channels[i % len(channels)], f'message {i}') for i in range(args.messages)]
+
+    web_client = FakeWebClient(posts_per_second=args.posts_per_second, retry_after=args.retry_after)
+    start = time.perf_counter()
+    failed = 0
+    for channel, text in burst:
+        try:
+            web_client.chat_postMessage(channel=channel, text=text)
+        except Exception:
+            failed += 1
+    print(f'direct:     {failed} of {args.messages} posts lost to rate limiting, '
+          f'{time.perf_counter() - start:.2f}s')
+
+    for label, rate in (('queue, paced', args.posts_per_second * 0.9), ('queue, eager', args.posts_per_second * 5)):
+        web_client = FakeWebClient(posts_per_second=args.posts_per_second, retry_after=args.retry_after)
+        send_queue = SendQueue(rate=rate, burst=max(1, int(args.posts_per_second / 2)), max_attempts=10)
+        start = time.perf_counter()
+        for channel, text in burst:
+            send_queue.put(channel, web_client, text)
+        send_queue.close()
+        elapsed = time.perf_counter() - start
+        stats = send_queue.stats()
+        in_order = all(
+            web_client.posts[channel] == [text for c, text in burst if c == channel]
+            for channel in channels
+        )
+        print(f'{label}: {stats["sent"]} posted in order={in_order}, {stats["dropped"]} dropped, '
+              f'{web_client.rate_limited} 429s, {elapsed:.2f}s, latency p50={stats["latency_p50"] * 1000:.0f}ms '
+              f'p95={stats["latency_p95"] * 1000:.0f}ms max={stats["latency_max"] * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Times the status command with a large directory and many reserved resources: the first
+(uncached) render, repeated renders with nothing changed, renders after one queue changed,
+and a filtered status.
+
+Run with: python -m benchmarks.bench_status_render
+"""
+import argparse
+import random
+import time
+
+from benchmarks.fakes import (
+    FakeWebClient,
+    make_members,
+)
+from van.res_reservation import ResourceReservationProcessor
+from van.userstore import UserStore
+
+
+def timed_ms(function, repeat: int = 1) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--resources', type=int, default=1000)
+    parser.add_argument('--queue-len', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    members = make_members(args.members)
+    user_store = UserStore(FakeWebClient(members))
+    user_store.get_users()
+    processor = ResourceReservationProcessor(user_store)
+    reservations = processor.reservations
+    for i in range(args.resources):
+        for member in rng.sample(members, args.queue_len):
+            reservations.queue(f'resource-{i}', member['id'])
+
+    context = {'user_id': members[0]['id']}
+    print(f'{args.resources} resources of {args.queue_len} users, {args.members} users in the directory')
+    print(f'first status        {timed_ms(lambda: processor.status([], context)):8.2f}ms')
+    print(f'unchanged status    {timed_ms(lambda: processor.status([], context), args.repeat):8.2f}ms')
+
+    def change_and_status():
+        resource = f'resource-{rng.randrange(args.resources)}'
+        reservations.queue(resource, rng.choice(members)['id'])
+        processor.status([], context)
+
+    print(f'one queue changed   {timed_ms(change_and_status, args.repeat):8.2f}ms')
+    print(f'status resource-1*  {timed_ms(lambda: processor.status(["resource-1*"], context), args.repeat):8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
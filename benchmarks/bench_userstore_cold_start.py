@@ -0,0 +1,56 @@
+"""
+Measures the time from a bot (re)start to its first response that needs a user name,
+with and without an on-disk user snapshot.
+
+Run with: python -m benchmarks.bench_userstore_cold_start
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.fakes import (
+    FakeWebClient,
+    make_members,
+)
+from van.res_reservation import ResourceReservationProcessor
+from van.user import User
+from van.user_snapshot import UserSnapshot
+from van.userstore import UserStore
+
+
+def first_response_time(members, latency: float, snapshot: UserSnapshot = None) -> float:
+    start = time.perf_counter()
+    user_store = UserStore(FakeWebClient(members, latency=latency), snapshot=snapshot)
+    processor = ResourceReservationProcessor(user_store=user_store)
+    # The user saying hello is on the last page of users.list
+    responses = processor.process_message_text(['hello'], {'user_id': members[-1]['id']})
+    elapsed = time.perf_counter() - start
+    assert responses[0].message == 'Hello back, {}!'.format(members[-1]['real_name'])
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument(
+        '--latency', type=float, default=0.02,
+        help='seconds per simulated users.list call, to account for the network and rate limits'
+    )
+    args = parser.parse_args()
+
+    members = make_members(args.members)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot = UserSnapshot(os.path.join(tmp_dir, 'users.db'))
+        start = time.perf_counter()
+        snapshot.save([User.from_member(member) for member in members])
+        print(f'save snapshot of {len(members)} users: {(time.perf_counter() - start) * 1000:.1f}ms, '
+              f'{os.path.getsize(snapshot.path) / 1024:.0f}KiB')
+
+        print(f'without snapshot: {first_response_time(members, args.latency) * 1000:10.1f}ms to first response')
+        print(f'with snapshot:    {first_response_time(members, args.latency, snapshot) * 1000:10.1f}ms '
+              'to first response')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures the time for UserStore to answer its first lookup and the peak memory used
+while loading a large directory, with and without users.list pagination.
+
+Run with: python -m benchmarks.bench_userstore_load
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.fakes import (
+    FakeWebClient,
+    make_members,
+)
+from van.userstore import UserStore
+
+
+def run(members, page_size: int, latency_per_call: float, lookup_index: int):
+    web_client = FakeWebClient(members, latency=latency_per_call)
+    user_store = UserStore(web_client, page_size=page_size)
+    user_id = members[lookup_index]['id']
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    user_store.get_cached_user_info(user_id)
+    first_answer = time.perf_counter() - start
+    _, peak_first = tracemalloc.get_traced_memory()
+
+    user_store.get_users()
+    full_load = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'page_size': page_size,
+        'calls': web_client.calls,
+        'first_answer_ms': first_answer * 1000,
+        'full_load_ms': full_load * 1000,
+        'peak_first_kb': peak_first / 1024,
+        'peak_kb': peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per simulated API call')
+    args = parser.parse_args()
+
+    members = make_members(args.members)
+    for label, page_size in (('single call', args.members), ('paginated', args.page_size)):
+        for lookup_index in (0, args.members // 2):
+            result = run(members, page_size, args.latency, lookup_index)
+            print(
+                f'{label:12} lookup #{lookup_index:<6} calls={result["calls"]:<5} '
+                f'first answer={result["first_answer_ms"]:9.2f}ms '
+                f'full load={result["full_load_ms"]:9.2f}ms '
+                f'peak at first answer={result["peak_first_kb"]:10.1f}KiB '
+                f'peak={result["peak_kb"]:10.1f}KiB'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Measures the memory UserStore keeps per user for a large directory, storing compact User
+records versus keeping the full Slack payload of each user (raw mode).
+
+Run with: python -m benchmarks.bench_userstore_memory
+"""
+import argparse
+import gc
+import tracemalloc
+
+from benchmarks.fakes import (
+    FakeWebClient,
+    make_members,
+)
+from van.userstore import UserStore
+
+
+def retained_bytes(member_count: int, raw: bool) -> int:
+    gc.collect()
+    tracemalloc.start()
+    web_client = FakeWebClient(make_members(member_count))
+    user_store = UserStore(web_client, raw=raw)
+    user_store.get_users()
+    # Drop the fake's copy of the payload so that only what the store kept is counted
+    web_client.members = []
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(user_store.users) == member_count
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=50000)
+    args = parser.parse_args()
+
+    for label, raw in (('raw payload', True), ('User records', False)):
+        retained = retained_bytes(args.members, raw)
+        print(f'{label:14} {retained / 1024 / 1024:8.1f}MiB retained, {retained / args.members:7.0f} bytes/user')
+
+
+if __name__ == '__main__':
+    main()
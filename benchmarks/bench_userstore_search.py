@@ -0,0 +1,61 @@
+"""
+Compares UserStore.search_for_user against the linear scan over every cached user that
+it replaced.
+
+Run with: python -m benchmarks.bench_userstore_search
+"""
+import argparse
+import random
+import time
+
+from benchmarks.fakes import (
+    FakeWebClient,
+    make_members,
+)
+from van.userstore import UserStore
+
+
+def linear_scan(users, user_name):
+    return next((
+        user
+        for _, user in users.items()
+        if user.name == user_name or user.real_name == user_name
+    ), None)
+
+
+def timed(label, lookups, search):
+    start = time.perf_counter()
+    for user_name in lookups:
+        search(user_name)
+    elapsed = time.perf_counter() - start
+    print(f'{label:28} {len(lookups) / elapsed:12.0f} lookups/s {elapsed / len(lookups) * 1e6:10.2f}us/lookup')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    members = make_members(args.members)
+    user_store = UserStore(FakeWebClient(members))
+
+    start = time.perf_counter()
+    users = user_store.get_users()
+    print(f'load and index {len(users)} users: {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    rng = random.Random(42)
+    lookups = [
+        rng.choice(members)[rng.choice(('name', 'real_name'))]
+        for _ in range(args.lookups)
+    ]
+    prefixes = [user_name[:len(user_name) - 2] for user_name in lookups]
+
+    timed('linear scan', lookups, lambda user_name: linear_scan(users, user_name))
+    timed('indexed', lookups, user_store.search_for_user)
+    timed('indexed, case-folded', [user_name.upper() for user_name in lookups], user_store.search_for_user)
+    timed('prefix (limit 10)', prefixes, user_store.search_for_users_by_prefix)
+
+
+if __name__ == '__main__':
+    main()
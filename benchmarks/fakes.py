@@ -0,0 +1,140 @@
+"""
+Fakes of the Slack clients used by the benchmarks. They serve canned data from memory
+so the benchmarks can be run without a Slack workspace.
+"""
+import threading
+import time
+from collections import (
+    defaultdict,
+    deque,
+)
+from typing import (
+    Dict,
+    List,
+)
+
+from slack.errors import SlackApiError
+from slack.web.slack_response import SlackResponse
+
+
+def make_members(count: int) -> List[Dict]:
+    """
+    Makes a synthetic workspace directory shaped like Slack's users.list members.
+
+    :param count: number of members to make
+    :return: the members
+    """
+    return [
+        {
+            'id': f'U{i:08d}',
+            'team_id': 'T00000001',
+            'name': f'user.{i}',
+            'real_name': f'User Number {i}',
+            'deleted': False,
+            'is_bot': False,
+            'tz': 'America/Los_Angeles',
+            'profile': {
+                'real_name': f'User Number {i}',
+                'display_name': f'user.{i}',
+                'email': f'user.{i}@example.com',
+                'image_48': f'https://example.com/avatars/{i}_48.png',
+                'image_192': f'https://example.com/avatars/{i}_192.png',
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def _response(status_code: int, data: Dict, headers: Dict = None) -> SlackResponse:
+    return SlackResponse(
+        client=None,
+        http_verb='POST',
+        api_url='',
+        req_args={},
+        data=data,
+        headers=headers or {},
+        status_code=status_code,
+    )
+
+
+class FakeWebClient:
+    """
+    Stand-in for slack.WebClient serving users.list from a list of members and accepting
+    chat.postMessage calls. Posts can be rate limited per channel like Slack does, answering
+    with 429 responses and a Retry-After header.
+    """
+
+    def __init__(
+        self,
+        members: List[Dict] = (),
+        latency: float = 0.0,
+        posts_per_second: float = None,
+        retry_after: str = '1',
+    ) -> None:
+        """
+        :param members: the workspace directory to serve
+        :param latency: seconds to sleep per API call to simulate the network
+        :param posts_per_second: posts accepted per channel per second (None for no limit)
+        :param retry_after: Retry-After header value sent with 429 responses
+        """
+        self.members = members
+        self.latency = latency
+        self.posts_per_second = posts_per_second
+        self.retry_after = retry_after
+        self.calls = 0
+        self.rate_limited = 0
+        # Channel -> texts posted, in order
+        self.posts = defaultdict(list)
+        self._post_times = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def api_call(self, api_method: str, http_verb: str = 'POST', params: Dict = None, **kwargs) -> Dict:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if api_method != 'users.list':
+            return {'ok': False, 'error': 'unknown_method'}
+
+        params = params or {}
+        start = int(params.get('cursor') or 0)
+        limit = params.get('limit')
+        end = start + limit if limit else len(self.members)
+        response = {'ok': True, 'members': self.members[start:end]}
+        if end < len(self.members):
+            response['response_metadata'] = {'next_cursor': str(end)}
+        return response
+
+    def chat_postMessage(self, *, channel: str, text: str = None, **kwargs) -> SlackResponse:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.posts_per_second:
+                now = time.monotonic()
+                post_times = self._post_times[channel]
+                while post_times and post_times[0] <= now - 1:
+                    post_times.popleft()
+                if len(post_times) >= self.posts_per_second:
+                    self.rate_limited += 1
+                    raise SlackApiError(
+                        'The request to the Slack API failed.',
+                        _response(429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': self.retry_after}),
+                    )
+                post_times.append(now)
+            self.posts[channel].append(text)
+            ts = f'{time.time():.6f}'
+        return _response(200, {'ok': True, 'channel': channel, 'ts': ts, 'message': {'text': text}})
+
+
+class FakeRTMClient:
+    """
+    Stand-in for slack.rtm.client.RTMClient, passed to callbacks along with the events being
+    replayed. The bot only hands it around, so it does nothing but count sends.
+    """
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    def send_over_websocket(self, *, payload: Dict) -> None:
+        self.sent += 1
@@ -0,0 +1,155 @@
+"""
+Replays message events captured from a workspace (see CAPTURE_PATH in the README) through the
+slackbot message callback, against fake Slack clients. Events are fed at the pace they arrived
+at, sped up by --speed, or as fast as they can be handled (--speed 0).
+
+Reports events per second, the latency of each event from when it was due until its callback
+returned, and the number of Slack API calls made. With --workers, the callback only queues
+messages to the pipeline, so the latencies are of queueing; the events per second include
+waiting for the pipeline to drain.
+
+Without a capture at hand, --synthetic N writes a capture of N made-up events to replay.
+
+Run with: python -m benchmarks.replay_capture capture.jsonl [--speed 10] [--workers 4]
+"""
+import argparse
+import json
+import logging
+import time
+from typing import (
+    Dict,
+    List,
+)
+
+from benchmarks.bench_message_filter import (
+    BOT_ID,
+    make_events,
+)
+from benchmarks.fakes import (
+    FakeRTMClient,
+    FakeWebClient,
+    make_members,
+)
+from slackbot import (
+    CommandFilter,
+    message_processor,
+)
+from van.event_capture import (
+    Capture,
+    read_capture,
+)
+from van.pipeline import MessagePipeline
+from van.res_reservation import (
+    ResourceReservation,
+    ResourceReservationProcessor,
+)
+from van.reservation_namespaces import (
+    NamespaceScope,
+    ReservationNamespaces,
+)
+from van.send_queue import SendQueue
+from van.userstore import UserStore
+
+
+def write_synthetic_capture(path: str, count: int, events_per_second: float) -> None:
+    with open(path, 'w') as capture_file:
+        capture_file.write(json.dumps({'bot_id': BOT_ID, 'started_at': time.time()}) + '\n')
+        for i, payload in enumerate(make_events(count, command_share=0.05)):
+            data = payload['data']
+            if 'text' in data and data['text'].startswith('<@'):
+                # Spread the commands over a few of the commands the bot takes
+                data['text'] = data['text'].replace(' add ', (' add ', ' remove ', ' status ', ' mine ')[i % 4])
+            capture_file.write(json.dumps({'t': round(i / events_per_second, 6), 'data': data}) + '\n')
+
+
+def make_members_for(capture: Capture) -> List[Dict]:
+    """
+    Makes a workspace directory with a member for each user in the capture.
+    """
+    user_ids = sorted({event.data['user'] for event in capture.events if 'user' in event.data})
+    members = make_members(len(user_ids))
+    for member, user_id in zip(members, user_ids):
+        member['id'] = user_id
+    return members
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def replay(capture: Capture, speed: float, workers: int, use_send_queue: bool, scope: str) -> None:
+    web_client = FakeWebClient(make_members_for(capture))
+    user_store = UserStore(web_client)
+    user_store.get_users()
+    # Only count the calls made handling the events
+    web_client.calls = 0
+
+    namespaces = ReservationNamespaces(NamespaceScope(scope)) if scope else None
+    processor = ResourceReservationProcessor(
+        user_store,
+        reservations=ResourceReservation() if namespaces is None else None,
+        namespaces=namespaces,
+    )
+    # Paced as loosely as possible, since the fake client doesn't rate limit
+    send_queue = SendQueue(rate=1000000, burst=1000000, max_size=1000000) if use_send_queue else None
+    pipeline = None
+    if workers:
+        pipeline = MessagePipeline(processor, workers=workers, send_queue=send_queue, namespaces=namespaces)
+    callback = message_processor(capture.bot_id, user_store, processor, pipeline=pipeline, send_queue=send_queue)
+    rtm_client = FakeRTMClient()
+    command_filter = CommandFilter(capture.bot_id)
+    commands = sum(command_filter.command_tokens(event.data) is not None for event in capture.events)
+
+    first_t = capture.events[0].t if capture.events else 0.0
+    latencies = []
+    start = time.perf_counter()
+    for event in capture.events:
+        if speed:
+            due = start + (event.t - first_t) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            due = time.perf_counter()
+        callback(data=event.data, rtm_client=rtm_client, web_client=web_client)
+        latencies.append(time.perf_counter() - due)
+    if pipeline:
+        pipeline.close()
+    if send_queue:
+        send_queue.drain()
+        send_queue.close()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f'{len(capture.events)} events, {commands} commands, replayed in {elapsed:.2f}s')
+    print(f'{len(capture.events) / elapsed:12.0f} events/s')
+    for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)):
+        print(f'{label} latency {percentile(latencies, fraction) * 1000:10.3f} ms')
+    posts = sum(len(texts) for texts in web_client.posts.values())
+    print(f'{web_client.calls} Slack calls ({posts} posts)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', help='the capture file to replay')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='how many times faster than real time to replay (0 for as fast as possible)')
+    parser.add_argument('--workers', type=int, default=0, help='handle messages with a pipeline of this many workers')
+    parser.add_argument('--send-queue', action='store_true', help='post responses through a SendQueue')
+    parser.add_argument('--scope', choices=[scope.value for scope in NamespaceScope],
+                        help='keep separate reservations per channel or workspace')
+    parser.add_argument('--synthetic', type=int, metavar='N', help='first write a capture of N made-up events')
+    parser.add_argument('--synthetic-rate', type=float, default=100.0, help='events per second of the made-up capture')
+    args = parser.parse_args()
+
+    # As in production, where debug logging is off
+    logging.getLogger('van').setLevel(logging.INFO)
+    if args.synthetic:
+        write_synthetic_capture(args.capture, args.synthetic, args.synthetic_rate)
+    replay(read_capture(args.capture), args.speed, args.workers, args.send_queue, args.scope)
+
+
+if __name__ == '__main__':
+    main()
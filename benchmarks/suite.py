@@ -0,0 +1,327 @@
+"""
+Runs the benchmarks of the reservation core and the message path, and writes the results as
+JSON so that runs can be compared:
+
+* ResourceReservation queue, remove, front and position lookups with many resources, some of
+  them with deep queues
+* ResourceReservationProcessor.process_message_text, per command
+* the status command against a large UserStore: first render, unchanged and after one change
+* the slackbot message callback end to end, posting to a fake WebClient
+
+Each result is the best time per operation over --repeat runs, in microseconds.
+
+Run with: python -m benchmarks.suite run [--output results.json]
+Compare with: python -m benchmarks.suite compare base.json results.json [--threshold 0.1]
+The comparison exits with status 1 if any benchmark got slower by more than the threshold.
+"""
+import argparse
+import gc
+import json
+import logging
+import platform
+import random
+import sys
+import time
+from typing import (
+    Callable,
+    Dict,
+    List,
+)
+
+from benchmarks.fakes import (
+    FakeRTMClient,
+    FakeWebClient,
+    make_members,
+)
+from slackbot import message_processor
+from van.res_reservation import (
+    ResourceReservation,
+    ResourceReservationProcessor,
+)
+from van.userstore import UserStore
+
+# Version of the results format, bumped if it changes incompatibly
+RESULTS_VERSION = 1
+# Status renders per run of the cached status benchmarks
+STATUS_RENDERS = 20
+# Changes in time per operation smaller than this fraction are not reported as regressions
+DEFAULT_THRESHOLD = 0.1
+
+
+def _best_us(run: Callable[[], int], repeat: int) -> float:
+    """
+    :param run: runs the benchmark once and returns the number of operations it made
+    :return: the best time per operation over repeat runs, in microseconds
+    """
+    best = None
+    for _ in range(repeat):
+        # As timeit does, so that collections triggered by earlier benchmarks don't land in this one
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            ops = run()
+            per_op = (time.perf_counter() - start) / ops * 1e6
+        finally:
+            gc.enable()
+        best = per_op if best is None else min(best, per_op)
+    return best
+
+
+def _make_user_store(members: List[Dict]) -> UserStore:
+    user_store = UserStore(FakeWebClient(members))
+    user_store.get_users()
+    return user_store
+
+
+def bench_reservation(args, results: Dict[str, float]) -> None:
+    rng = random.Random(42)
+    reservation = ResourceReservation()
+    user_ids = [f'U{i:08d}' for i in range(args.queue_depth)]
+    deep = [f'deep-{i}' for i in range(args.deep_resources)]
+    for resource in deep:
+        for user_id in user_ids:
+            reservation.queue(resource, user_id)
+    for i in range(args.resources - args.deep_resources):
+        for user_id in rng.sample(user_ids, 5):
+            reservation.queue(f'resource-{i}', user_id)
+    resources = list(reservation.resources)
+
+    targets = [(rng.choice(deep), f'N{i:08d}') for i in range(args.ops)]
+    middles = [(rng.choice(deep), rng.choice(user_ids)) for _ in range(args.ops)]
+    lookups = [rng.choice(resources) for _ in range(args.ops)]
+
+    def queue():
+        for resource, user_id in targets:
+            reservation.queue(resource, user_id)
+        return len(targets)
+
+    def remove():
+        for resource, user_id in targets:
+            reservation.remove(resource, user_id)
+        return len(targets)
+
+    def requeue_middle():
+        # Removes users from the middle of deep queues and puts them back at the end
+        for resource, user_id in middles:
+            reservation.remove(resource, user_id)
+            reservation.queue(resource, user_id)
+        return len(middles)
+
+    def front():
+        for resource in lookups:
+            reservation.get_user_id_at_front(resource)
+        return len(lookups)
+
+    def position():
+        for resource, user_id in middles:
+            reservation.get_position(resource, user_id)
+        return len(middles)
+
+    timings = {'queue': [], 'remove': []}
+    for _ in range(args.repeat):
+        timings['queue'].append(_best_us(queue, 1))
+        timings['remove'].append(_best_us(remove, 1))
+    results['reservation.queue'] = min(timings['queue'])
+    results['reservation.remove'] = min(timings['remove'])
+    results['reservation.requeue_middle'] = _best_us(requeue_middle, args.repeat)
+    results['reservation.front'] = _best_us(front, args.repeat)
+    results['reservation.position'] = _best_us(position, args.repeat)
+
+
+def bench_commands(args, members: List[Dict], results: Dict[str, float]) -> None:
+    rng = random.Random(42)
+    processor = ResourceReservationProcessor(_make_user_store(members))
+    for i in range(100):
+        for member in rng.sample(members, 10):
+            processor.reservations.queue(f'resource-{i}', member['id'])
+    user_ids = [member['id'] for member in rng.sample(members, min(len(members), args.ops))]
+
+    def command(tokens: List[str], users: List[str] = user_ids) -> Callable[[], int]:
+        def run():
+            for user_id in users:
+                processor.process_message_text(tokens, {'user_id': user_id})
+            return len(users)
+        return run
+
+    # add and remove are timed in pairs of runs so that each run finds the queues as they started
+    add = command(['add', 'resource-1', 'resource-2'])
+    remove = command(['remove', 'resource-1', 'resource-2'])
+    timings = {'add': [], 'remove': []}
+    for _ in range(args.repeat):
+        timings['add'].append(_best_us(add, 1))
+        timings['remove'].append(_best_us(remove, 1))
+    results['command.add'] = min(timings['add'])
+    results['command.remove'] = min(timings['remove'])
+
+    few_users = user_ids[:max(1, len(user_ids) // 10)]
+    for name, tokens in (
+        ('position', ['position', 'resource-1']),
+        ('mine', ['mine']),
+        ('status_filtered', ['status', 'resource-1*']),
+        ('help', ['help']),
+        ('sequence', ['add', 'resource-3;', 'position', 'resource-3;', 'remove', 'resource-3']),
+    ):
+        results[f'command.{name}'] = _best_us(command(tokens, few_users), args.repeat)
+
+
+def bench_status(args, members: List[Dict], results: Dict[str, float]) -> None:
+    rng = random.Random(42)
+    user_store = _make_user_store(members)
+    context = {'user_id': members[0]['id']}
+
+    def make_processor():
+        processor = ResourceReservationProcessor(user_store)
+        for i in range(args.status_resources):
+            for member in rng.sample(members, 10):
+                processor.reservations.queue(f'resource-{i}', member['id'])
+        return processor
+
+    first = []
+    for _ in range(args.repeat):
+        processor = make_processor()
+        first.append(_best_us(lambda: processor.status([], context) and 1, 1))
+    results['status.first'] = min(first)
+
+    def unchanged():
+        for _ in range(STATUS_RENDERS):
+            processor.status([], context)
+        return STATUS_RENDERS
+
+    def one_changed():
+        for _ in range(STATUS_RENDERS):
+            processor.reservations.queue(
+                f'resource-{rng.randrange(args.status_resources)}', rng.choice(members)['id']
+            )
+            processor.status([], context)
+        return STATUS_RENDERS
+
+    results['status.unchanged'] = _best_us(unchanged, args.repeat)
+    results['status.one_changed'] = _best_us(one_changed, args.repeat)
+
+
+def bench_callback(args, members: List[Dict], results: Dict[str, float]) -> None:
+    rng = random.Random(42)
+    bot_id = 'UBOT00001'
+    web_client = FakeWebClient(members)
+    user_store = UserStore(web_client)
+    user_store.get_users()
+    processor = ResourceReservationProcessor(user_store)
+    callback = message_processor(bot_id, user_store, processor)
+    rtm_client = FakeRTMClient()
+
+    def payloads(texts: List[str]) -> List[Dict]:
+        return [
+            {
+                'data': {
+                    'type': 'message', 'channel': f'C{i % 10}', 'user': rng.choice(members)['id'],
+                    'ts': f'{1600000000 + i}.000100', 'text': text,
+                },
+                'rtm_client': rtm_client,
+                'web_client': web_client,
+            }
+            for i, text in enumerate(texts)
+        ]
+
+    commands = payloads([
+        f'<@{bot_id}> {("add", "remove", "position", "mine")[i % 4]} resource-{i // 4 % 50}' for i in range(args.ops)
+    ])
+    chatter = payloads(['the build is red again, can someone look at the deploy'] * args.ops)
+
+    def replay(events: List[Dict]) -> Callable[[], int]:
+        def run():
+            for payload in events:
+                callback(**payload)
+            return len(events)
+        return run
+
+    results['callback.command'] = _best_us(replay(commands), args.repeat)
+    results['callback.chatter'] = _best_us(replay(chatter), args.repeat)
+
+
+def run(args) -> Dict:
+    members = make_members(args.members)
+    results = {}
+    bench_reservation(args, results)
+    bench_commands(args, members, results)
+    bench_status(args, members, results)
+    bench_callback(args, members, results)
+    return {
+        'version': RESULTS_VERSION,
+        'created_at': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': {
+            name: value for name, value in vars(args).items() if name not in ('command', 'output', 'function')
+        },
+        # Benchmark -> microseconds per operation
+        'results': results,
+    }
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> List[str]:
+    """
+    :return: the names of the benchmarks that got slower by more than threshold
+    """
+    if base.get('args') != new.get('args'):
+        print('warning: the runs were made with different arguments', file=sys.stderr)
+    regressions = []
+    print(f'{"benchmark":28} {"base us":>12} {"new us":>12} {"change":>8}')
+    for name in sorted(set(base['results']) | set(new['results'])):
+        base_us = base['results'].get(name)
+        new_us = new['results'].get(name)
+        if base_us is None or new_us is None:
+            print(f'{name:28} {"only in " + ("new" if base_us is None else "base"):>34}')
+            continue
+        change = new_us / base_us - 1
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = 'improved'
+        print(f'{name:28} {base_us:12.2f} {new_us:12.2f} {change:+8.1%} {flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--output', help='file to write the results to (default: standard output)')
+    run_parser.add_argument('--resources', type=int, default=10000)
+    run_parser.add_argument('--deep-resources', type=int, default=50, help='resources with deep queues')
+    run_parser.add_argument('--queue-depth', type=int, default=1000)
+    run_parser.add_argument('--members', type=int, default=50000, help='users in the directory')
+    run_parser.add_argument('--status-resources', type=int, default=1000)
+    run_parser.add_argument('--ops', type=int, default=5000, help='operations per run of each benchmark')
+    run_parser.add_argument('--repeat', type=int, default=5, help='runs of each benchmark to take the best of')
+
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='fraction a benchmark may slow down by before it is flagged')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.base) as base_file, open(args.new) as new_file:
+            regressions = compare(json.load(base_file), json.load(new_file), args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+        return
+
+    # As in production, where debug logging is off
+    logging.getLogger('van').setLevel(logging.INFO)
+    results = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(results + '\n')
+    else:
+        print(results)
+
+
+if __name__ == '__main__':
+    main()
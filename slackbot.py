@@ -1,60 +1,272 @@
 import os
-from typing import Callable
+import re
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
 
 from slack import WebClient
 from slack.rtm.client import RTMClient
 
-from responses import Responder
+from van.event_capture import EventCapture
+from van.responses import Responder
 from van import logs
 from van.logs import get_logger
-from van.res_reservation import ResourceReservationProcessor
+from van.metrics import (
+    REGISTRY,
+    MetricsServer,
+)
+from van.pipeline import MessagePipeline
+from van.profiling import (
+    PROFILER,
+    install_signal_handlers,
+)
+from van.res_reservation import (
+    ResourceReservation,
+    ResourceReservationProcessor,
+)
+from van.reservation_journal import ReservationJournal
+from van.reservation_namespaces import (
+    DEFAULT_NAMESPACE_LOCK_SHARDS,
+    NamespaceScope,
+    ReservationNamespaces,
+)
+from van.send_queue import SendQueue
+from van.user_snapshot import UserSnapshot
 from van.userstore import UserStore
 
 
 logs.init_logging()
 LOGGER = get_logger(name='van.slackbot')
 
+# Subtypes of messages posted by people, which can be commands. Messages of any other subtype
+# (edits, deletions, joins, bot messages, ...) are ignored.
+COMMAND_SUBTYPES = frozenset(('thread_broadcast', 'file_share', 'me_message'))
 
-def message_processor(bot_id: str, user_store: UserStore, processor: ResourceReservationProcessor) -> Callable:
+
+class CommandFilter:
+    """
+    Picks out commands for the bot from message events. Most events are chatter not meant for
+    the bot, so they are turned away by cheap checks on the subtype, the sender and a substring
+    search for the mention, before anything is matched or split.
+    """
+    __slots__ = ('bot_id', 'mention_prefix', 'mention')
+
+    def __init__(self, bot_id: str) -> None:
+        """
+        :param bot_id: the bot's user ID
+        """
+        self.bot_id = bot_id
+        self.mention_prefix = '<@' + bot_id
+        # Mentions are <@BOT_ID> or <@BOT_ID|name>
+        self.mention = re.compile(r'<@{}(?:\|[^>]*)?>'.format(re.escape(bot_id)))
+
+    def command_tokens(self, data: Dict[str, Any]) -> Optional[List[str]]:
+        """
+        :param data: the data of a message event
+        :return: the command tokens following the mention of the bot (or preceding it, if nothing
+            follows), or None if the message isn't a command for the bot
+        """
+        subtype = data.get('subtype')
+        if subtype is not None and subtype not in COMMAND_SUBTYPES:
+            return None
+        text = data.get('text')
+        if not text or self.mention_prefix not in text or data.get('bot_id') or data.get('user') == self.bot_id:
+            return None
+        match = self.mention.search(text)
+        if not match:
+            return None
+        return text[match.end():].split() or text[:match.start()].split()
+
+
+def message_processor(
+    bot_id: str,
+    user_store: UserStore,
+    processor: ResourceReservationProcessor,
+    pipeline: MessagePipeline = None,
+    send_queue: SendQueue = None,
+) -> Callable:
     """
     A thunk to return a message processor callback to handle message events from Slack.
 
+    :param pipeline: if provided, messages are only queued to this pipeline by the callback
+        instead of being handled and responded to right away
+    :param send_queue: if provided, responses are posted through this queue
     :return: a callback that can be passed to RTMClient.on()
     """
-    at_bot = '<@{}>'.format(bot_id)
+    command_filter = CommandFilter(bot_id)
 
     def callback(**payload):
-        LOGGER.debug('Got message: {}'.format(payload))
-
         data = payload['data']
-        text = data.get('text')
-        if text:
-            tokens = text.strip().split()
-            if tokens[0] == at_bot:
-                context = {
-                    'channel': data['channel'],
-                    'thread_ts': data['ts'],
-                    'user_id': data['user'],
-                    'rtm_client': payload['rtm_client'],
-                    'web_client': payload['web_client'],
-                }
-
-                responder = Responder(data['channel'], payload['web_client'])
-                for response in processor.process_message_text(tokens[1:], context):
-                    responder.respond(response)
+        tokens = command_filter.command_tokens(data)
+        if tokens is None:
+            return
+        LOGGER.debug('Got command: %s', data)
+        context = {
+            'channel': data['channel'],
+            'team': data.get('team'),
+            'thread_ts': data['ts'],
+            'user_id': data['user'],
+            'rtm_client': payload['rtm_client'],
+            'web_client': payload['web_client'],
+        }
+
+        if pipeline:
+            pipeline.submit(tokens, context)
+        else:
+            responder = Responder(data['channel'], payload['web_client'], send_queue=send_queue)
+            responder.respond_all(processor.process_message_text(tokens, context))
+
+    return callback
+
+
+def capture_processor(capture: EventCapture) -> Callable:
+    """
+    A thunk to return a callback recording message events from Slack, to be replayed offline.
+
+    :return: a callback that can be passed to RTMClient.on()
+    """
+    def callback(**payload):
+        capture.record(payload['data'])
 
     return callback
 
 
+def user_change_processor(user_store: UserStore) -> Callable:
+    """
+    A thunk to return a callback to handle user_change and team_join events from Slack,
+    keeping the users known to the UserStore up to date between full reloads.
+
+    :return: a callback that can be passed to RTMClient.on()
+    """
+    def callback(**payload):
+        user = payload['data'].get('user')
+        if isinstance(user, dict):
+            LOGGER.debug('Updating user %s', user.get('id'))
+            user_store.update_user(user)
+
+    return callback
+
+
+def serve_metrics(
+    port: int,
+    user_store: UserStore,
+    processor: ResourceReservationProcessor,
+    namespaces: ReservationNamespaces = None,
+    send_queue: SendQueue = None,
+    pipeline: MessagePipeline = None,
+) -> MetricsServer:
+    """
+    Registers gauges of the bot's queues and serves them, along with the latencies and counts
+    recorded as the bot runs, on a local HTTP endpoint for Prometheus to scrape.
+
+    :param port: the port to listen on
+    :return: the started server
+    """
+    def all_reservations() -> List[ResourceReservation]:
+        return namespaces.all() if namespaces else [processor.reservations]
+
+    REGISTRY.gauge(
+        'van_resources', 'Resources with users queued for them',
+        lambda: sum(reservations.get_resource_count() for reservations in all_reservations()),
+    )
+    REGISTRY.gauge(
+        'van_queued_users', 'Places taken in all the resource queues',
+        lambda: sum(reservations.get_queued_count() for reservations in all_reservations()),
+    )
+    REGISTRY.gauge('van_users', 'Users in the directory', lambda: len(user_store.users))
+    if namespaces:
+        REGISTRY.gauge('van_namespaces', 'Reservation namespaces in use', lambda: len(namespaces.all()))
+    if send_queue:
+        REGISTRY.gauge('van_send_queue_depth', 'Responses waiting to be posted', send_queue.depth)
+    if pipeline:
+        REGISTRY.gauge('van_pipeline_pending', 'Messages waiting to be handled', pipeline.pending)
+
+    server = MetricsServer(REGISTRY, port=port)
+    server.start()
+    return server
+
+
 if '__main__' == __name__:
     bot_token = os.environ.get('BOT_API_TOKEN')
     bot_id = os.environ.get('BOT_ID')
     if bot_token and bot_id:
         rtm_client = RTMClient(token=bot_token, auto_reconnect=True)
-        user_store = UserStore(WebClient(token=bot_token))
-        processor = ResourceReservationProcessor(user_store=user_store)
+        snapshot_path = os.environ.get('USER_SNAPSHOT_PATH')
+        user_store = UserStore(
+            WebClient(token=bot_token),
+            # Users are kept up to date by events, so full reloads are only a daily consistency sweep
+            ttl=24 * 60 * 60,
+            snapshot=UserSnapshot(snapshot_path) if snapshot_path else None,
+        )
+        # Load the users up front so that handling messages never waits on the download
+        user_store.get_users()
+        data_dir = os.environ.get('RESERVATION_DATA_DIR')
+        max_resources = os.environ.get('MAX_RESOURCES')
+        max_queue_len = os.environ.get('MAX_QUEUE_LENGTH')
+
+        def make_reservations(namespace: str = None, **kwargs) -> ResourceReservation:
+            journal = None
+            if data_dir:
+                # Each namespace keeps its own journal in a directory named after it
+                journal = ReservationJournal(os.path.join(data_dir, namespace) if namespace else data_dir)
+            return ResourceReservation(
+                journal=journal,
+                max_resources=int(max_resources) if max_resources else None,
+                max_queue_len=int(max_queue_len) if max_queue_len else None,
+                **kwargs
+            )
+
+        reservation_scope = os.environ.get('RESERVATION_SCOPE')
+        namespaces = None
+        if reservation_scope:
+            namespaces = ReservationNamespaces(
+                NamespaceScope(reservation_scope.lower()),
+                factory=lambda key: make_reservations(key or '_', lock_shards=DEFAULT_NAMESPACE_LOCK_SHARDS),
+            )
+        status_board_debounce = os.environ.get('STATUS_BOARD_DEBOUNCE')
+        admin_user_ids = os.environ.get('ADMIN_USER_IDS')
+        profile_dir = os.environ.get('PROFILE_DIR')
+        if profile_dir:
+            PROFILER.directory = profile_dir
+        install_signal_handlers(PROFILER)
+        send_queue = SendQueue()
+        processor = ResourceReservationProcessor(
+            user_store=user_store,
+            reservations=make_reservations() if namespaces is None else None,
+            status_board_debounce=float(status_board_debounce) if status_board_debounce else None,
+            namespaces=namespaces,
+            profiler=PROFILER,
+            admin_user_ids=admin_user_ids.replace(',', ' ').split() if admin_user_ids else (),
+            send_queue=send_queue,
+        )
+
+        pipeline_workers = os.environ.get('PIPELINE_WORKERS')
+        pipeline = None
+        if pipeline_workers:
+            pipeline = MessagePipeline(
+                processor, workers=int(pipeline_workers), send_queue=send_queue, namespaces=namespaces
+            )
 
-        RTMClient.on(event='message', callback=message_processor(bot_id, user_store, processor))
+        capture_path = os.environ.get('CAPTURE_PATH')
+        if capture_path:
+            capture_max_events = os.environ.get('CAPTURE_MAX_EVENTS')
+            capture = EventCapture(
+                capture_path, bot_id, max_events=int(capture_max_events) if capture_max_events else None
+            )
+            RTMClient.on(event='message', callback=capture_processor(capture))
+        metrics_port = os.environ.get('METRICS_PORT')
+        if metrics_port:
+            serve_metrics(int(metrics_port), user_store, processor, namespaces, send_queue, pipeline)
+        RTMClient.on(
+            event='message',
+            callback=message_processor(bot_id, user_store, processor, pipeline=pipeline, send_queue=send_queue),
+        )
+        for event in ('user_change', 'team_join'):
+            RTMClient.on(event=event, callback=user_change_processor(user_store))
         rtm_client.start()
     else:
         LOGGER.error('Set environment variables BOT_API_TOKEN and BOT_ID and try again.')
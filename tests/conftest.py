@@ -5,12 +5,14 @@ from van.res_reservation import (
     ResourceReservation,
     ResourceReservationProcessor,
 )
+from van.user import User
 from van.userstore import UserStore
 
 MOCK_USERS = [
     {'id': f'user_{i}', 'name': f'User {i}', 'real_name': f'Real User {i}'}
     for i in range(1, 4)
 ]
+MOCK_USER_RECORDS = [User.from_member(user) for user in MOCK_USERS]
 
 
 @pytest.fixture
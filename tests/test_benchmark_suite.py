@@ -0,0 +1,63 @@
+import json
+
+import mock
+import pytest
+
+from benchmarks import suite
+
+
+def _write_results(path, results, args=None):
+    path.write_text(json.dumps({'version': suite.RESULTS_VERSION, 'args': args or {'ops': 100}, 'results': results}))
+    return str(path)
+
+
+def _compare(capsys, base, new, *options):
+    with mock.patch('sys.argv', ['suite', 'compare', base, new, *options]):
+        try:
+            suite.main()
+            status = 0
+        except SystemExit as e:
+            status = e.code
+    return status, capsys.readouterr().out.splitlines()
+
+
+def test_compare_flags_regression(tmp_path, capsys):
+    base = _write_results(tmp_path / 'base.json', {'add': 10.0, 'status': 20.0, 'removed': 5.0})
+    new = _write_results(tmp_path / 'new.json', {'add': 12.0, 'status': 15.0, 'added': 1.0})
+
+    status, lines = _compare(capsys, base, new)
+
+    assert status == 1
+    rows = {line.split()[0]: line.split()[1:] for line in lines[1:-1]}
+    assert rows['add'] == ['10.00', '12.00', '+20.0%', 'REGRESSION']
+    assert rows['status'] == ['20.00', '15.00', '-25.0%', 'improved']
+    assert rows['added'] == ['only', 'in', 'new']
+    assert rows['removed'] == ['only', 'in', 'base']
+    assert lines[-1] == '1 regression(s): add'
+
+
+def test_compare_within_threshold(tmp_path, capsys):
+    base = _write_results(tmp_path / 'base.json', {'add': 10.0, 'status': 20.0})
+    new = _write_results(tmp_path / 'new.json', {'add': 10.5, 'status': 19.5})
+
+    status, lines = _compare(capsys, base, new)
+
+    assert status == 0
+    assert [line.split()[-1] for line in lines[1:]] == ['+5.0%', '-2.5%']
+
+    # A stricter threshold flags the same change
+    status, lines = _compare(capsys, base, new, '--threshold', '0.01')
+    assert status == 1
+    assert lines[-1] == '1 regression(s): add'
+
+
+def test_compare_warns_about_different_args(capsys):
+    base = {'args': {'ops': 100}, 'results': {'add': 10.0}}
+    new = {'args': {'ops': 200}, 'results': {'add': 10.0}}
+
+    assert suite.compare(base, new, suite.DEFAULT_THRESHOLD) == []
+    assert 'different arguments' in capsys.readouterr().err
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,93 @@
+import pytest
+
+from slackbot import CommandFilter
+from van.event_capture import (
+    EventCapture,
+    EventScrubber,
+    read_capture,
+)
+
+
+def _event(text, **fields):
+    data = {
+        'type': 'message',
+        'channel': 'C1',
+        'team': 'T1',
+        'user': 'U1',
+        'ts': '1.0',
+        'text': text,
+        'token': 'xoxb-secret',
+        'user_profile': {'real_name': 'Some One', 'email': 'some.one@example.com'},
+        'blocks': [{'type': 'rich_text'}],
+    }
+    data.update(fields)
+    return data
+
+
+def test_scrub():
+    scrubber = EventScrubber('BOT', key=b'key')
+
+    scrubbed = scrubber.scrub(_event('<@BOT> add printer <@U2|someone> <mailto:a@example.com|a> xoxp-123-abc'))
+
+    assert set(scrubbed) == {'type', 'channel', 'team', 'user', 'ts', 'text'}
+    assert scrubbed['user'] == scrubber.pseudonym('U1') != 'U1'
+    assert scrubbed['user'].startswith('U')
+    assert scrubbed['channel'].startswith('C') and scrubbed['channel'] != 'C1'
+    assert scrubbed['text'] == '<@BOT> add printer <@{}> <link> <token>'.format(scrubber.pseudonym('U2'))
+    assert CommandFilter('BOT').command_tokens(scrubbed)[:2] == ['add', 'printer']
+
+
+def test_scrub_chatter():
+    scrubbed = EventScrubber('BOT').scrub(_event('call me on 555-1234'))
+
+    assert scrubbed['text'] == 'x' * len('call me on 555-1234')
+
+
+def test_pseudonyms_are_stable_within_a_capture_only():
+    scrubber = EventScrubber('BOT')
+
+    assert scrubber.pseudonym('U1') == scrubber.pseudonym('U1')
+    assert scrubber.pseudonym('U1') != scrubber.pseudonym('U2')
+    assert scrubber.pseudonym('U1') != EventScrubber('BOT').pseudonym('U1')
+    assert scrubber.pseudonym('BOT') == 'BOT'
+
+
+def test_capture_and_read(tmp_path):
+    path = str(tmp_path / 'capture.jsonl')
+    capture = EventCapture(path, 'BOT')
+    capture.record(_event('<@BOT> add printer'))
+    capture.record(_event('hello', subtype='me_message'))
+    capture.close()
+    capture.record(_event('<@BOT> remove printer'))
+
+    bot_id, events = read_capture(path)
+    assert bot_id == 'BOT'
+    assert [event.data['text'] for event in events] == ['<@BOT> add printer', 'xxxxx']
+    assert events[1].data['subtype'] == 'me_message'
+    assert 0 <= events[0].t <= events[1].t
+    assert 'xoxb' not in open(path).read()
+
+
+def test_capture_stops_at_max_events(tmp_path):
+    path = str(tmp_path / 'capture.jsonl')
+    capture = EventCapture(path, 'BOT', max_events=2)
+    for _ in range(5):
+        capture.record(_event('<@BOT> status'))
+
+    assert capture.recorded == 2
+    assert len(read_capture(path).events) == 2
+
+
+def test_read_ignores_incomplete_record(tmp_path):
+    path = str(tmp_path / 'capture.jsonl')
+    capture = EventCapture(path, 'BOT')
+    capture.record(_event('<@BOT> status'))
+    capture.close()
+    with open(path, 'a') as capture_file:
+        capture_file.write('{"t": 1.0, "da')
+
+    assert len(read_capture(path).events) == 1
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,94 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from van import logs
+
+
+@pytest.fixture
+def restore_logging():
+    yield
+    logs.init_logging({})
+
+
+def _logged(capsys):
+    logs.stop_logging()
+    return capsys.readouterr().err.splitlines()
+
+
+def _messages(lines):
+    # Lines are: date time logger level message
+    return [line.split(None, 4)[4] for line in lines]
+
+
+def test_text(restore_logging, capsys):
+    logs.init_logging({})
+    logs.get_logger('van.test').debug('Queued %s for %s', 'user_1', 'printer')
+
+    lines = _logged(capsys)
+    assert len(lines) == 1
+    assert lines[0].endswith('van.test     DEBUG    Queued user_1 for printer')
+
+
+def test_json(restore_logging, capsys):
+    logs.init_logging({'LOG_FORMAT': 'json'})
+    logger = logs.get_logger('van.test')
+    logger.info('Queued %s', 'user_1')
+    try:
+        raise ValueError('oops')
+    except ValueError:
+        logger.exception('Failed')
+
+    entries = [json.loads(line) for line in _logged(capsys)]
+    assert [(entry['level'], entry['logger'], entry['message']) for entry in entries] == [
+        ('INFO', 'van.test', 'Queued user_1'),
+        ('ERROR', 'van.test', 'Failed'),
+    ]
+    assert 'ValueError: oops' in entries[1]['exception']
+
+
+def test_level(restore_logging, capsys):
+    logs.init_logging({'LOG_LEVEL': 'warning'})
+    logger = logs.get_logger('van.test')
+    logger.info('Not written')
+    logger.warning('Written')
+
+    assert _messages(_logged(capsys)) == ['Written']
+
+
+def test_unknown_level():
+    with pytest.raises(ValueError):
+        logs.init_logging({'LOG_LEVEL': 'chatty'})
+
+
+def test_debug_sampling(restore_logging, capsys):
+    logs.init_logging({'LOG_DEBUG_SAMPLE_RATE': '10'})
+    logger = logs.get_logger('van.test')
+    for i in range(25):
+        logger.debug('Event %s', i)
+        logger.debug('Other event %s', i)
+    logger.info('Not sampled')
+
+    assert _messages(_logged(capsys)) == [
+        'Event 0', 'Other event 0', 'Event 10', 'Other event 10', 'Event 20', 'Other event 20', 'Not sampled',
+    ]
+
+
+def test_full_queue_drops_records():
+    handler = logs._NonBlockingQueueHandler(queue.Queue(2))
+    logger = logging.Logger('test')
+    logger.addHandler(handler)
+
+    for i in range(5):
+        logger.warning('Record %s', i)
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+    # Messages are left to the listener to format
+    assert handler.queue.get().args == (0,)
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -7,7 +7,7 @@ from slack import WebClient
 from van.message_formatting import format_user, format_users
 from van.userstore import UserStore
 
-from tests.conftest import MOCK_USERS
+from tests.conftest import MOCK_USER_RECORDS
 
 
 class MessageFormattingTest(TestCase):
@@ -17,7 +17,7 @@ class MessageFormattingTest(TestCase):
     def setUp(self):
         self.mocked_client = MagicMock()
         self.users = UserStore(self.mocked_client)
-        self.users.users = {user['id']: user for user in MOCK_USERS}
+        self.users.users = {user.id: user for user in MOCK_USER_RECORDS}
 
     def test_format_user(self):
         """
@@ -0,0 +1,97 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from van.metrics import (
+    MetricsRegistry,
+    MetricsServer,
+)
+
+
+def test_counter():
+    registry = MetricsRegistry()
+    counter = registry.counter('errors_total', 'Errors', ('command',))
+    counter.inc('add')
+    counter.inc('add')
+    counter.inc('say "hi"')
+
+    assert registry.counter('errors_total', 'Errors', ('command',)) is counter
+    assert counter.get('add') == 2
+    assert registry.render() == (
+        '# HELP errors_total Errors\n'
+        '# TYPE errors_total counter\n'
+        'errors_total{command="add"} 2\n'
+        'errors_total{command="say \\"hi\\""} 1\n'
+    )
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('seconds', 'Seconds', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert histogram.get_count() == 4
+    assert registry.render() == (
+        '# HELP seconds Seconds\n'
+        '# TYPE seconds histogram\n'
+        'seconds_bucket{le="0.1"} 2\n'
+        'seconds_bucket{le="1"} 3\n'
+        'seconds_bucket{le="+Inf"} 4\n'
+        'seconds_sum 5.65\n'
+        'seconds_count 4\n'
+    )
+
+
+def test_time():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('seconds', 'Seconds', ('command',))
+    errors = registry.counter('errors_total', 'Errors', ('command',))
+
+    with histogram.time('add', errors=errors):
+        pass
+    with pytest.raises(ValueError):
+        with histogram.time('remove', errors=errors):
+            raise ValueError()
+
+    assert histogram.get_count('add') == 1
+    assert histogram.get_count('remove') == 1
+    assert errors.get('add') == 0
+    assert errors.get('remove') == 1
+
+
+def test_gauge():
+    registry = MetricsRegistry()
+    registry.gauge('depth', 'Depth', lambda: 3)
+    registry.gauge('broken', 'Broken', lambda: 1 / 0)
+
+    assert registry.render() == (
+        '# HELP depth Depth\n'
+        '# TYPE depth gauge\n'
+        'depth 3\n'
+        '# HELP broken Broken\n'
+        '# TYPE broken gauge\n'
+    )
+
+
+def test_server():
+    registry = MetricsRegistry()
+    registry.gauge('depth', 'Depth', lambda: 3)
+    server = MetricsServer(registry, port=0)
+    server.start()
+    try:
+        host, port = server.address
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert b'depth 3\n' in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'http://{host}:{port}/other')
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,174 @@
+import threading
+
+import mock
+import pytest
+
+from van.pipeline import MessagePipeline
+from van.reservation_namespaces import (
+    NamespaceScope,
+    ReservationNamespaces,
+)
+from van.responses import Response
+
+
+class RecordingProcessor:
+    """
+    Processor that echoes the message tokens back, optionally waiting on an event first.
+    """
+
+    def __init__(self):
+        self.handled = []
+        self.gates = {}
+        self.lock = threading.Lock()
+
+    def process_message_text(self, message_tokens, context_dict):
+        gate = self.gates.get(' '.join(message_tokens))
+        if gate:
+            assert gate.wait(timeout=5)
+        with self.lock:
+            self.handled.append((context_dict['channel'], ' '.join(message_tokens)))
+        return [Response.broadcast_response(' '.join(message_tokens))]
+
+
+def _context(channel, web_client):
+    return {'channel': channel, 'user_id': 'user_1', 'web_client': web_client}
+
+
+def _posted(web_client, channel):
+    return [
+        call[1]['text']
+        for call in web_client.chat_postMessage.call_args_list
+        if call[1]['channel'] == channel
+    ]
+
+
+def test_responses_posted():
+    processor = RecordingProcessor()
+    web_client = mock.MagicMock()
+    pipeline = MessagePipeline(processor)
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['status'], _context('C1', web_client))
+    pipeline.close()
+
+    assert _posted(web_client, 'C1') == ['add printer', 'status']
+
+
+def test_slow_message_does_not_hold_up_other_channels():
+    processor = RecordingProcessor()
+    gate = processor.gates['add printer'] = threading.Event()
+    web_client = mock.MagicMock()
+    pipeline = MessagePipeline(processor, workers=2)
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['status'], _context('C1', web_client))
+    pipeline.submit(['add', 'scanner'], _context('C2', web_client))
+
+    # C2 is handled while C1 is stuck on its first message
+    for _ in range(500):
+        if processor.handled:
+            break
+        threading.Event().wait(0.01)
+    assert processor.handled == [('C2', 'add scanner')]
+
+    gate.set()
+    pipeline.close()
+    assert _posted(web_client, 'C1') == ['add printer', 'status']
+    assert _posted(web_client, 'C2') == ['add scanner']
+
+
+def test_messages_about_a_resource_keep_their_order_across_channels():
+    processor = RecordingProcessor()
+    gate = processor.gates['add printer'] = threading.Event()
+    web_client = mock.MagicMock()
+    pipeline = MessagePipeline(processor, workers=4)
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['remove', 'printer'], _context('C2', web_client))
+    pipeline.submit(['add', 'scanner'], _context('C3', web_client))
+    for _ in range(500):
+        if processor.handled:
+            break
+        threading.Event().wait(0.01)
+
+    gate.set()
+    pipeline.close()
+    assert processor.handled == [('C3', 'add scanner'), ('C1', 'add printer'), ('C2', 'remove printer')]
+
+
+def test_messages_about_several_resources_wait_on_each():
+    processor = RecordingProcessor()
+    gate = processor.gates['add printer'] = threading.Event()
+    web_client = mock.MagicMock()
+    pipeline = MessagePipeline(processor, workers=4)
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['add', 'scanner;', 'remove', 'printer'], _context('C2', web_client))
+    pipeline.submit(['add', 'scanner'], _context('C3', web_client))
+    pipeline.submit(['add', 'plotter'], _context('C4', web_client))
+    for _ in range(500):
+        if processor.handled:
+            break
+        threading.Event().wait(0.01)
+
+    gate.set()
+    pipeline.close()
+    assert processor.handled == [
+        ('C4', 'add plotter'),
+        ('C1', 'add printer'),
+        ('C2', 'add scanner; remove printer'),
+        ('C3', 'add scanner'),
+    ]
+
+
+def test_namespaced_resources_do_not_wait_on_each_other():
+    processor = RecordingProcessor()
+    gate = processor.gates['add printer'] = threading.Event()
+    web_client = mock.MagicMock()
+    pipeline = MessagePipeline(processor, workers=4, namespaces=ReservationNamespaces(NamespaceScope.CHANNEL))
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['add', 'Printer'], _context('C2', web_client))
+    for _ in range(500):
+        if processor.handled:
+            break
+        threading.Event().wait(0.01)
+    assert processor.handled == [('C2', 'add Printer')]
+
+    gate.set()
+    pipeline.close()
+
+
+def test_failing_message_does_not_stop_pipeline():
+    processor = mock.MagicMock()
+    processor.process_message_text.side_effect = [Exception('ha ha ha'), [Response.broadcast_response('ok')]]
+    web_client = mock.MagicMock()
+    pipeline = MessagePipeline(processor)
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.close()
+
+    assert _posted(web_client, 'C1') == ['ok']
+
+
+def test_failing_post_does_not_stop_pipeline():
+    processor = RecordingProcessor()
+    web_client = mock.MagicMock()
+    web_client.chat_postMessage.side_effect = [Exception('ha ha ha'), None]
+    pipeline = MessagePipeline(processor)
+
+    pipeline.submit(['add', 'printer'], _context('C1', web_client))
+    pipeline.submit(['add', 'scanner'], _context('C1', web_client))
+    pipeline.close()
+
+    assert _posted(web_client, 'C1') == ['add printer', 'add scanner']
+
+
+def test_workers_required():
+    with pytest.raises(ValueError):
+        MessagePipeline(RecordingProcessor(), workers=0)
+
+
+if __name__ == '__main__':
+    pytest.main()
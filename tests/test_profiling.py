@@ -0,0 +1,95 @@
+import os
+import signal
+import threading
+
+import pytest
+
+from van.profiling import (
+    Profiler,
+    install_signal_handlers,
+)
+
+
+def _work(n):
+    return sum(range(n))
+
+
+def test_not_profiling(tmp_path):
+    profiler = Profiler(str(tmp_path))
+
+    assert profiler.run('work', _work, 10) == 45
+    assert profiler.stop() == []
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_profile(tmp_path):
+    profiler = Profiler(str(tmp_path / 'profiles'))
+    assert profiler.start(60)
+    assert not profiler.start(60)
+
+    assert profiler.run('work', _work, 10) == 45
+    thread = threading.Thread(target=profiler.run, args=('work', _work, 1000))
+    thread.start()
+    thread.join()
+    paths = profiler.stop()
+
+    assert not profiler.active
+    assert [os.path.splitext(path)[1] for path in paths] == ['.pstats', '.txt']
+    report = open(paths[1]).read()
+    assert 'calls: work 2' in report
+    assert '_work' in report
+
+
+def test_sampling(tmp_path):
+    profiler = Profiler(str(tmp_path), sample_every=3)
+    profiler.start(60)
+    for _ in range(7):
+        profiler.run('work', _work, 10)
+    profile = profiler._local.profile
+    paths = profiler.stop()
+
+    assert 'calls: work 7' in open(paths[1]).read()
+    # Only the 1st, 4th and 7th calls were profiled
+    assert [stat.callcount for stat in profile.getstats() if getattr(stat.code, 'co_name', '') == '_work'] == [3]
+
+
+def test_memory(tmp_path):
+    profiler = Profiler(str(tmp_path), top_n=5)
+    profiler.start(60, memory=True)
+    held = profiler.run('allocate', lambda: [bytearray(1024) for _ in range(100)])
+    paths = profiler.stop()
+
+    assert len(held) == 100
+    assert os.path.basename(paths[-1]).startswith('memory-')
+    assert 'test_profiling.py' in open(paths[-1]).read()
+
+
+def test_stops_when_time_is_up(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.start(0.01)
+    profiler._timer.join(timeout=5)
+
+    assert not profiler.active
+    assert any(name.endswith('.txt') for name in os.listdir(str(tmp_path)))
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='no SIGUSR1 on this platform')
+def test_signal(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    previous = {signum: signal.getsignal(signum) for signum in (signal.SIGUSR1, signal.SIGUSR2)}
+    try:
+        assert install_signal_handlers(profiler, seconds=60)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        for _ in range(500):
+            if profiler.active:
+                break
+            threading.Event().wait(0.01)
+        assert profiler.active
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        profiler.stop()
+
+
+if __name__ == '__main__':
+    pytest.main()
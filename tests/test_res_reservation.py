@@ -1,6 +1,15 @@
+import random
+import threading
+
+import mock
 import pytest
 
-from van.res_reservation import ResourceReservationProcessor
+from van.res_reservation import (
+    ReservationLimitError,
+    ResourceReservation,
+    ResourceReservationProcessor,
+)
+from van.reservation_journal import ReservationJournal
 
 
 def test_hello(reservation_processor: ResourceReservationProcessor):
@@ -28,6 +37,70 @@ def test_status(reservation_processor: ResourceReservationProcessor):
     assert response[1].message == '*printer2*: Real User 1'
 
 
+def test_status_filter(reservation_processor: ResourceReservationProcessor):
+    reservation_processor.reservations.queue('scanner', 'user_2')
+    context = {'user_id': 'user_3'}
+
+    responses = reservation_processor.status(['printer'], context)
+    assert [response.message for response in responses] == ['*printer*: Real User 1, Real User 2']
+
+    responses = reservation_processor.status(['print*'], context)
+    assert [response.message for response in responses] == [
+        '*printer*: Real User 1, Real User 2',
+        '*printer2*: Real User 1',
+    ]
+
+    responses = reservation_processor.status(['scanner', 'printer2'], context)
+    assert [response.message for response in responses] == ['*printer2*: Real User 1', '*scanner*: Real User 2']
+
+    responses = reservation_processor.status(['fax*'], context)
+    assert [response.message for response in responses] == ['No resources match fax*']
+
+
+def test_status_reuses_unchanged_lines(reservation_processor: ResourceReservationProcessor):
+    context = {'user_id': 'user_3'}
+    reservation_processor.status([], context)
+
+    with mock.patch.object(
+        reservation_processor, '_user_name_for_id', wraps=reservation_processor._user_name_for_id
+    ) as user_name_for_id:
+        reservation_processor.status([], context)
+        assert user_name_for_id.call_count == 0
+
+        reservation_processor.reservations.queue('printer2', 'user_3')
+        responses = reservation_processor.status([], context)
+        assert [call.args[0] for call in user_name_for_id.call_args_list] == ['user_1', 'user_3']
+    assert responses[1].message == '*printer2*: Real User 1, Real User 3'
+
+    reservation_processor.user_store.update_user({'id': 'user_2', 'name': 'User 2', 'real_name': 'Renamed'})
+    responses = reservation_processor.status([], context)
+    assert responses[0].message == '*printer*: Real User 1, Renamed'
+
+
+def test_status_rendered_concurrently(reservation_processor: ResourceReservationProcessor):
+    reservations = reservation_processor.reservations
+    errors = []
+
+    def churn(seed):
+        try:
+            for i in range(200):
+                resource = f'resource-{seed}-{i % 20}'
+                reservations.queue(resource, 'user_1')
+                reservation_processor._status_text()
+                reservations.remove_all(resource)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=churn, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert reservation_processor._status_text() == '*printer*: Real User 1, Real User 2\n*printer2*: Real User 1'
+
+
 def test_remove_head(reservation_processor: ResourceReservationProcessor):
     queue_for_printer = reservation_processor.reservations.resources['printer']
     assert len(queue_for_printer) == 2
@@ -67,8 +140,219 @@ def test_remove_all(reservation_processor: ResourceReservationProcessor):
 
     assert reservation_processor.remove_all(['printer2'], {'user_id': 'user_3', 'web_client': object()})
 
-    queue_for_printer_2 = reservation_processor.reservations.resources['printer2']
-    assert len(queue_for_printer_2) == 0
+    assert 'printer2' not in reservation_processor.reservations.resources
+    assert reservation_processor.reservations.get_queue_len('printer2') == 0
+
+
+def test_add_several(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.add(['scanner', 'printer', 'plotter', 'scanner'], {'user_id': 'user_3'})
+
+    assert [response.message for response in responses] == [
+        'Real User 3 queued for resources *scanner*, *printer*, *plotter*',
+        '<@user_3> : you are up for *scanner* ',
+        '<@user_3> : you are up for *plotter* ',
+    ]
+    assert reservation_processor.reservations.get_user_resources('user_3') == ['scanner', 'printer', 'plotter']
+
+
+def test_remove_several(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.remove(['printer', 'scanner', 'printer2'], {'user_id': 'user_1'})
+
+    assert [response.message for response in responses] == [
+        'Real User 1 removed from resources *printer*, *printer2*',
+        '<@user_2> : you are up for *printer* ',
+    ]
+
+
+def test_remove_all_several(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.remove_all(['printer', 'printer2'], {'user_id': 'user_3'})
+
+    assert [response.message for response in responses] == [
+        'Real User 3 removed *everyone* from resources *printer*, *printer2*',
+    ]
+    assert reservation_processor.reservations.get_resources() == {}
+
+
+def test_command_sequence(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.process_message_text(
+        ['remove', 'printer;', 'add', 'scanner', ';mine;;', 'bogus'], {'user_id': 'user_1'}
+    )
+
+    assert [response.message for response in responses] == [
+        'Real User 1 removed from resource *printer*',
+        '<@user_2> : you are up for *printer* ',
+        'Real User 1 queued for resource *scanner*',
+        '<@user_1> : you are up for *scanner* ',
+        'Real User 1 is queued for *printer2* (up now), *scanner* (up now)',
+    ]
+
+
+def test_too_many_commands(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.process_message_text(['mine;'] * 11, {'user_id': 'user_1'})
+
+    assert [response.message for response in responses] == ['Too many commands in one message (the limit is 10)']
+
+
+def test_command_sequence_runs_as_a_batch(reservation_processor: ResourceReservationProcessor):
+    reservations = reservation_processor.reservations
+    other_thread_done = threading.Event()
+
+    def add_from_another_thread(params, context_dict):
+        threading.Thread(target=lambda: (reservations.queue('scanner', 'user_2'), other_thread_done.set())).start()
+        # The other thread can't get in until the batch is done
+        assert not other_thread_done.wait(timeout=0.2)
+        return lambda: []
+
+    reservation_processor.command_handlers['wait'] = reservation_processor.command_handlers['add']._replace(
+        apply=add_from_another_thread
+    )
+    reservation_processor.process_message_text(['add', 'scanner;', 'wait'], {'user_id': 'user_1'})
+
+    assert other_thread_done.wait(timeout=5)
+    assert list(reservations.resources['scanner']) == ['user_1', 'user_2']
+
+
+def test_command_sequence_looks_up_users_outside_the_batch(reservation_processor: ResourceReservationProcessor):
+    reservations = reservation_processor.reservations
+    batch_held = []
+
+    def try_lock():
+        lock = reservations._lock_for('a')
+        acquired = lock.acquire(blocking=False)
+        if acquired:
+            lock.release()
+        batch_held.append(not acquired)
+
+    def user_name_for_id(user_id):
+        # Users are looked up once the batch is done, so other threads can make changes meanwhile
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return user_id
+
+    context = {'user_id': 'user_1'}
+    with mock.patch.object(reservation_processor, '_user_name_for_id', side_effect=user_name_for_id):
+        with mock.patch.object(reservations, 'batch', wraps=reservations.batch) as batch:
+            responses = reservation_processor.process_message_text(['add', 'a', 'b;', 'status'], context)
+            assert batch.call_count == 1
+
+            # Commands that change several resources are batched even on their own
+            reservation_processor.process_message_text(['remove-me'], context)
+            assert batch.call_count == 2
+
+    assert [response.message for response in responses][:3] == [
+        'user_1 queued for resources *a*, *b*',
+        '<@user_1> : you are up for *a* ',
+        '<@user_1> : you are up for *b* ',
+    ]
+    assert batch_held and not any(batch_held)
+
+
+def test_command_sequence_reads_in_order(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.process_message_text(
+        ['status;', 'add', 'z;', 'position', 'z;', 'status', 'z'], {'user_id': 'user_1'}
+    )
+
+    assert [response.message for response in responses] == [
+        '*printer*: Real User 1, Real User 2',
+        '*printer2*: Real User 1',
+        'Real User 1 queued for resource *z*',
+        '<@user_1> : you are up for *z* ',
+        'Real User 1 is up now for resource *z*',
+        '*z*: Real User 1',
+    ]
+
+
+def test_profile(user_store):
+    profiler = mock.MagicMock()
+    profiler.directory = '/tmp/profiles'
+    processor = ResourceReservationProcessor(user_store, profiler=profiler, admin_user_ids=['user_1'])
+
+    responses = processor.process_message_text(['profile', '60', 'memory'], {'user_id': 'user_1'})
+
+    assert responses[0].message == (
+        'Profiling for 60 seconds with memory tracing; results will be written to /tmp/profiles'
+    )
+    profiler.start.assert_called_once_with(60, memory=True)
+
+    profiler.start.return_value = False
+    responses = processor.process_message_text(['profile'], {'user_id': 'user_1'})
+    assert responses[0].message == 'Already profiling'
+
+    profiler.stop.return_value = ['/tmp/profiles/profile-1.pstats', '/tmp/profiles/profile-1.txt']
+    responses = processor.process_message_text(['profile', 'stop'], {'user_id': 'user_1'})
+    assert responses[0].message == (
+        'Profiling stopped; results written to /tmp/profiles/profile-1.pstats, /tmp/profiles/profile-1.txt'
+    )
+
+
+def test_profile_admins_only(user_store):
+    profiler = mock.MagicMock()
+    processor = ResourceReservationProcessor(user_store, profiler=profiler, admin_user_ids=['user_1'])
+
+    responses = processor.process_message_text(['profile'], {'user_id': 'user_2'})
+
+    assert responses[0].message == 'Only admins can profile the bot'
+    profiler.start.assert_not_called()
+
+
+def test_profile_needs_admins(reservation_processor: ResourceReservationProcessor):
+    assert reservation_processor.process_message_text(['profile'], {'user_id': 'user_1'}) == []
+    assert 'profile' not in reservation_processor.help([], {})[0].message
+
+
+def test_empty_queues_are_dropped(resource_reservation: ResourceReservation):
+    assert not resource_reservation.remove('scanner', 'user_1')
+    assert not resource_reservation.remove_all('scanner')
+    assert resource_reservation.get_user_id_at_front('scanner') is None
+    assert resource_reservation.get_position('scanner', 'user_1') is None
+    assert 'scanner' not in resource_reservation.get_resources()
+
+    assert resource_reservation.remove('printer2', 'user_1')
+    assert list(resource_reservation.get_resources()) == ['printer']
+
+
+def test_resource_names_normalized(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.add([' Printer '], {'user_id': 'user_3'})
+    assert responses[0].message == 'Real User 3 queued for resource *printer*'
+    assert list(reservation_processor.reservations.resources['printer']) == ['user_1', 'user_2', 'user_3']
+
+    responses = reservation_processor.status(['PRINT*'], {'user_id': 'user_3'})
+    assert len(responses) == 2
+
+    assert reservation_processor.remove(['PRINTER2'], {'user_id': 'user_1'})
+    assert list(reservation_processor.reservations.get_resources()) == ['printer']
+
+
+def test_resource_limit(user_store):
+    processor = ResourceReservationProcessor(user_store, ResourceReservation(max_resources=1))
+    processor.add(['printer'], {'user_id': 'user_1'})
+
+    responses = processor.add(['scanner'], {'user_id': 'user_1'})
+    assert [response.message for response in responses] == [
+        'Cannot reserve *scanner*: the limit of 1 resources is reached'
+    ]
+    # Queuing for a resource that already exists is still allowed
+    assert processor.add(['printer'], {'user_id': 'user_2'})
+
+    processor.remove(['printer'], {'user_id': 'user_1'})
+    processor.remove(['printer'], {'user_id': 'user_2'})
+    assert processor.add(['scanner'], {'user_id': 'user_1'})
+
+
+def test_queue_length_limit(user_store):
+    processor = ResourceReservationProcessor(user_store, ResourceReservation(max_queue_len=2))
+    processor.add(['printer'], {'user_id': 'user_1'})
+    processor.add(['printer'], {'user_id': 'user_2'})
+
+    responses = processor.add(['printer'], {'user_id': 'user_3'})
+    assert [response.message for response in responses] == [
+        'Cannot queue for *printer*: the limit of 2 users in a queue is reached'
+    ]
+    # Already queued users are not turned away
+    assert processor.add(['printer'], {'user_id': 'user_2'}) == []
+    with pytest.raises(ReservationLimitError):
+        processor.reservations.queue('printer', 'user_3', to_front=True)
 
 
 def test_help(reservation_processor: ResourceReservationProcessor):
@@ -84,6 +368,8 @@ def test_get_handler_method(reservation_processor: ResourceReservationProcessor)
     assert reservation_processor._get_handler_method('remove') == reservation_processor.remove
     assert reservation_processor._get_handler_method('remove-all') == reservation_processor.remove_all
     assert reservation_processor._get_handler_method('help') == reservation_processor.help
+    assert reservation_processor._get_handler_method('mine') == reservation_processor.mine
+    assert reservation_processor._get_handler_method('remove-me') == reservation_processor.remove_me
 
 
 def test_process_message_text(reservation_processor: ResourceReservationProcessor):
@@ -97,5 +383,176 @@ def test_process_message_text(reservation_processor: ResourceReservationProcesso
     assert response[0].message == 'Real User 1 queued for resource *scanner*'
 
 
+def test_mine(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.mine([], {'user_id': 'user_1'})
+    assert responses[0].message == 'Real User 1 is queued for *printer* (up now), *printer2* (up now)'
+
+    responses = reservation_processor.mine([], {'user_id': 'user_2'})
+    assert responses[0].message == 'Real User 2 is queued for *printer*'
+
+    responses = reservation_processor.mine([], {'user_id': 'user_3'})
+    assert responses[0].message == 'Real User 3 is not queued for any resource'
+
+
+def test_remove_me(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.remove_me([], {'user_id': 'user_1'})
+
+    assert [response.message for response in responses] == [
+        'Real User 1 removed from resources *printer*, *printer2*',
+        '<@user_2> : you are up for *printer* ',
+    ]
+    assert list(reservation_processor.reservations.resources['printer']) == ['user_2']
+    assert 'printer2' not in reservation_processor.reservations.resources
+    assert reservation_processor.reservations.get_user_resources('user_1') == []
+
+    assert reservation_processor.remove_me([], {'user_id': 'user_1'}) == []
+
+
+def test_position(reservation_processor: ResourceReservationProcessor):
+    responses = reservation_processor.position(['printer'], {'user_id': 'user_1'})
+    assert responses[0].message == 'Real User 1 is up now for resource *printer*'
+
+    responses = reservation_processor.position(['printer'], {'user_id': 'user_2'})
+    assert responses[0].message == 'Real User 2 is 2nd in line for resource *printer* (no wait estimate yet)'
+
+    responses = reservation_processor.position(['printer'], {'user_id': 'user_3'})
+    assert responses[0].message == 'Real User 3 is not queued for resource *printer*'
+
+    assert reservation_processor.position([], {'user_id': 'user_1'}) == []
+
+
+def test_position_expected_wait(resource_reservation: ResourceReservation, user_store):
+    processor = ResourceReservationProcessor(user_store, resource_reservation)
+    with mock.patch('van.res_reservation.time') as mock_time:
+        mock_time.monotonic.return_value = 1000.0
+        for user_id in ['user_1', 'user_2', 'user_3']:
+            resource_reservation.queue('scanner', user_id)
+        mock_time.monotonic.return_value = 1600.0
+        resource_reservation.remove('scanner', 'user_1')
+        mock_time.monotonic.return_value = 1900.0
+
+        assert resource_reservation.hold_times['scanner'] == 600.0
+        assert resource_reservation.get_expected_wait('scanner', 'user_2') == 0.0
+        assert resource_reservation.get_expected_wait('scanner', 'user_3') == 300.0
+
+        responses = processor.position(['scanner'], {'user_id': 'user_3'})
+    assert responses[0].message == 'Real User 3 is 2nd in line for resource *scanner* (expected wait about 5 minutes)'
+
+
+def _check_user_index(reservation: ResourceReservation):
+    expected = {}
+    for resource, queue in reservation.get_resources().items():
+        for user_id in queue:
+            expected.setdefault(user_id, set()).add(resource)
+    assert {
+        user_id: set(reservation.get_user_resources(user_id))
+        for user_id in reservation.user_resources
+    } == expected
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_user_index_consistent(seed):
+    rng = random.Random(seed)
+    reservation = ResourceReservation()
+    resources = [f'resource-{i}' for i in range(5)]
+    user_ids = [f'user_{i}' for i in range(5)]
+
+    for _ in range(200):
+        op = rng.random()
+        if op < 0.5:
+            reservation.queue(rng.choice(resources), rng.choice(user_ids), to_front=rng.random() < 0.2)
+        elif op < 0.8:
+            reservation.remove(rng.choice(resources), rng.choice(user_ids))
+        elif op < 0.9:
+            reservation.remove_all(rng.choice(resources))
+        else:
+            reservation.remove_user(rng.choice(user_ids))
+        _check_user_index(reservation)
+
+
+def test_resources_snapshot(resource_reservation: ResourceReservation):
+    snapshot = resource_reservation.get_resources()
+    assert resource_reservation.get_resources() is snapshot
+
+    resource_reservation.queue('printer', 'user_3')
+    resource_reservation.remove_all('printer2')
+
+    assert {resource: list(queue) for resource, queue in snapshot.items()} == {
+        'printer': ['user_1', 'user_2'],
+        'printer2': ['user_1'],
+    }
+    assert {resource: list(queue) for resource, queue in resource_reservation.get_resources().items()} == {
+        'printer': ['user_1', 'user_2', 'user_3'],
+    }
+    with pytest.raises(TypeError):
+        snapshot['scanner'] = ()
+
+
+def test_concurrent_changes(tmp_path):
+    journal = ReservationJournal(str(tmp_path), compact_every=500)
+    reservation = ResourceReservation(journal=journal, lock_shards=4)
+    resources = [f'resource-{i}' for i in range(8)]
+    user_ids = [f'user_{i}' for i in range(20)]
+    errors = []
+
+    def make_changes(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(2000):
+                op = rng.random()
+                if op < 0.5:
+                    reservation.queue(rng.choice(resources), rng.choice(user_ids), to_front=rng.random() < 0.2)
+                elif op < 0.8:
+                    reservation.remove(rng.choice(resources), rng.choice(user_ids))
+                elif op < 0.85:
+                    reservation.remove_all(rng.choice(resources))
+                elif op < 0.9:
+                    reservation.remove_user(rng.choice(user_ids))
+                else:
+                    for queue in reservation.get_resources().values():
+                        assert len(set(queue)) == len(queue) > 0
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=make_changes, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    assert errors == []
+    _check_user_index(reservation)
+    queues = {resource: list(queue) for resource, queue in reservation.resources.items()}
+    assert {resource: list(queue) for resource, queue in reservation.get_resources().items()} == queues
+    assert list(reservation.get_resources()) == list(queues)
+    restored = ResourceReservation(journal=ReservationJournal(str(tmp_path)))
+    assert {resource: list(queue) for resource, queue in restored.get_resources().items()} == queues
+
+
+def test_board(resource_reservation, user_store):
+    processor = ResourceReservationProcessor(user_store, reservations=resource_reservation, status_board_debounce=60)
+    web_client = mock.MagicMock()
+    context = {'channel': 'C1', 'user_id': 'user_3', 'web_client': web_client}
+
+    assert processor._get_handler_method('board') == processor.board
+    assert processor.process_message_text(['board'], context) == []
+    web_client.chat_postMessage.assert_called_once_with(
+        channel='C1', text='*printer*: Real User 1, Real User 2\n*printer2*: Real User 1'
+    )
+
+    processor.add(['printer2'], context)
+    assert processor.status_board._timer is not None
+    processor.status_board._timer.cancel()
+
+    responses = processor.process_message_text(['board', 'off'], context)
+    assert responses[0].message == 'Status board stopped'
+    assert not processor.status_board.has_board('C1')
+
+
+def test_board_disabled(reservation_processor: ResourceReservationProcessor):
+    assert reservation_processor._get_handler_method('board') is None
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+
+import pytest
+
+from van.res_reservation import ResourceReservation
+from van.reservation_journal import (
+    QUEUE,
+    ReservationJournal,
+)
+
+
+def _queues(reservation):
+    return {resource: list(queue) for resource, queue in reservation.get_resources().items() if queue}
+
+
+def _wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _make_changes(reservation):
+    reservation.queue('printer', 'user_1')
+    reservation.queue('printer', 'user_2')
+    reservation.queue('printer', 'user_3', to_front=True)
+    reservation.queue('scanner', 'user_1')
+    reservation.queue('plotter', 'user_2')
+    reservation.remove('printer', 'user_1')
+    reservation.remove_all('scanner')
+
+
+def test_replay(tmp_path):
+    journal = ReservationJournal(str(tmp_path))
+    reservation = ResourceReservation(journal=journal)
+    _make_changes(reservation)
+    journal.close()
+
+    restored = ResourceReservation(journal=ReservationJournal(str(tmp_path)))
+    assert _queues(restored) == {'printer': ['user_3', 'user_2'], 'plotter': ['user_2']}
+
+
+def test_replay_ignores_limits(tmp_path):
+    journal = ReservationJournal(str(tmp_path))
+    reservation = ResourceReservation(journal=journal)
+    _make_changes(reservation)
+    journal.close()
+
+    restored = ResourceReservation(journal=ReservationJournal(str(tmp_path)), max_resources=1, max_queue_len=1)
+    assert _queues(restored) == {'printer': ['user_3', 'user_2'], 'plotter': ['user_2']}
+
+
+def test_replay_empty(tmp_path):
+    assert _queues(ResourceReservation(journal=ReservationJournal(str(tmp_path)))) == {}
+
+
+def test_compaction(tmp_path):
+    journal = ReservationJournal(str(tmp_path), compact_every=3)
+    reservation = ResourceReservation(journal=journal)
+    _make_changes(reservation)
+    journal.close()
+
+    with open(journal.journal_path) as journal_file:
+        assert len(journal_file.readlines()) == 1
+    with open(journal.snapshot_path) as snapshot_file:
+        assert json.load(snapshot_file)['seq'] == 6
+
+    restored = ResourceReservation(journal=ReservationJournal(str(tmp_path)))
+    assert _queues(restored) == {'printer': ['user_3', 'user_2'], 'plotter': ['user_2']}
+
+
+def test_records_in_snapshot_are_skipped(tmp_path):
+    journal = ReservationJournal(str(tmp_path))
+    reservation = ResourceReservation(journal=journal)
+    _make_changes(reservation)
+    with open(journal.journal_path, 'rb') as journal_file:
+        records = journal_file.read()
+
+    # Simulate a crash after the snapshot was written but before the journal was emptied
+    journal.compact(reservation.get_resources())
+    reservation.queue('printer', 'user_4')
+    journal.close()
+    with open(journal.journal_path, 'rb') as journal_file:
+        records += journal_file.read()
+    with open(journal.journal_path, 'wb') as journal_file:
+        journal_file.write(records)
+
+    restored = ResourceReservation(journal=ReservationJournal(str(tmp_path)))
+    assert _queues(restored) == {'printer': ['user_3', 'user_2', 'user_4'], 'plotter': ['user_2']}
+
+
+def test_incomplete_record_is_dropped(tmp_path):
+    journal = ReservationJournal(str(tmp_path))
+    reservation = ResourceReservation(journal=journal)
+    reservation.queue('printer', 'user_1')
+    journal.close()
+    with open(journal.journal_path, 'ab') as journal_file:
+        journal_file.write(b'[2,"q","prin')
+
+    journal = ReservationJournal(str(tmp_path))
+    restored = ResourceReservation(journal=journal)
+    restored.queue('printer', 'user_2')
+    journal.close()
+
+    restored = ResourceReservation(journal=ReservationJournal(str(tmp_path)))
+    assert _queues(restored) == {'printer': ['user_1', 'user_2']}
+
+
+def test_unchanged_reservations_not_recorded(tmp_path):
+    journal = ReservationJournal(str(tmp_path))
+    reservation = ResourceReservation(journal=journal)
+    reservation.queue('printer', 'user_1')
+    reservation.queue('printer', 'user_1')
+    reservation.remove('printer', 'user_2')
+    journal.close()
+
+    with open(journal.journal_path) as journal_file:
+        assert len(journal_file.readlines()) == 1
+
+
+def test_journals_synced_by_one_thread(tmp_path):
+    journals = [ReservationJournal(str(tmp_path / str(i)), sync_interval=0.05) for i in range(20)]
+    for journal in journals:
+        journal.replay(ResourceReservation())
+        # The first change is synced right away, the second left to the sync thread
+        journal.append(QUEUE, 'printer', 'user_1', 0)
+        journal.append(QUEUE, 'printer', 'user_2', 0)
+    assert all(journal._dirty for journal in journals)
+
+    assert _wait_for(lambda: not any(journal._dirty for journal in journals))
+    assert [thread.name for thread in threading.enumerate()].count('ReservationJournal-sync') == 1
+    for journal in journals:
+        journal.close()
+
+
+def test_directory_required():
+    with pytest.raises(ValueError):
+        ReservationJournal('')
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,96 @@
+import threading
+
+import mock
+import pytest
+
+from van.res_reservation import ResourceReservationProcessor
+from van.reservation_namespaces import (
+    NamespaceScope,
+    ReservationNamespaces,
+)
+
+
+def _context(channel, team='T1', user_id='user_1'):
+    return {'channel': channel, 'team': team, 'user_id': user_id, 'web_client': object()}
+
+
+def test_namespace_per_channel():
+    namespaces = ReservationNamespaces()
+
+    assert namespaces.key_for(_context('C1')) == 'C1'
+    assert namespaces.for_context(_context('C1')) is namespaces.get('C1')
+    assert namespaces.for_context(_context('C1')) is not namespaces.for_context(_context('C2'))
+
+
+def test_namespace_per_workspace():
+    namespaces = ReservationNamespaces(NamespaceScope.WORKSPACE)
+
+    assert namespaces.key_for(_context('C1', team='T1')) == 'T1'
+    assert namespaces.for_context(_context('C1')) is namespaces.for_context(_context('C2'))
+    assert namespaces.for_context(_context('C1', team='T1')) is not namespaces.for_context(_context('C1', team='T2'))
+
+
+def test_namespace_created_once():
+    created = []
+
+    def factory(key):
+        created.append(key)
+        return object()
+
+    namespaces = ReservationNamespaces(factory=factory)
+    threads = [threading.Thread(target=namespaces.get, args=('C1',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created == ['C1']
+
+
+def test_processor_keeps_namespaces_apart(user_store):
+    processor = ResourceReservationProcessor(user_store, namespaces=ReservationNamespaces())
+
+    processor.add(['printer'], _context('C1'))
+    processor.add(['printer'], _context('C2', user_id='user_2'))
+    processor.add(['scanner'], _context('C2', user_id='user_2'))
+
+    assert [response.message for response in processor.status([], _context('C1'))] == ['*printer*: Real User 1']
+    assert [response.message for response in processor.status([], _context('C2'))] == [
+        '*printer*: Real User 2',
+        '*scanner*: Real User 2',
+    ]
+    responses = processor.mine([], _context('C2', user_id='user_1'))
+    assert responses[0].message == 'Real User 1 is not queued for any resource'
+
+    responses = processor.remove(['printer'], _context('C1'))
+    assert [response.message for response in responses] == ['Real User 1 removed from resource *printer*']
+    assert processor.status([], _context('C1')) == []
+    assert len(processor.status([], _context('C2'))) == 2
+
+
+def test_status_board_per_namespace(user_store):
+    processor = ResourceReservationProcessor(user_store, status_board_debounce=60, namespaces=ReservationNamespaces())
+    processor.add(['printer'], _context('C1'))
+    web_client = mock.MagicMock()
+    context = dict(_context('C1'), web_client=web_client)
+
+    processor.board([], context)
+    web_client.chat_postMessage.assert_called_once_with(channel='C1', text='*printer*: Real User 1')
+
+    # Changes in another namespace don't touch this channel's board
+    processor.add(['scanner'], _context('C2'))
+    board = processor._status_board_for(context)
+    assert board is not processor._status_board_for(_context('C2'))
+    assert board._timer is None
+
+    processor.add(['scanner'], context)
+    assert board._timer is not None
+    board._timer.cancel()
+
+    # No reservations or board are kept outside the namespaces
+    assert processor.reservations is None
+    assert processor.status_board is None
+
+
+if __name__ == '__main__':
+    pytest.main()
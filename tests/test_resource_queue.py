@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from van.resource_queue import ResourceQueue
+
+
+def test_queue_order():
+    queue = ResourceQueue(['user_1', 'user_2'])
+    assert queue.appendleft('user_3')
+    assert queue.append('user_4')
+    assert not queue.append('user_1')
+    assert not queue.appendleft('user_4')
+
+    assert list(queue) == ['user_3', 'user_1', 'user_2', 'user_4']
+    assert queue.first() == 'user_3'
+    assert len(queue) == 4
+    assert 'user_2' in queue
+
+
+def test_position():
+    queue = ResourceQueue(['user_1', 'user_2', 'user_3'])
+    queue.appendleft('user_4')
+    queue.appendleft('user_5')
+
+    assert [queue.position(user_id) for user_id in queue] == [0, 1, 2, 3, 4]
+    assert queue.position('nobody') is None
+
+    assert queue.remove('user_4')
+    assert not queue.remove('user_4')
+    assert [queue.position(user_id) for user_id in ['user_5', 'user_1', 'user_2', 'user_3']] == [0, 1, 2, 3]
+
+
+def test_version_changes_with_users():
+    queue = ResourceQueue(['user_1'])
+    version = queue.version
+
+    queue.append('user_1')
+    queue.remove('user_2')
+    assert queue.version == version
+
+    queue.append('user_2')
+    assert queue.version != version
+    version = queue.version
+    queue.remove('user_1')
+    assert queue.version != version
+
+    assert ResourceQueue().version != ResourceQueue().version
+
+
+def test_empty_queue():
+    queue = ResourceQueue()
+
+    assert queue.first() is None
+    assert not queue
+    assert list(queue) == []
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_matches_list(seed):
+    rng = random.Random(seed)
+    queue = ResourceQueue()
+    expected = []
+
+    # Enough operations to renumber the queue a few times
+    for _ in range(2000):
+        user_id = f'user_{rng.randrange(30)}'
+        op = rng.random()
+        if op < 0.35:
+            if user_id not in expected:
+                expected.append(user_id)
+            queue.append(user_id)
+        elif op < 0.5:
+            if user_id not in expected:
+                expected.insert(0, user_id)
+            queue.appendleft(user_id)
+        else:
+            if user_id in expected:
+                expected.remove(user_id)
+            queue.remove(user_id)
+
+        assert list(queue) == expected
+        assert queue.first() == (expected[0] if expected else None)
+        for position, queued_user_id in enumerate(expected):
+            assert queue.position(queued_user_id) == position
+    assert len(queue._front) + len(queue._back) <= 2 * len(queue) + 64
+
+
+if __name__ == '__main__':
+    pytest.main()
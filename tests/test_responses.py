@@ -4,6 +4,7 @@ from van.responses import (
     Distribution,
     Responder,
     Response,
+    coalesce_messages,
 )
 
 
@@ -23,3 +24,49 @@ def test_direct_response(mocked_broadcast):
     responder.respond(response)
 
     mocked_broadcast.assert_not_called()
+
+
+def test_coalesce_messages():
+    assert coalesce_messages(['a', 'b', 'c']) == ['a\nb\nc']
+    assert coalesce_messages([]) == []
+
+
+def test_coalesce_messages_splits_at_max_length():
+    assert coalesce_messages(['aaa', 'bbb', 'ccc', 'd'], max_length=7) == ['aaa\nbbb', 'ccc\nd']
+
+
+def test_coalesce_messages_splits_long_message():
+    assert coalesce_messages(['a', 'bbb\nccc\ndd', 'e'], max_length=7) == ['a', 'bbb\nccc', 'dd\ne']
+    assert coalesce_messages(['aaaaaaaaaa'], max_length=4) == ['aaaa', 'aaaa', 'aa']
+
+
+def test_respond_all_coalesces_broadcasts():
+    web_client = mock.MagicMock()
+    responder = Responder('channel', web_client)
+    responder.respond_all([
+        Response.broadcast_response('*printer*: Real User 1'),
+        Response.broadcast_response('*scanner*: Real User 2'),
+    ])
+
+    web_client.chat_postMessage.assert_called_once_with(
+        channel='channel', text='*printer*: Real User 1\n*scanner*: Real User 2'
+    )
+
+
+@mock.patch.object(Responder, 'respond')
+@mock.patch.object(Responder, '_broadcast')
+def test_respond_all_keeps_order(mocked_broadcast, mocked_respond):
+    calls = []
+    mocked_broadcast.side_effect = lambda message: calls.append(message)
+    mocked_respond.side_effect = lambda response: calls.append(response)
+    direct = Response('direct', Distribution.DIRECT)
+
+    responder = Responder('channel', mock.MagicMock)
+    responder.respond_all([
+        Response.broadcast_response('a'),
+        Response.broadcast_response('b'),
+        direct,
+        Response.broadcast_response('c'),
+    ])
+
+    assert calls == ['a\nb', direct, 'c']
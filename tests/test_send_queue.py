@@ -0,0 +1,159 @@
+import time
+
+import mock
+import pytest
+
+from benchmarks.fakes import FakeWebClient
+from van.profiling import Profiler
+from van.responses import (
+    Responder,
+    Response,
+)
+from van.send_queue import (
+    OverflowPolicy,
+    SendQueue,
+)
+
+
+def test_posts_in_order():
+    web_client = FakeWebClient()
+    send_queue = SendQueue(rate=1000, burst=10)
+    for i in range(5):
+        assert send_queue.put('C1', web_client, f'message {i}')
+        send_queue.put('C2', web_client, f'other {i}')
+    send_queue.close()
+
+    assert web_client.posts['C1'] == [f'message {i}' for i in range(5)]
+    assert web_client.posts['C2'] == [f'other {i}' for i in range(5)]
+    assert send_queue.stats()['sent'] == 10
+
+
+def test_channel_rate_limited_by_token_bucket():
+    web_client = FakeWebClient()
+    send_queue = SendQueue(rate=20, burst=2)
+    start = time.monotonic()
+    for i in range(6):
+        send_queue.put('C1', web_client, f'message {i}')
+    send_queue.close()
+
+    # 2 posts in the initial burst, then 4 more at 20 per second
+    assert time.monotonic() - start >= 0.15
+    assert len(web_client.posts['C1']) == 6
+
+
+def test_retries_after_rate_limited():
+    web_client = FakeWebClient(posts_per_second=3, retry_after='0.6')
+    send_queue = SendQueue(rate=1000, burst=10)
+    for i in range(5):
+        send_queue.put('C1', web_client, f'message {i}')
+    send_queue.close()
+
+    assert web_client.rate_limited > 0
+    assert web_client.posts['C1'] == [f'message {i}' for i in range(5)]
+    stats = send_queue.stats()
+    assert stats['sent'] == 5
+    assert stats['retries'] == web_client.rate_limited
+    assert stats['dropped'] == 0
+
+
+def test_rate_limited_channel_does_not_hold_up_others():
+    web_client = FakeWebClient(posts_per_second=1, retry_after='0.5')
+    send_queue = SendQueue(rate=1000, burst=10)
+    send_queue.put('C1', web_client, 'first')
+    send_queue.put('C1', web_client, 'second')
+    send_queue.put('C2', web_client, 'other')
+
+    for _ in range(200):
+        if web_client.posts['C2']:
+            break
+        time.sleep(0.01)
+    assert web_client.posts['C2'] == ['other']
+    assert web_client.posts['C1'] == ['first']
+    send_queue.close()
+    assert web_client.posts['C1'] == ['first', 'second']
+
+
+def test_gives_up_after_max_attempts():
+    web_client = mock.MagicMock()
+    web_client.chat_postMessage.side_effect = Exception('ha ha ha')
+    send_queue = SendQueue(max_attempts=3, retry_backoff=0.01)
+    send_queue.put('C1', web_client, 'message')
+    send_queue.close()
+
+    assert web_client.chat_postMessage.call_count == 3
+    assert send_queue.stats()['dropped'] == 1
+
+
+def test_overflow_drop_newest():
+    web_client = mock.MagicMock()
+    send_queue = SendQueue(rate=0.001, burst=1, max_size=2)
+    send_queue.put('C1', web_client, 'first')
+    send_queue.drain()
+
+    assert send_queue.put('C1', web_client, 'second')
+    assert send_queue.put('C1', web_client, 'third')
+    assert not send_queue.put('C1', web_client, 'fourth')
+    assert send_queue.depth() == 2
+    assert [outgoing.text for outgoing in send_queue._queues['C1']] == ['second', 'third']
+
+
+def test_overflow_drop_oldest():
+    web_client = mock.MagicMock()
+    send_queue = SendQueue(rate=0.001, burst=1, max_size=2, overflow=OverflowPolicy.DROP_OLDEST)
+    send_queue.put('C1', web_client, 'first')
+    send_queue.drain()
+
+    send_queue.put('C1', web_client, 'second')
+    send_queue.put('C2', web_client, 'third')
+    assert send_queue.put('C1', web_client, 'fourth')
+    assert send_queue.depth() == 2
+    assert send_queue.stats()['dropped'] == 1
+    assert [outgoing.text for outgoing in send_queue._queues['C1']] == ['fourth']
+
+
+def test_quiet_channels_forgotten():
+    web_client = FakeWebClient()
+    with mock.patch('van.send_queue.PRUNE_INTERVAL', 0):
+        send_queue = SendQueue(rate=1000, burst=1)
+        for i in range(50):
+            send_queue.put(f'C{i}', web_client, 'message')
+        send_queue.drain()
+        # Long enough for every bucket to fill up again
+        time.sleep(0.05)
+        send_queue.put('C50', web_client, 'message')
+        send_queue.close()
+
+    assert len(web_client.posts) == 51
+    assert set(send_queue._buckets) <= {'C50'}
+    assert not send_queue._paused_until
+
+
+def test_responder_uses_send_queue():
+    web_client = mock.MagicMock()
+    send_queue = mock.MagicMock()
+    Responder('C1', web_client, send_queue=send_queue).respond(Response.broadcast_response('hello'))
+
+    send_queue.put.assert_called_once_with('C1', web_client, 'hello')
+    web_client.chat_postMessage.assert_not_called()
+
+
+def test_posts_profiled(tmp_path):
+    web_client = FakeWebClient()
+    profiler = Profiler(str(tmp_path))
+    with mock.patch('van.profiling.PROFILER', profiler):
+        profiler.start(60)
+        send_queue = SendQueue(rate=1000, burst=10)
+        send_queue.put('C1', web_client, 'message')
+        send_queue.close()
+        paths = profiler.stop()
+
+    assert 'calls: SendQueue._post 1' in open(paths[-1]).read()
+
+
+def test_validation():
+    with pytest.raises(ValueError):
+        SendQueue(rate=0)
+
+
+if __name__ == '__main__':
+    pytest.main()
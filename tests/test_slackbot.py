@@ -0,0 +1,113 @@
+import mock
+import pytest
+
+from slackbot import (
+    CommandFilter,
+    capture_processor,
+    message_processor,
+    serve_metrics,
+)
+from van.metrics import REGISTRY
+from van.responses import Response
+
+
+def _payload(text, channel='C1'):
+    return {
+        'data': {'text': text, 'channel': channel, 'ts': '1.0', 'user': 'user_1'},
+        'rtm_client': mock.MagicMock(),
+        'web_client': mock.MagicMock(),
+    }
+
+
+def test_message_handled_and_responded_to(user_store):
+    processor = mock.MagicMock()
+    processor.process_message_text.return_value = [Response.broadcast_response('hi')]
+    payload = _payload('<@BOT> hello')
+
+    message_processor('BOT', user_store, processor)(**payload)
+
+    assert processor.process_message_text.call_args[0][0] == ['hello']
+    payload['web_client'].chat_postMessage.assert_called_once_with(channel='C1', text='hi')
+
+
+def test_message_not_for_bot_ignored(user_store):
+    processor = mock.MagicMock()
+
+    message_processor('BOT', user_store, processor)(**_payload('hello everyone'))
+
+    processor.process_message_text.assert_not_called()
+
+
+@pytest.mark.parametrize('text, tokens', [
+    ('<@BOT> add printer', ['add', 'printer']),
+    ('  <@BOT>   add  printer ', ['add', 'printer']),
+    ('hey <@BOT> add printer', ['add', 'printer']),
+    ('<@BOT|queuesem> status', ['status']),
+    ('status <@BOT>', ['status']),
+    ('<@BOT>', []),
+    ('hello everyone', None),
+    ('<@BOTTOM> add printer', None),
+    ('<@OTHER> add printer', None),
+    ('', None),
+])
+def test_command_tokens(text, tokens):
+    assert CommandFilter('BOT').command_tokens({'text': text, 'user': 'user_1'}) == tokens
+
+
+@pytest.mark.parametrize('data', [
+    {'subtype': 'message_changed', 'text': '<@BOT> add printer', 'user': 'user_1'},
+    {'subtype': 'bot_message', 'text': '<@BOT> add printer', 'bot_id': 'B1'},
+    {'text': '<@BOT> add printer', 'user': 'user_1', 'bot_id': 'B1'},
+    {'text': '<@BOT> add printer', 'user': 'BOT'},
+    {'subtype': 'channel_join', 'text': '<@BOT> has joined the channel', 'user': 'BOT'},
+])
+def test_non_commands_filtered(data):
+    assert CommandFilter('BOT').command_tokens(data) is None
+
+
+def test_thread_broadcast_accepted():
+    data = {'subtype': 'thread_broadcast', 'text': '<@BOT> mine', 'user': 'user_1'}
+    assert CommandFilter('BOT').command_tokens(data) == ['mine']
+
+
+def test_message_queued_to_pipeline(user_store):
+    processor = mock.MagicMock()
+    pipeline = mock.MagicMock()
+    payload = _payload('<@BOT> add printer')
+
+    message_processor('BOT', user_store, processor, pipeline=pipeline)(**payload)
+
+    processor.process_message_text.assert_not_called()
+    tokens, context = pipeline.submit.call_args[0]
+    assert tokens == ['add', 'printer']
+    assert context['channel'] == 'C1'
+    assert context['user_id'] == 'user_1'
+    payload['web_client'].chat_postMessage.assert_not_called()
+
+
+def test_messages_captured():
+    capture = mock.MagicMock()
+    payload = _payload('hello everyone')
+
+    capture_processor(capture)(**payload)
+
+    capture.record.assert_called_once_with(payload['data'])
+
+
+def test_serve_metrics(user_store, reservation_processor):
+    reservation_processor.process_message_text(['add', 'printer'], {'user_id': 'user_3'})
+    send_queue = mock.MagicMock()
+    send_queue.depth.return_value = 7
+
+    server = serve_metrics(0, user_store, reservation_processor, send_queue=send_queue)
+    server.close()
+
+    metrics = REGISTRY.render()
+    assert 'van_resources 2\n' in metrics
+    assert 'van_queued_users 4\n' in metrics
+    assert 'van_send_queue_depth 7\n' in metrics
+    assert 'van_command_seconds_count{command="add"}' in metrics
+
+
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,164 @@
+import threading
+
+import mock
+import pytest
+from slack.errors import SlackApiError
+
+from benchmarks.fakes import (
+    FakeWebClient,
+    _response,
+)
+from van.responses import MAX_MESSAGE_LENGTH
+from van.send_queue import SendQueue
+from van.status_board import (
+    TRUNCATED_SUFFIX,
+    StatusBoard,
+    truncate_board,
+)
+
+
+def _wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+@pytest.fixture
+def web_client():
+    web_client = mock.MagicMock()
+    web_client.chat_postMessage.return_value = {'ok': True, 'ts': '1.0'}
+    return web_client
+
+
+def test_add_posts_board(web_client):
+    board = StatusBoard(lambda: 'status', debounce=0.01)
+    board.add('C1', web_client)
+
+    web_client.chat_postMessage.assert_called_once_with(channel='C1', text='status')
+    assert board.has_board('C1')
+
+
+def test_burst_of_changes_makes_one_edit(web_client):
+    texts = iter(['status 1', 'status 2'])
+    board = StatusBoard(lambda: next(texts), debounce=0.05)
+    board.add('C1', web_client)
+
+    for _ in range(10):
+        board.changed('q', 'printer', 'user_1', 0)
+
+    assert _wait_for(lambda: web_client.chat_update.called)
+    threading.Event().wait(0.1)
+    web_client.chat_update.assert_called_once_with(channel='C1', ts='1.0', text='status 2')
+
+
+def test_changes_without_boards_ignored(web_client):
+    render = mock.MagicMock()
+    board = StatusBoard(render, debounce=0.01)
+    board.changed('q', 'printer', 'user_1', 0)
+
+    assert board._timer is None
+    render.assert_not_called()
+
+
+def test_removed_board_not_updated(web_client):
+    board = StatusBoard(lambda: 'status', debounce=0.01)
+    board.add('C1', web_client)
+
+    assert board.remove('C1')
+    assert not board.remove('C1')
+    board.changed('q', 'printer', 'user_1', 0)
+    threading.Event().wait(0.05)
+    web_client.chat_update.assert_not_called()
+
+
+def _slack_error(status_code, error, headers=None):
+    response = _response(status_code, {'ok': False, 'error': error}, headers)
+    return SlackApiError('The request to the Slack API failed.', response)
+
+
+def test_failed_update_drops_board(web_client):
+    web_client.chat_update.side_effect = _slack_error(200, 'message_not_found')
+    board = StatusBoard(lambda: 'status', debounce=0.01)
+    board.add('C1', web_client)
+
+    board.changed('q', 'printer', 'user_1', 0)
+    assert _wait_for(lambda: not board.has_board('C1'))
+
+
+def test_failed_update_retried_on_next_change(web_client):
+    web_client.chat_update.side_effect = [Exception('connection reset'), {'ok': True}]
+    board = StatusBoard(lambda: 'status', debounce=0.01)
+    board.add('C1', web_client)
+
+    board.changed('q', 'printer', 'user_1', 0)
+    assert _wait_for(lambda: web_client.chat_update.call_count == 1)
+    threading.Event().wait(0.05)
+    assert board.has_board('C1')
+    assert web_client.chat_update.call_count == 1
+
+    board.changed('q', 'printer', 'user_2', 1)
+    assert _wait_for(lambda: web_client.chat_update.call_count == 2)
+
+
+def test_failed_render_retried_on_next_change(web_client):
+    render = mock.MagicMock(side_effect=['status', Exception('user store down'), 'new status'])
+    board = StatusBoard(render, debounce=0.01)
+    board.add('C1', web_client)
+
+    board.changed('q', 'printer', 'user_1', 0)
+    assert _wait_for(lambda: render.call_count == 2)
+    assert _wait_for(lambda: board._boards['C1'].stale)
+    web_client.chat_update.assert_not_called()
+
+    board.changed('q', 'printer', 'user_2', 1)
+    assert _wait_for(lambda: web_client.chat_update.call_count == 1)
+    web_client.chat_update.assert_called_with(channel='C1', ts='1.0', text='new status')
+
+
+def test_rate_limited_update_retried_after_retry_after(web_client):
+    web_client.chat_update.side_effect = [_slack_error(429, 'ratelimited', {'Retry-After': '0.2'}), {'ok': True}]
+    board = StatusBoard(lambda: 'status', debounce=0.01)
+    board.add('C1', web_client)
+
+    board.changed('q', 'printer', 'user_1', 0)
+    assert _wait_for(lambda: web_client.chat_update.call_count == 1)
+    # Not retried before Slack allows it, even if the reservations change again
+    board.changed('q', 'printer', 'user_2', 1)
+    threading.Event().wait(0.1)
+    assert web_client.chat_update.call_count == 1
+    # Retried without waiting for another change
+    assert _wait_for(lambda: web_client.chat_update.call_count == 2)
+    assert board.has_board('C1')
+
+
+def test_posted_through_send_queue():
+    web_client = FakeWebClient()
+    web_client.chat_update = mock.MagicMock()
+    send_queue = SendQueue(rate=1000, burst=10)
+    texts = iter(['status 1', 'status 2'])
+    board = StatusBoard(lambda: next(texts), debounce=0.01, send_queue=send_queue)
+    board.add('C1', web_client)
+    # Changed before the board is posted
+    board.changed('q', 'printer', 'user_1', 0)
+    send_queue.close()
+
+    assert web_client.posts['C1'] == ['status 1']
+    assert _wait_for(lambda: web_client.chat_update.called)
+    assert web_client.chat_update.call_args[1]['text'] == 'status 2'
+    assert web_client.chat_update.call_args[1]['ts'] == board._boards['C1'].ts
+
+
+def test_board_truncated(web_client):
+    board = StatusBoard(lambda: '\n'.join(f'*resource {i}*: someone' for i in range(1000)), debounce=0.01)
+    board.add('C1', web_client)
+
+    text = web_client.chat_postMessage.call_args[1]['text']
+    assert len(text) <= MAX_MESSAGE_LENGTH
+    assert text.endswith('someone' + TRUNCATED_SUFFIX)
+    assert truncate_board('short') == 'short'
+
+
+if __name__ == '__main__':
+    pytest.main()
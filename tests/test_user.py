@@ -0,0 +1,33 @@
+import pytest
+
+from van.user import User
+
+MEMBER = {
+    'id': 'user_1',
+    'name': 'User 1',
+    'real_name': 'Real User 1',
+    'is_bot': True,
+    'profile': {'real_name': 'Real User 1', 'image_48': 'https://example.com/1.png'},
+}
+
+
+def test_from_member():
+    user = User.from_member(MEMBER)
+
+    assert user == User('user_1', 'User 1', 'Real User 1', is_bot=True)
+    assert user.raw is None
+
+
+def test_from_member_raw():
+    assert User.from_member(MEMBER, raw=True).raw is MEMBER
+
+
+def test_from_member_profile_real_name():
+    user = User.from_member({'id': 'user_1', 'name': 'User 1', 'profile': {'real_name': 'Real User 1'}})
+
+    assert user.real_name == 'Real User 1'
+    assert not user.is_bot
+
+
+if __name__ == '__main__':
+    pytest.main()
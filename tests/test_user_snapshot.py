@@ -0,0 +1,41 @@
+import pytest
+
+from tests.conftest import MOCK_USER_RECORDS
+from van.user_snapshot import UserSnapshot
+
+
+def test_save_and_load(tmp_path):
+    snapshot = UserSnapshot(str(tmp_path / 'users.db'))
+    users = [user._replace(is_bot=True, raw={'profile': {'image_48': 'x'}}) for user in MOCK_USER_RECORDS]
+
+    assert snapshot.save(users)
+    # Only the id, name and real_name are kept
+    assert snapshot.load() == MOCK_USER_RECORDS
+
+
+def test_save_replaces_snapshot(tmp_path):
+    snapshot = UserSnapshot(str(tmp_path / 'users.db'))
+    snapshot.save(MOCK_USER_RECORDS)
+    snapshot.save(MOCK_USER_RECORDS[:1])
+
+    assert snapshot.load() == MOCK_USER_RECORDS[:1]
+
+
+def test_load_missing_snapshot(tmp_path):
+    assert UserSnapshot(str(tmp_path / 'users.db')).load() == []
+
+
+def test_load_corrupt_snapshot(tmp_path):
+    path = tmp_path / 'users.db'
+    path.write_text('ha ha ha')
+
+    assert UserSnapshot(str(path)).load() == []
+
+
+def test_path_required():
+    with pytest.raises(ValueError):
+        UserSnapshot('')
+
+
+if __name__ == '__main__':
+    pytest.main()
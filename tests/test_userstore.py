@@ -1,7 +1,17 @@
+import threading
+
+import mock
 import pytest
 from mock import MagicMock
+from slack.errors import SlackApiError
 
-from tests.conftest import MOCK_USERS
+from benchmarks.fakes import _response
+from tests.conftest import (
+    MOCK_USER_RECORDS,
+    MOCK_USERS,
+)
+from van.user import User
+from van.user_snapshot import UserSnapshot
 from van.userstore import UserStore
 
 
@@ -12,7 +22,7 @@ def slack_web_client():
         'ok': True,
         'members': MOCK_USERS,
     })
-    mocked_users_info = MagicMock()
+    mocked_users_info = MagicMock(return_value={'ok': False, 'error': 'user_not_found'})
 
     mocked_client.api_call = mocked_api_call
     mocked_client.users_info = mocked_users_info
@@ -21,14 +31,60 @@ def slack_web_client():
 
 def test_load_users(slack_web_client):
     user_store = UserStore(slack_web_client)
-    assert user_store._load_users() == MOCK_USERS
+    assert list(user_store._load_users()) == MOCK_USERS
 
 
 def test_load_users_error(slack_web_client):
     slack_web_client.api_call = MagicMock(side_effect=Exception('ha ha ha'))
     user_store = UserStore(slack_web_client)
     with pytest.raises(Exception):
-        user_store._load_users()
+        list(user_store._load_users())
+
+
+def _paged_api_call():
+    def api_call(api_method, http_verb='POST', params=None):
+        start = int(params.get('cursor') or 0)
+        end = start + params['limit']
+        response = {'ok': True, 'members': MOCK_USERS[start:end]}
+        if end < len(MOCK_USERS):
+            response['response_metadata'] = {'next_cursor': str(end)}
+        return response
+    return MagicMock(side_effect=api_call)
+
+
+def test_load_users_paginated(slack_web_client):
+    slack_web_client.api_call = _paged_api_call()
+    user_store = UserStore(slack_web_client, page_size=1)
+
+    assert list(user_store._load_users()) == MOCK_USERS
+    assert slack_web_client.api_call.call_count == len(MOCK_USERS)
+    for call in slack_web_client.api_call.call_args_list:
+        assert call[1]['params']['limit'] == 1
+
+
+def test_page_size_validation(slack_web_client):
+    with pytest.raises(ValueError):
+        UserStore(slack_web_client, page_size=0)
+
+
+def test_get_cached_user_info_streams_pages(slack_web_client):
+    slack_web_client.api_call = _paged_api_call()
+    user_store = UserStore(slack_web_client, page_size=1)
+
+    # Only the first page is needed to answer for the first user
+    assert user_store.get_cached_user_info(MOCK_USERS[0]['id']) == MOCK_USER_RECORDS[0]
+    assert slack_web_client.api_call.call_count == 1
+
+    assert user_store.get_cached_user_info(MOCK_USERS[1]['id']) == MOCK_USER_RECORDS[1]
+    assert slack_web_client.api_call.call_count == 2
+
+    # Loading resumes where it left off and completes
+    assert len(user_store.get_users()) == len(MOCK_USERS)
+    assert slack_web_client.api_call.call_count == len(MOCK_USERS)
+
+    # Unknown users don't restart the load
+    assert user_store.get_cached_user_info('nobody') is None
+    assert slack_web_client.api_call.call_count == len(MOCK_USERS)
 
 
 def test_lookup_user_info(slack_web_client):
@@ -47,23 +103,463 @@ def test_lookup_user_info_error(slack_web_client):
     assert user_store.lookup_user_info('12345') is None
 
 
+def test_lookup_user_info_not_found(slack_web_client):
+    slack_web_client.users_info.side_effect = SlackApiError(
+        'The request to the Slack API failed.', _response(200, {'ok': False, 'error': 'user_not_found'})
+    )
+    user_store = UserStore(slack_web_client)
+
+    with mock.patch('van.userstore.LOGGER') as logger:
+        assert user_store.lookup_user_info('12345') is None
+    # An expected outcome, not an error
+    logger.exception.assert_not_called()
+    logger.info.assert_called_once()
+
+
 def test_get_users(slack_web_client):
     user_store = UserStore(slack_web_client)
     user_store._load_users = MagicMock(return_value=MOCK_USERS)
     users = user_store.get_users()
 
-    for mock_user in MOCK_USERS:
-        assert users[mock_user['id']] == mock_user
-        assert user_store.get_cached_user_info(mock_user['id']) == mock_user
+    for mock_user in MOCK_USER_RECORDS:
+        assert users[mock_user.id] == mock_user
+        assert user_store.get_cached_user_info(mock_user.id) == mock_user
+
+
+def test_get_users_raw(slack_web_client):
+    members = [dict(user, profile={'image_48': 'x'}) for user in MOCK_USERS]
+    slack_web_client.api_call.return_value = {'ok': True, 'members': members}
+
+    assert UserStore(slack_web_client).get_cached_user_info('user_1').raw is None
+    assert UserStore(slack_web_client, raw=True).get_cached_user_info('user_1').raw == members[0]
 
 
 def test_search_for_user(slack_web_client):
     user_store = UserStore(slack_web_client)
     user_store._load_users = MagicMock(return_value=MOCK_USERS)
 
-    for mock_user in MOCK_USERS:
-        assert user_store.search_for_user(mock_user['name']) == mock_user
-        assert user_store.search_for_user(mock_user['real_name']) == mock_user
+    for mock_user in MOCK_USER_RECORDS:
+        assert user_store.search_for_user(mock_user.name) == mock_user
+        assert user_store.search_for_user(mock_user.real_name) == mock_user
+
+
+def test_search_for_user_ignores_case(slack_web_client):
+    user_store = UserStore(slack_web_client)
+
+    assert user_store.search_for_user('user 2') == MOCK_USER_RECORDS[1]
+    assert user_store.search_for_user('REAL USER 3') == MOCK_USER_RECORDS[2]
+    assert user_store.search_for_user('User 4') is None
+    assert user_store.search_for_user('') is None
+
+
+def test_search_for_user_prefers_exact_match(slack_web_client):
+    users = [
+        {'id': 'U1', 'name': 'alice', 'real_name': 'Alice Smith'},
+        {'id': 'U2', 'name': 'Alice', 'real_name': 'Alice Jones'},
+    ]
+    slack_web_client.api_call.return_value = {'ok': True, 'members': users}
+    user_store = UserStore(slack_web_client)
+
+    assert user_store.search_for_user('Alice').id == 'U2'
+    assert user_store.search_for_user('alice').id == 'U1'
+    assert user_store.search_for_user('ALICE').id == 'U1'
+
+
+def test_search_for_users_by_prefix(slack_web_client):
+    users = [
+        {'id': 'U1', 'name': 'alice', 'real_name': 'Alice Smith'},
+        {'id': 'U2', 'name': 'alfred', 'real_name': 'Alfred Jones'},
+        {'id': 'U3', 'name': 'bob', 'real_name': 'Bob Allen'},
+    ]
+    slack_web_client.api_call.return_value = {'ok': True, 'members': users}
+    user_store = UserStore(slack_web_client)
+
+    assert [user.id for user in user_store.search_for_users_by_prefix('AL')] == ['U2', 'U1']
+    assert [user.id for user in user_store.search_for_users_by_prefix('alice s')] == ['U1']
+    assert [user.id for user in user_store.search_for_users_by_prefix('b')] == ['U3']
+    assert len(user_store.search_for_users_by_prefix('al', limit=1)) == 1
+    assert user_store.search_for_users_by_prefix('zed') == []
+
+
+def test_refresh_rebuilds_indexes(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    assert user_store.search_for_user('User 1') == MOCK_USER_RECORDS[0]
+
+    renamed = [dict(user, name=f'Renamed {user["id"]}') for user in MOCK_USERS]
+    slack_web_client.api_call.return_value = {'ok': True, 'members': renamed}
+    user_store.refresh(wait=True)
+
+    assert user_store.search_for_user('User 1') is None
+    assert user_store.search_for_user('renamed user_1') == User.from_member(renamed[0])
+
+
+def test_missing_user_looked_up_and_cached(slack_web_client):
+    new_user = {'id': 'user_4', 'name': 'User 4', 'real_name': 'Real User 4'}
+    slack_web_client.users_info.return_value = {'ok': True, 'user': new_user}
+    user_store = UserStore(slack_web_client)
+
+    assert user_store.get_cached_user_info('user_4') == User.from_member(new_user)
+    assert user_store.get_cached_user_info('user_4') == User.from_member(new_user)
+    assert user_store.search_for_user('User 4') == User.from_member(new_user)
+    slack_web_client.users_info.assert_called_once_with(user='user_4')
+
+
+def test_missing_user_remembered(slack_web_client):
+    user_store = UserStore(slack_web_client, missing_ttl=60)
+
+    with mock.patch('van.userstore.time.monotonic', return_value=1000.0):
+        assert user_store.get_cached_user_info('nobody') is None
+        assert user_store.get_cached_user_info('nobody') is None
+    assert slack_web_client.users_info.call_count == 1
+
+    with mock.patch('van.userstore.time.monotonic', return_value=1060.0):
+        assert user_store.get_cached_user_info('nobody') is None
+    assert slack_web_client.users_info.call_count == 2
+
+
+def test_missing_users_bounded(slack_web_client):
+    user_store = UserStore(slack_web_client, missing_cache_size=2)
+    for user_id in ('nobody_1', 'nobody_2', 'nobody_3'):
+        user_store.get_cached_user_info(user_id)
+
+    assert list(user_store._missing) == ['nobody_2', 'nobody_3']
+    user_store.get_cached_user_info('nobody_1')
+    assert slack_web_client.users_info.call_count == 4
+
+
+def test_get_cached_user_infos(slack_web_client):
+    new_user = {'id': 'user_4', 'name': 'User 4', 'real_name': 'Real User 4'}
+
+    def users_info(user):
+        if user == 'user_4':
+            return {'ok': True, 'user': new_user}
+        return {'ok': False, 'error': 'user_not_found'}
+
+    slack_web_client.users_info.side_effect = users_info
+    user_store = UserStore(slack_web_client)
+
+    users = user_store.get_cached_user_infos(['user_1', 'user_4', 'nobody', 'user_4', 'nobody'])
+    assert users == {'user_1': MOCK_USER_RECORDS[0], 'user_4': User.from_member(new_user)}
+    # Each missing user is looked up once
+    assert slack_web_client.users_info.call_count == 2
+
+
+def test_concurrent_missing_users_share_lookup(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+    release = threading.Event()
+
+    def slow_users_info(user):
+        release.wait(timeout=5)
+        return {'ok': True, 'user': {'id': user, 'name': user, 'real_name': user}}
+
+    slack_web_client.users_info.side_effect = slow_users_info
+    results = {}
+
+    def look_up(user_id):
+        results.setdefault(user_id, []).append(user_store.get_cached_user_info(user_id))
+
+    threads = [
+        threading.Thread(target=look_up, args=(user_id,))
+        for user_id in ('user_4', 'user_4', 'user_5', 'user_4')
+    ]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert [user.id for user in results['user_4']] == ['user_4'] * 3
+    assert results['user_5'][0].id == 'user_5'
+    assert sorted(call[1]['user'] for call in slack_web_client.users_info.call_args_list) == ['user_4', 'user_5']
+
+
+def test_failed_lookup_releases_waiting_users(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+    # A user without an ID can't be made into a User
+    slack_web_client.users_info.side_effect = lambda user: {'ok': True, 'user': {'name': user}}
+
+    with pytest.raises(KeyError):
+        user_store.get_cached_user_infos(['user_4', 'user_5'])
+
+    slack_web_client.users_info.side_effect = None
+    slack_web_client.users_info.return_value = {'ok': True, 'user': {'id': 'user_5', 'name': 'User 5'}}
+    thread = threading.Thread(target=user_store.get_cached_user_info, args=('user_5',), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert user_store.get_cached_user_info('user_5').name == 'User 5'
+
+
+def test_update_user(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+
+    user_store.update_user(dict(MOCK_USERS[0], name='Renamed', real_name='Renamed For Real'))
+    renamed = MOCK_USER_RECORDS[0]._replace(name='Renamed', real_name='Renamed For Real')
+
+    assert user_store.get_cached_user_info('user_1') == renamed
+    assert user_store.search_for_user('Renamed') == renamed
+    assert user_store.search_for_user('renamed for real') == renamed
+    assert user_store.search_for_user('User 1') is None
+    assert user_store.search_for_user('Real User 1') is None
+    assert user_store.search_for_users_by_prefix('rename') == [renamed]
+    assert slack_web_client.api_call.call_count == 1
+
+
+def test_update_user_keeps_other_users_with_same_name(slack_web_client):
+    slack_web_client.api_call.return_value = {'ok': True, 'members': [
+        {'id': 'U1', 'name': 'sam', 'real_name': 'Sam One'},
+        {'id': 'U2', 'name': 'Sam', 'real_name': 'Sam Two'},
+    ]}
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+
+    user_store.update_user({'id': 'U1', 'name': 'samuel', 'real_name': 'Sam One'})
+
+    assert user_store.search_for_user('SAM').id == 'U2'
+    assert user_store.search_for_user('samuel').id == 'U1'
+    assert [user.id for user in user_store.search_for_users_by_prefix('sam')] == ['U2', 'U1']
+
+
+class _PausingDict(dict):
+    """
+    Dict that waits for `resume` partway through an iteration over its items, so that another
+    thread can change it in the middle of the iteration.
+    """
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.paused = threading.Event()
+        self.resume = threading.Event()
+
+    def items(self):
+        items = iter(super().items())
+        yield next(items)
+        self.paused.set()
+        self.resume.wait(timeout=0.2)
+        yield from items
+
+
+def test_search_while_users_updated(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+    directory = user_store._directory
+    directory.by_folded_name = _PausingDict(directory.by_folded_name)
+    new_user = {'id': 'user_4', 'name': 'User 4', 'real_name': 'Real User 4'}
+
+    def update() -> None:
+        directory.by_folded_name.paused.wait()
+        user_store.update_user(new_user)
+        directory.by_folded_name.resume.set()
+
+    thread = threading.Thread(target=update)
+    thread.start()
+    try:
+        assert user_store.search_for_users_by_prefix('user') == MOCK_USER_RECORDS
+    finally:
+        directory.by_folded_name.resume.set()
+        thread.join()
+    assert user_store.search_for_users_by_prefix('user') == MOCK_USER_RECORDS + [User.from_member(new_user)]
+
+
+def test_generation_changes_with_users(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    generation = user_store.get_generation()
+    assert user_store.get_generation() == generation
+
+    user_store.update_user(dict(MOCK_USERS[0], name='Renamed'))
+    assert user_store.get_generation() != generation
+
+    generation = user_store.get_generation()
+    user_store.refresh(wait=True)
+    assert user_store.get_generation() != generation
+
+
+def test_generation_kept_when_names_unchanged(slack_web_client):
+    user_store = UserStore(slack_web_client, raw=True)
+    generation = user_store.get_generation()
+
+    status_edit = dict(MOCK_USERS[0], profile={'status_text': 'Out to lunch'})
+    user_store.update_user(status_edit)
+
+    assert user_store.get_generation() == generation
+    assert user_store.get_cached_user_info('user_1').raw == status_edit
+
+
+def test_update_user_new_user(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    assert user_store.get_cached_user_info('user_4') is None
+
+    new_user = {'id': 'user_4', 'name': 'User 4', 'real_name': 'Real User 4'}
+    user_store.update_user(new_user)
+
+    assert user_store.get_cached_user_info('user_4') == User.from_member(new_user)
+    assert user_store.search_for_user('User 4') == User.from_member(new_user)
+
+
+def test_update_user_during_refresh(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_api_call(*args, **kwargs):
+        loading.set()
+        release.wait(timeout=5)
+        return {'ok': True, 'members': MOCK_USERS}
+
+    slack_web_client.api_call = MagicMock(side_effect=slow_api_call)
+    user_store.refresh()
+    assert loading.wait(timeout=5)
+
+    user_store.update_user(dict(MOCK_USERS[0], name='Renamed'))
+    release.set()
+    user_store.refresh(wait=True)
+
+    # The update isn't lost when the refreshed users replace the cache
+    assert user_store.get_cached_user_info('user_1').name == 'Renamed'
+
+
+def test_looked_up_user_kept_by_refresh(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    user_store.get_users()
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_api_call(*args, **kwargs):
+        loading.set()
+        release.wait(timeout=5)
+        return {'ok': True, 'members': MOCK_USERS}
+
+    new_user = {'id': 'user_4', 'name': 'User 4', 'real_name': 'Real User 4'}
+    slack_web_client.users_info.return_value = {'ok': True, 'user': new_user}
+    slack_web_client.api_call = MagicMock(side_effect=slow_api_call)
+    user_store.refresh()
+    assert loading.wait(timeout=5)
+
+    assert user_store.get_cached_user_info('user_4') == User.from_member(new_user)
+    release.set()
+    user_store.refresh(wait=True)
+
+    # Not looked up again once the refreshed users replace the cache
+    assert user_store.get_cached_user_info('user_4') == User.from_member(new_user)
+    slack_web_client.users_info.assert_called_once_with(user='user_4')
+
+
+def test_serves_from_snapshot_then_reconciles(slack_web_client, tmp_path):
+    snapshot = UserSnapshot(str(tmp_path / 'users.db'))
+    snapshot.save([user._replace(name='Old name') for user in MOCK_USER_RECORDS])
+    release = threading.Event()
+
+    def slow_api_call(*args, **kwargs):
+        release.wait(timeout=5)
+        return {'ok': True, 'members': MOCK_USERS}
+
+    slack_web_client.api_call = MagicMock(side_effect=slow_api_call)
+    user_store = UserStore(slack_web_client, snapshot=snapshot)
+
+    # Served from the snapshot while Slack is still loading
+    assert user_store.get_cached_user_info('user_1').name == 'Old name'
+
+    release.set()
+    user_store._refresh_thread.join()
+    assert user_store.get_cached_user_info('user_1') == MOCK_USER_RECORDS[0]
+    assert snapshot.load() == MOCK_USER_RECORDS
+
+
+def test_initial_load_saves_snapshot(slack_web_client, tmp_path):
+    snapshot = UserSnapshot(str(tmp_path / 'users.db'))
+    user_store = UserStore(slack_web_client, snapshot=snapshot)
+    saved = threading.Event()
+    snapshot.save = MagicMock(side_effect=lambda users: saved.set())
+
+    user_store.get_users()
+
+    assert saved.wait(timeout=5)
+    snapshot.save.assert_called_once_with(MOCK_USER_RECORDS)
+
+
+def test_refresh_after_ttl_keeps_serving_old_users(slack_web_client):
+    user_store = UserStore(slack_web_client, ttl=0)
+    assert user_store.get_cached_user_info('user_1') == MOCK_USER_RECORDS[0]
+
+    release = threading.Event()
+    renamed = [dict(user, name='Renamed') for user in MOCK_USERS]
+
+    def slow_api_call(*args, **kwargs):
+        release.wait(timeout=5)
+        return {'ok': True, 'members': renamed}
+
+    slack_web_client.api_call = MagicMock(side_effect=slow_api_call)
+
+    # Stale, so a refresh starts, but readers get the old users until it is done
+    assert user_store.get_cached_user_info('user_1').name == 'User 1'
+    assert user_store.get_users()['user_1'].name == 'User 1'
+
+    release.set()
+    user_store._refresh_thread.join()
+    assert user_store.users['user_1'].name == 'Renamed'
+    # Concurrent stale reads shared the one refresh
+    assert slack_web_client.api_call.call_count == 1
+
+
+def test_refresh_is_single_flight(slack_web_client):
+    user_store = UserStore(slack_web_client)
+    release = threading.Event()
+
+    def slow_api_call(*args, **kwargs):
+        release.wait(timeout=5)
+        return {'ok': True, 'members': MOCK_USERS}
+
+    slack_web_client.api_call = MagicMock(side_effect=slow_api_call)
+    user_store.refresh()
+    refresh_thread = user_store._refresh_thread
+    user_store.refresh()
+    assert user_store._refresh_thread is refresh_thread
+    release.set()
+    # Joined rather than refresh(wait=True), which would start a second refresh if the first
+    # was already done
+    refresh_thread.join()
+
+    assert slack_web_client.api_call.call_count == 1
+    assert len(user_store.users) == len(MOCK_USERS)
+
+
+def test_failed_load_backs_off(slack_web_client):
+    slack_web_client.api_call = MagicMock(side_effect=Exception('ha ha ha'))
+    user_store = UserStore(slack_web_client, retry_backoff=10)
+
+    with mock.patch('van.userstore.time.monotonic', return_value=1000.0):
+        assert user_store.get_cached_user_info('user_1') is None
+        # Later lookups don't retry the load inline while backing off
+        assert user_store.get_cached_user_info('user_1') is None
+        assert user_store.get_users() == {}
+    assert slack_web_client.api_call.call_count == 1
+
+    slack_web_client.api_call = MagicMock(return_value={'ok': True, 'members': MOCK_USERS})
+    with mock.patch('van.userstore.time.monotonic', return_value=1010.0):
+        # The retry happens in the background once the backoff has passed
+        user_store.get_cached_user_info('user_1')
+        user_store._refresh_thread.join()
+    assert user_store.get_cached_user_info('user_1') == MOCK_USER_RECORDS[0]
+
+
+def test_consecutive_failures_double_backoff(slack_web_client):
+    slack_web_client.api_call = MagicMock(side_effect=Exception('ha ha ha'))
+    user_store = UserStore(slack_web_client, retry_backoff=10)
+
+    with mock.patch('van.userstore.LOGGER') as logger:
+        with mock.patch('van.userstore.time.monotonic', return_value=1000.0):
+            user_store.get_users()
+        assert user_store._expires_at == 1010.0
+
+        with mock.patch('van.userstore.time.monotonic', return_value=1010.0):
+            user_store.refresh(wait=True)
+        assert user_store._expires_at == 1030.0
+    logger.warning.assert_called_with('User load failed %s time(s) in a row; retrying in %ss', 2, 20)
 
 
 if __name__ == '__main__':
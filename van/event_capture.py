@@ -0,0 +1,174 @@
+import hashlib
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from van.logs import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Fields of message events kept in a capture. Everything else (tokens, profiles, blocks, files,
+# attachments, ...) is dropped.
+CAPTURED_FIELDS = ('type', 'subtype', 'channel', 'team', 'user', 'bot_id', 'ts', 'thread_ts', 'text')
+# Fields holding Slack IDs, which are replaced by pseudonyms
+ID_FIELDS = frozenset(('channel', 'team', 'user', 'bot_id'))
+
+# Slack tokens, wherever they turn up
+TOKEN = re.compile(r'xox[a-z]-[0-9A-Za-z-]+')
+# User and channel references (<@U123>, <@U123|name>, <#C123|name>)
+REFERENCE = re.compile(r'<([@#])([A-Z0-9]+)(?:\|[^>]*)?>')
+# Links and email addresses (<https://...>, <mailto:...>)
+LINK = re.compile(r'<(?:https?|mailto):[^>]*>')
+
+
+class CapturedEvent(NamedTuple):
+    # Seconds since the capture started
+    t: float
+    # The scrubbed event data
+    data: Dict[str, Any]
+
+
+class Capture(NamedTuple):
+    bot_id: str
+    events: List[CapturedEvent]
+
+
+class EventScrubber:
+    """
+    Scrubs tokens and personal information from message events. IDs are replaced by keyed
+    hashes, so the same user or channel gets the same pseudonym throughout a capture but can't
+    be looked up from it. Commands for the bot keep their text; any other text is replaced by
+    x's of the same length.
+    """
+
+    def __init__(self, bot_id: str, key: bytes = None) -> None:
+        """
+        :param bot_id: the bot's user ID, which is left as is
+        :param key: the key pseudonyms are hashed with. A random one is used if not provided.
+        """
+        self.bot_id = bot_id
+        self.key = key or os.urandom(16)
+        self._mention_prefix = '<@' + bot_id
+
+    def pseudonym(self, slack_id: str) -> str:
+        """
+        :param slack_id: a user, channel, team or bot ID
+        :return: its pseudonym, starting with the same letter (e.g. U for users)
+        """
+        if not slack_id or slack_id == self.bot_id:
+            return slack_id
+        digest = hmac.new(self.key, slack_id.encode(), hashlib.sha256).hexdigest()
+        return slack_id[0] + digest[:10].upper()
+
+    def _scrub_reference(self, match: re.Match) -> str:
+        return f'<{match.group(1)}{self.pseudonym(match.group(2))}>'
+
+    def scrub_text(self, text: str) -> str:
+        if self._mention_prefix not in text:
+            return 'x' * len(text)
+        text = TOKEN.sub('<token>', text)
+        text = LINK.sub('<link>', text)
+        return REFERENCE.sub(self._scrub_reference, text)
+
+    def scrub(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :param data: the data of a message event
+        :return: a scrubbed copy of the data
+        """
+        scrubbed = {}
+        for field in CAPTURED_FIELDS:
+            value = data.get(field)
+            if value is None:
+                continue
+            if field in ID_FIELDS:
+                value = self.pseudonym(value)
+            elif field == 'text':
+                value = self.scrub_text(value)
+            scrubbed[field] = value
+        return scrubbed
+
+
+class EventCapture:
+    """
+    Records message events to a JSON lines file, to be replayed offline by
+    benchmarks/replay_capture.py. The first line holds the bot's ID, and each line after it an
+    event and the time it arrived at. Events are scrubbed by an EventScrubber before they are
+    written.
+    """
+
+    def __init__(self, path: str, bot_id: str, max_events: int = None, scrubber: EventScrubber = None) -> None:
+        """
+        :param path: the file to record to. An existing file is replaced.
+        :param bot_id: the bot's user ID
+        :param max_events: stop recording after this many events (None for no limit)
+        :param scrubber: scrubs events before they are written. One keyed with a random key is
+            used if not provided.
+        """
+        self.path = path
+        self.max_events = max_events
+        self.scrubber = scrubber or EventScrubber(bot_id)
+        self.recorded = 0
+        self._started_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', buffering=1)
+        self._file.write(json.dumps({'bot_id': bot_id, 'started_at': time.time()}) + '\n')
+        LOGGER.info('Capturing message events to %s', path)
+
+    def record(self, data: Dict[str, Any]) -> None:
+        """
+        Records a message event, unless the capture is full or closed.
+
+        :param data: the data of the message event
+        """
+        line = json.dumps({'t': round(time.monotonic() - self._started_at, 6), 'data': self.scrubber.scrub(data)})
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self.recorded += 1
+            if self.max_events is not None and self.recorded >= self.max_events:
+                LOGGER.info('Captured %s events, stopping capture', self.recorded)
+                self._close()
+
+    def _close(self) -> None:
+        self._file.close()
+        self._file = None
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._close()
+
+
+def read_capture(path: str) -> Capture:
+    """
+    Reads a capture recorded by EventCapture.
+
+    :param path: the capture file
+    :return: the capture
+    """
+    events = []
+    bot_id: Optional[str] = None
+    with open(path) as capture_file:
+        for line_number, line in enumerate(capture_file):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short when the bot stopped
+                LOGGER.warning('Ignoring incomplete capture record on line %s', line_number + 1)
+                break
+            if line_number == 0:
+                bot_id = record['bot_id']
+            else:
+                events.append(CapturedEvent(record['t'], record['data']))
+    return Capture(bot_id, events)
@@ -1,13 +1,35 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import threading
 from logging.config import dictConfig
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+)
+from typing import (
+    Dict,
+    Mapping,
+)
 
+# Most log records waiting to be written. Records logged while the queue is full are dropped
+# rather than holding up the thread logging them.
+DEFAULT_QUEUE_SIZE = 10000
+# Most places DebugSampler keeps counts for. The counts start over once there are more.
+MAX_SAMPLED_PLACES = 10000
 
 config = {
     'version': 1,
     'formatters': {
         'f': {
             'format': '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
-        }
+        },
+        'json': {
+            '()': 'van.logs.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -29,15 +51,149 @@ config = {
     }
 }
 
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a JSON object on a line of its own.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'sample_rate', None):
+            entry['sample_rate'] = record.sample_rate
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
 
-def init_logging() -> None:
+class DebugSampler(logging.Filter):
+    """
+    Lets through only one in every rate DEBUG records logged from the same place, so that debug
+    logging of every event doesn't flood the log. The first record from each place is always let
+    through, and records at INFO and above are never dropped.
+    """
+
+    def __init__(self, rate: int) -> None:
+        """
+        :param rate: let through one in this many DEBUG records from each place
+        """
+        super().__init__()
+        self.rate = rate
+        # (logger name, message template) -> DEBUG records seen
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        with self._lock:
+            if len(self._seen) >= MAX_SAMPLED_PLACES and key not in self._seen:
+                self._seen.clear()
+            seen = self._seen.get(key, 0)
+            self._seen[key] = seen + 1
+        if seen % self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records over to a QueueListener without formatting them, so that building the message
+    is left to the listener's thread. Records that don't fit in the queue are dropped.
+    """
+
+    def __init__(self, record_queue: queue.Queue) -> None:
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            # Tracebacks can't wait: the frames they refer to are changing
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _settings(environ: Mapping[str, str]) -> Dict:
+    settings = {
+        'level': (environ.get('LOG_LEVEL') or 'DEBUG').upper(),
+        'formatter': 'json' if (environ.get('LOG_FORMAT') or '').lower() == 'json' else 'f',
+        'queue_size': int(environ.get('LOG_QUEUE_SIZE') or DEFAULT_QUEUE_SIZE),
+        'debug_sample_rate': int(environ.get('LOG_DEBUG_SAMPLE_RATE') or 1),
+    }
+    if not isinstance(logging.getLevelName(settings['level']), int):
+        raise ValueError('Unknown LOG_LEVEL {}'.format(settings['level']))
+    return settings
+
+
+def init_logging(environ: Mapping[str, str] = None) -> None:
     """
     Initializes logging configuration using config above.
 
     Call this at least once when a script/program starts. This is necessary since we're not
     running in Django or some framework that does it for us.
+
+    Records are written to the console by a thread of their own, so logging never waits on the
+    console. These environment variables tune logging:
+
+    * LOG_LEVEL - level of the van loggers (DEBUG by default)
+    * LOG_FORMAT - json to write each record as a JSON object
+    * LOG_DEBUG_SAMPLE_RATE - write only one in this many DEBUG records logged from each place
+    * LOG_QUEUE_SIZE - most records waiting to be written (DEFAULT_QUEUE_SIZE by default)
+
+    :param environ: the environment to read the settings from (os.environ by default)
     """
-    dictConfig(config)
+    global _listener
+
+    settings = _settings(os.environ if environ is None else environ)
+    stop_logging()
+    logging_config = copy.deepcopy(config)
+    logging_config['handlers']['console']['formatter'] = settings['formatter']
+    logging_config['loggers']['van']['level'] = settings['level']
+    dictConfig(logging_config)
+    console = logging.getLogger().handlers[0]
+
+    queue_handler = _NonBlockingQueueHandler(queue.Queue(settings['queue_size']))
+    if settings['debug_sample_rate'] > 1:
+        queue_handler.addFilter(DebugSampler(settings['debug_sample_rate']))
+    for logger in (logging.getLogger(), logging.getLogger('van')):
+        logger.handlers = [queue_handler]
+
+    _listener = QueueListener(queue_handler.queue, console, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Writes the records still waiting in the queue and stops the thread writing them. Called when
+    the program exits.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
 
 
 def get_logger(name: str = None) -> logging.Logger:
@@ -36,7 +36,7 @@ def format_user(user_id, user_store: UserStore, slack_client: WebClient, active:
         if user_id:
             user_profile = user_store.get_cached_user_info(user_id)
             if user_profile:
-                formatted = "{}".format(user_profile['name'])
+                formatted = "{}".format(user_profile.name)
     return formatted
 
 
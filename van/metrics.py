@@ -0,0 +1,278 @@
+import bisect
+import threading
+import time
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from van.logs import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Port of the metrics endpoint when not given. Only listened on when METRICS_PORT is set.
+DEFAULT_PORT = 9464
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    """
+    A count of things that happened (calls, errors, ...), optionally split by labels.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Label values -> count
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labelvalues, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'errors', 'labelvalues', 'start')
+
+    def __init__(self, histogram: 'Histogram', errors: Optional[Counter], labelvalues: Tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.errors = errors
+        self.labelvalues = labelvalues
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(*self.labelvalues)
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+
+
+class Histogram:
+    """
+    A distribution of durations, counted in buckets, optionally split by labels. Its count is
+    the number of calls timed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [count per bucket (the last one for values over every bound), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, *labelvalues: str, errors: Counter = None) -> _Timer:
+        """
+        Times a block of code (with histogram.time(...): ...), counting it in errors if it raises.
+
+        :param labelvalues: the label values to time the block under
+        :param errors: the counter to count failures in, under the same label values
+        """
+        return _Timer(self, errors, labelvalues)
+
+    def get_count(self, *labelvalues: str) -> int:
+        counts = self._values.get(labelvalues)
+        return sum(counts[:-1]) if counts else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((labelvalues, list(counts)) for labelvalues, counts in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labelvalues, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """
+    A current value (a queue size, a number of resources, ...). The value is only worked out, by
+    calling a function, when the metrics are scraped.
+    """
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        try:
+            lines.append(f'{self.name} {_format_value(self.function())}')
+        except Exception:
+            LOGGER.exception('Cannot get the value of %s', self.name)
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics served by a MetricsServer.
+    """
+
+    def __init__(self) -> None:
+        # Name -> metric, in the order registered
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Gets a counter, creating it if needed.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        """
+        Gets a histogram, creating it if needed.
+        """
+        return self._register(Histogram(name, documentation, labelnames, **kwargs))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float]) -> Gauge:
+        """
+        Registers a gauge, replacing any gauge of the same name.
+        """
+        gauge = Gauge(name, documentation, function)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        """
+        :return: the metrics in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# The metrics of the bot. Modules register their metrics here when they are imported.
+REGISTRY = MetricsRegistry()
+
+# Slack API calls, by API method, shared by everything that calls Slack
+SLACK_API_SECONDS = REGISTRY.histogram('van_slack_api_seconds', 'Time taken by Slack API calls', ('method',))
+SLACK_API_ERRORS = REGISTRY.counter('van_slack_api_errors_total', 'Slack API calls that failed', ('method',))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = None
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        LOGGER.debug('Metrics request: ' + format, *args)
+
+
+class MetricsServer:
+    """
+    Serves the metrics in the Prometheus text format over HTTP, from a thread of its own. Nothing
+    is worked out until a scrape comes in, so the server costs next to nothing otherwise.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        port: int = DEFAULT_PORT,
+        host: str = '127.0.0.1',
+    ) -> None:
+        """
+        :param registry: the metrics to serve
+        :param port: the port to listen on (0 for any free port)
+        :param host: the address to listen on. Only local by default.
+        """
+        handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+        LOGGER.info('Serving metrics on http://%s:%s/metrics', *self.address)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
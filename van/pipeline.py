@@ -0,0 +1,199 @@
+import queue
+import threading
+from collections import (
+    defaultdict,
+    deque,
+)
+from typing import (
+    Any,
+    Dict,
+    List,
+    Tuple,
+)
+
+from van.logs import get_logger
+from van.res_reservation import (
+    ResourceReservationProcessor,
+    normalize_resource_name,
+)
+from van.reservation_namespaces import ReservationNamespaces
+from van.responses import (
+    Responder,
+    Response,
+)
+from van.send_queue import SendQueue
+
+LOGGER = get_logger(__name__)
+
+# Number of messages handled at the same time. Messages about the same resource or in the same
+# channel are still handled one at a time, in order.
+DEFAULT_WORKERS = 4
+# Number of threads posting responses. Each channel is always posted to by the same thread.
+DEFAULT_SENDERS = 2
+
+
+class _Message:
+    """
+    A message waiting to be handled, along with the ordering keys it has to wait its turn on.
+    """
+    __slots__ = ('message_tokens', 'context_dict', 'keys', 'scheduled')
+
+    def __init__(self, message_tokens: List[str], context_dict: Dict[str, Any], keys: Tuple) -> None:
+        self.message_tokens = message_tokens
+        self.context_dict = context_dict
+        self.keys = keys
+        self.scheduled = False
+
+
+class MessagePipeline:
+    """
+    Handles messages off the RTM event loop. Messages are queued by submit(), handled by a pool
+    of worker threads and their responses posted by separate sender threads, so that a slow
+    handler or Slack API call doesn't hold up other events.
+
+    Messages in the same channel, and messages about the same resource, are handled in the
+    order they were submitted. Unrelated messages are handled concurrently.
+    """
+
+    def __init__(
+        self,
+        processor: Any,
+        workers: int = DEFAULT_WORKERS,
+        senders: int = DEFAULT_SENDERS,
+        send_queue: SendQueue = None,
+        namespaces: ReservationNamespaces = None,
+    ) -> None:
+        """
+        :param processor: the ResourceReservationProcessor to handle messages with
+        :param workers: the maximum number of messages to handle at the same time
+        :param senders: the number of threads posting responses
+        :param send_queue: if provided, responses are posted through this queue
+        :param namespaces: the processor's ReservationNamespaces, if it has them. Messages about
+            resources of the same name in different namespaces are then handled independently.
+        """
+        if workers < 1 or senders < 1:
+            raise ValueError('workers and senders must be positive')
+        self.processor = processor
+        self.send_queue = send_queue
+        self.namespaces = namespaces
+
+        self._lock = threading.Condition()
+        # Ordering key -> messages waiting on it, oldest first. A message is handled once it is
+        # first in line for all of its keys.
+        self._lines = defaultdict(deque)
+        self._pending = 0
+        self._ready = queue.Queue()
+        self._send_queues = [queue.Queue() for _ in range(senders)]
+
+        self._workers = [
+            threading.Thread(target=self._work, name=f'MessagePipeline-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        self._senders = [
+            threading.Thread(target=self._send, args=(send_queue,), name=f'MessagePipeline-sender-{i}', daemon=True)
+            for i, send_queue in enumerate(self._send_queues)
+        ]
+        for thread in self._workers + self._senders:
+            thread.start()
+
+    def _ordering_keys(self, message_tokens: List[str], context_dict: Dict[str, Any]) -> Tuple:
+        keys = [('channel', context_dict.get('channel'))]
+        namespace = self.namespaces.key_for(context_dict) if self.namespaces else None
+        for command_tokens in ResourceReservationProcessor._split_commands(message_tokens):
+            for resource in command_tokens[1:]:
+                key = ('resource', namespace, normalize_resource_name(resource))
+                if key not in keys:
+                    keys.append(key)
+        return tuple(keys)
+
+    def _is_first_in_line(self, message: _Message) -> bool:
+        return all(self._lines[key][0] is message for key in message.keys)
+
+    def submit(self, message_tokens: List[str], context_dict: Dict[str, Any]) -> None:
+        """
+        Queues a message to be handled. Returns right away.
+
+        :param message_tokens: the message text tokens to process (e.g. ["add", "printer-1"])
+        :param context_dict: the context of the message, as passed to process_message_text()
+        """
+        message = _Message(list(message_tokens), context_dict, self._ordering_keys(message_tokens, context_dict))
+        with self._lock:
+            self._pending += 1
+            for key in message.keys:
+                self._lines[key].append(message)
+            if self._is_first_in_line(message):
+                message.scheduled = True
+                self._ready.put(message)
+
+    def pending(self) -> int:
+        """
+        :return: the number of messages submitted and not yet handled
+        """
+        return self._pending
+
+    def _done(self, message: _Message) -> None:
+        with self._lock:
+            for key in message.keys:
+                line = self._lines[key]
+                line.popleft()
+                if not line:
+                    del self._lines[key]
+                elif not line[0].scheduled and self._is_first_in_line(line[0]):
+                    line[0].scheduled = True
+                    self._ready.put(line[0])
+            self._pending -= 1
+            self._lock.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            message = self._ready.get()
+            if message is None:
+                return
+            try:
+                responses = self.processor.process_message_text(message.message_tokens, message.context_dict)
+                if responses:
+                    self._queue_responses(message.context_dict, responses)
+            except Exception:
+                LOGGER.exception('Cannot handle message %s', message.message_tokens)
+            finally:
+                self._done(message)
+
+    def _queue_responses(self, context_dict: Dict[str, Any], responses: List[Response]) -> None:
+        channel = context_dict['channel']
+        send_queue = self._send_queues[hash(channel) % len(self._send_queues)]
+        send_queue.put((channel, context_dict['web_client'], responses))
+
+    def _send(self, send_queue: queue.Queue) -> None:
+        while True:
+            item = send_queue.get()
+            try:
+                if item is None:
+                    return
+                channel, web_client, responses = item
+                try:
+                    Responder(channel, web_client, send_queue=self.send_queue).respond_all(responses)
+                except Exception:
+                    LOGGER.exception('Cannot post responses to %s', channel)
+            finally:
+                send_queue.task_done()
+
+    def drain(self) -> None:
+        """
+        Waits until every message submitted so far has been handled and its responses posted.
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: self._pending == 0)
+        for send_queue in self._send_queues:
+            send_queue.join()
+
+    def close(self) -> None:
+        """
+        Drains the pipeline and stops its threads.
+        """
+        self.drain()
+        for _ in self._workers:
+            self._ready.put(None)
+        for send_queue in self._send_queues:
+            send_queue.put(None)
+        for thread in self._workers + self._senders:
+            thread.join()
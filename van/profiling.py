@@ -0,0 +1,234 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import (
+    Callable,
+    List,
+)
+
+from van.logs import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Seconds profiled when profiling is started by a signal, and the most that can be asked for
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 10 * 60
+# Number of functions and allocation sites listed in the text reports
+DEFAULT_TOP_N = 30
+# Frames kept for each allocation traced by tracemalloc
+DEFAULT_MEMORY_FRAMES = 5
+
+
+class Profiler:
+    """
+    Profiles the functions decorated with @profiled for a while when asked to, so that a slow bot
+    can be looked at without restarting it with ad-hoc code. Each session writes, to a directory:
+
+    * profile-<time>.pstats - cProfile stats of the profiled calls, for pstats or snakeviz
+    * profile-<time>.txt - the top functions by cumulative time
+    * memory-<time>.txt - if asked for, the top allocation sites traced by tracemalloc
+
+    Each thread making profiled calls has a cProfile profile of its own, and the profiles are
+    merged when the session ends. Between sessions, a profiled call costs one attribute check.
+    """
+
+    def __init__(
+        self,
+        directory: str = 'profiles',
+        top_n: int = DEFAULT_TOP_N,
+        sample_every: int = 1,
+        memory_frames: int = DEFAULT_MEMORY_FRAMES,
+    ) -> None:
+        """
+        :param directory: the directory to write results to
+        :param top_n: number of functions and allocation sites listed in the text reports
+        :param sample_every: profile only one in this many calls, to profile busy bots more lightly
+        :param memory_frames: frames kept for each allocation traced
+        """
+        self.directory = directory
+        self.top_n = top_n
+        self.sample_every = sample_every
+        self.memory_frames = memory_frames
+        # Whether a session is in progress
+        self.active = False
+
+        self._lock = threading.Lock()
+        self._timer = None
+        self._started_at = None
+        self._memory = False
+        self._tracing_started = False
+        self._local = threading.local()
+        self._profiles = []
+        # Profiled function name -> calls seen during the session
+        self._calls = Counter()
+
+    def start(self, seconds: float = DEFAULT_PROFILE_SECONDS, memory: bool = False) -> bool:
+        """
+        Starts profiling. The results are written once the time is up.
+
+        :param seconds: seconds to profile for, up to MAX_PROFILE_SECONDS
+        :param memory: whether to also trace memory allocations
+        :return: whether profiling was started (False if a session is already in progress)
+        """
+        seconds = min(max(seconds, 0), MAX_PROFILE_SECONDS)
+        with self._lock:
+            if self.active:
+                return False
+            self._local = threading.local()
+            self._profiles = []
+            self._calls = Counter()
+            self._started_at = time.time()
+            self._memory = memory
+            self._tracing_started = memory and not tracemalloc.is_tracing()
+            if self._tracing_started:
+                tracemalloc.start(self.memory_frames)
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            self.active = True
+        LOGGER.info('Profiling for %ss%s', seconds, ' with memory tracing' if memory else '')
+        return True
+
+    def stop(self) -> List[str]:
+        """
+        Stops profiling early, or when the time is up, and writes the results.
+
+        :return: the paths of the files written (empty if no session was in progress)
+        """
+        with self._lock:
+            if not self.active:
+                return []
+            self.active = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            profiles = self._profiles
+            calls = self._calls
+            snapshot = None
+            if self._memory:
+                snapshot = tracemalloc.take_snapshot()
+                if self._tracing_started:
+                    tracemalloc.stop()
+            started_at = self._started_at
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at))
+        paths = self._write_profile(os.path.join(self.directory, f'profile-{stamp}'), profiles, calls, started_at)
+        if snapshot is not None:
+            paths.append(self._write_memory(os.path.join(self.directory, f'memory-{stamp}.txt'), snapshot))
+        LOGGER.info('Profiling done; wrote %s', ', '.join(paths))
+        return paths
+
+    def _write_profile(
+        self,
+        path: str,
+        profiles: List[cProfile.Profile],
+        calls: Counter,
+        started_at: float,
+    ) -> List[str]:
+        report = io.StringIO()
+        report.write('Profiled {:.1f}s from {}; calls: {}\n\n'.format(
+            time.time() - started_at,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at)),
+            ', '.join(f'{name} {count}' for name, count in calls.most_common()) or 'none',
+        ))
+        paths = []
+        if profiles:
+            stats = pstats.Stats(*profiles, stream=report)
+            stats.dump_stats(path + '.pstats')
+            paths.append(path + '.pstats')
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        with open(path + '.txt', 'w') as report_file:
+            report_file.write(report.getvalue())
+        paths.append(path + '.txt')
+        return paths
+
+    def _write_memory(self, path: str, snapshot: tracemalloc.Snapshot) -> str:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        statistics = snapshot.statistics('lineno')
+        with open(path, 'w') as report_file:
+            total = sum(statistic.size for statistic in statistics)
+            report_file.write(f'{total / 1024:.1f} KiB allocated and still held; top {self.top_n} sites:\n\n')
+            for statistic in statistics[:self.top_n]:
+                report_file.write(f'{statistic}\n')
+        return path
+
+    def run(self, name: str, function: Callable, *args, **kwargs):
+        """
+        Calls a function, profiling the call if a session is in progress.
+
+        :param name: the name to count the call under
+        """
+        local = self._local
+        if not self.active or getattr(local, 'running', False):
+            return function(*args, **kwargs)
+        with self._lock:
+            self._calls[name] += 1
+            sampled = (self._calls[name] - 1) % self.sample_every == 0
+            profile = getattr(local, 'profile', None)
+            if sampled and profile is None:
+                profile = local.profile = cProfile.Profile()
+                self._profiles.append(profile)
+        if not sampled:
+            return function(*args, **kwargs)
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already running (Python 3.12+ allows only one at a time)
+            return function(*args, **kwargs)
+        local.running = True
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            local.running = False
+
+
+# The profiler of the bot, used by the functions decorated with @profiled
+PROFILER = Profiler()
+
+
+def profiled(function: Callable) -> Callable:
+    """
+    A decorator profiling calls of a function while PROFILER has a session in progress.
+    """
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.active:
+            return function(*args, **kwargs)
+        return PROFILER.run(name, function, *args, **kwargs)
+
+    return wrapper
+
+
+def install_signal_handlers(profiler: Profiler = PROFILER, seconds: float = DEFAULT_PROFILE_SECONDS) -> bool:
+    """
+    Starts profiling for a while on SIGUSR1, and profiling with memory tracing on SIGUSR2
+    (e.g. kill -USR1 <pid>). Call from the main thread.
+
+    :return: whether the handlers were installed (not on platforms without these signals)
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        return False
+
+    def handler(signum, frame):
+        # Started from another thread, as the signal may have interrupted the main thread while it
+        # held the profiler's lock
+        memory = signum == signal.SIGUSR2
+        threading.Thread(target=profiler.start, args=(seconds, memory), name='Profiler-start', daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, handler)
+    signal.signal(signal.SIGUSR2, handler)
+    return True
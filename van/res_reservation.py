@@ -1,76 +1,418 @@
+import sys
+import threading
+import time
 from collections import (
     OrderedDict,
-    defaultdict,
     namedtuple,
 )
+from contextlib import contextmanager
+from types import MappingProxyType
 from typing import (
     Any,
     Callable,
     Dict,
+    Iterable,
+    Iterator,
     List,
+    Mapping,
     Optional,
-    OrderedDict as OrderedDictType,
 )
 
 from van.logs import get_logger
 from van.message_formatting import format_at_user
+from van.metrics import REGISTRY
+from van.profiling import (
+    DEFAULT_PROFILE_SECONDS,
+    MAX_PROFILE_SECONDS,
+    PROFILER,
+    Profiler,
+    profiled,
+)
+from van.reservation_journal import (
+    QUEUE,
+    REMOVE,
+    REMOVE_ALL,
+    ReservationJournal,
+)
+from van.resource_queue import (
+    QueueSnapshot,
+    ResourceQueue,
+)
 from van.responses import Response
+from van.send_queue import SendQueue
+from van.status_board import StatusBoard
 from van.userstore import UserStore
 
 
-HandlerEntry = namedtuple('HandlerEntry', ['method', 'help_info'])
+# A command: the method handling it, its help text and, for commands that read or change the
+# reservations, the method making the reads and changes and returning a function that builds the
+# responses. The commands in a message are applied together in one batch, and the responses built
+# once the batch is done.
+HandlerEntry = namedtuple('HandlerEntry', ['method', 'help_info', 'apply'], defaults=(None,))
 ProcessResult = namedtuple('ProcessResult', ['channel', 'text'])
 
 LOGGER = get_logger(__name__)
 
+# Weight of the latest hold time in the running average hold time of a resource
+HOLD_TIME_WEIGHT = 0.3
+# Number of resources whose average hold time is remembered after their queue empties
+DEFAULT_HOLD_TIMES_SIZE = 1000
+# Most commands that can be sent in one message, separated by ;
+MAX_COMMANDS_PER_MESSAGE = 10
+# Commands that can change several resources even when given at most one resource name
+MULTI_RESOURCE_COMMANDS = frozenset(('remove-me',))
+# Number of locks the resources are spread over. Changes to resources sharing a lock wait on each other.
+DEFAULT_LOCK_SHARDS = 64
+
+# Time taken to handle each command, by command name
+COMMAND_SECONDS = REGISTRY.histogram('van_command_seconds', 'Time taken to handle a command', ('command',))
+COMMAND_ERRORS = REGISTRY.counter('van_command_errors_total', 'Commands that raised an error', ('command',))
+
+
+class ReservationLimitError(Exception):
+    """
+    Raised when queuing a user would go over the limit on the number of resources or on queue length.
+    """
+
+
+def normalize_resource_name(resource: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a resource name so differently typed names of a resource (e.g. "Printer" and
+    "printer") share one queue. The name is interned, since it is kept as a key in several places.
+
+    :param resource: the resource name as typed
+    :return: the normalized name
+    """
+    if resource:
+        resource = sys.intern(resource.strip().lower())
+    return resource
+
+
+def _ordinal(number: int) -> str:
+    if 10 <= number % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return f'{number}{suffix}'
+
+
+def _format_duration(seconds: float) -> str:
+    minutes = round(seconds / 60)
+    if minutes < 1:
+        return 'under a minute'
+    if minutes < 60:
+        return f'about {minutes} minute{"s" if minutes != 1 else ""}'
+    hours = round(minutes / 60, 1)
+    return f'about {hours:g} hour{"s" if hours != 1 else ""}'
+
 
 class ResourceReservation:
     """
-    Tracks resource reservations to user IDs.
+    Tracks resource reservations to user IDs. A resource exists only while its queue has users in it.
+
+    Safe to use from several threads. Changes to a resource are made holding one of a fixed set of
+    locks, picked by the resource name, so changes to unrelated resources rarely wait on each
+    other. A global lock is only taken briefly, to update the state shared by all resources (the
+    user index, hold times and the resources changed since the last snapshot).
+
+    Readers of all the resources get an unchanging snapshot from get_resources(). Once taken, a
+    snapshot is shared by all readers until the next change, and reading it takes no locks.
     """
-    def __init__(self) -> None:
-        self.resources = defaultdict(OrderedDictType[str, str])
+    def __init__(
+        self,
+        journal: ReservationJournal = None,
+        max_resources: int = None,
+        max_queue_len: int = None,
+        lock_shards: int = DEFAULT_LOCK_SHARDS,
+    ) -> None:
+        """
+        :param journal: if provided, reservations are restored from and saved to this journal
+        :param max_resources: if provided, the most resources that can have users queued at once
+        :param max_queue_len: if provided, the most users that can be queued for a resource
+        :param lock_shards: number of locks the resources are spread over
+        """
+        self.max_resources = max_resources
+        self.max_queue_len = max_queue_len
+        # The live queues. Only read or change a queue holding the lock for its resource. Resources
+        # are only added to or dropped from it holding _lock as well.
+        self.resources = {}
+        # User ID -> the resources the user is queued for, in the order they were queued for them
+        self.user_resources = {}
+        # Callables called with the details of each change made
+        self.listeners = []
+        # Resource -> (user ID at the front of its queue, when they got there)
+        self._heads = {}
+        # Resource -> running average of the seconds users hold it for, least recently updated first
+        self.hold_times = OrderedDict()
+        # Reentrant, so changes can be made inside a batch()
+        self._shard_locks = [threading.RLock() for _ in range(lock_shards)]
+        # Guards the state shared by all resources: the resources themselves (but not their queues),
+        # the user index, hold times and changed resources. Taken after the lock of a resource.
+        self._lock = threading.Lock()
+        # Held while a snapshot is taken, and by batch() so that a batch can take snapshots too.
+        # Taken before the locks of the resources.
+        self._snapshot_lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        # Resource -> snapshot of its queue as of the last snapshot taken
+        self._published = {}
+        # Resources changed since the last snapshot was taken -> whether they were added or dropped.
+        # Their queues are copied when the next snapshot is taken, so a queue changed many times in
+        # between is only copied once.
+        self._changed = {}
+        self._version = 0
+        # (version, snapshot of all the queues) as of the last call to get_resources()
+        self._snapshot = None
+        self._replaying = False
+        self.journal = None
+        if journal:
+            # Replayed changes happen all at once, so they say nothing about how long resources are
+            # held. Limits are not applied either, so lowering them doesn't lose reservations.
+            self._replaying = True
+            try:
+                journal.replay(self)
+            finally:
+                self._replaying = False
+            self.journal = journal
+
+    def _lock_for(self, resource: str) -> threading.RLock:
+        return self._shard_locks[hash(resource) % len(self._shard_locks)]
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Holds the locks of all the resources, so that a series of changes and reads made by this
+        thread isn't interleaved with changes from other threads. Keep batches short: every
+        change waits on them.
+        """
+        with self._snapshot_lock:
+            for lock in self._shard_locks:
+                lock.acquire()
+            try:
+                yield
+            finally:
+                for lock in reversed(self._shard_locks):
+                    lock.release()
+
+    def _record(self, op: str, *args: Any) -> None:
+        """
+        Journals a change and tells the listeners about it. Called holding the lock of the
+        resource changed, so listeners must not call get_resources().
+        """
+        if self.journal:
+            self.journal.append(op, *args)
+        for listener in self.listeners:
+            listener(op, *args)
+
+    def _compact_if_needed(self) -> None:
+        """
+        Compacts the journal if it is due. Call holding no resource lock, or all of them in a
+        batch(): compaction takes all of them, so that the queues saved match the records in the
+        journal.
+        """
+        if not (self.journal and self.journal.needs_compaction()):
+            return
+        if not self._compact_lock.acquire(blocking=False):
+            # Another thread is already compacting
+            return
+        try:
+            with self.batch():
+                if self.journal.needs_compaction():
+                    self.journal.compact(self.resources)
+        finally:
+            self._compact_lock.release()
+
+    def _changed_resource(self, resource: str, added_or_dropped: bool = False) -> None:
+        """
+        Notes a change to the queue of a resource for the next snapshot. Call with the lock for the
+        resource and _lock held.
+        """
+        if added_or_dropped:
+            # Moved to the end, so the snapshot lists resources in the order they were added
+            self._changed.pop(resource, None)
+            self._changed[resource] = True
+        else:
+            self._changed.setdefault(resource, False)
+        self._version += 1
+
+    def _track_head(self, resource: str) -> None:
+        """
+        Notes when the user at the front of the queue for a resource changes, updating the
+        average hold time of the resource when the previous one left the queue. Call with the
+        lock for the resource and _lock held.
+        """
+        if self._replaying:
+            return
+        resource_queue = self.resources.get(resource)
+        head = resource_queue.first() if resource_queue else None
+        previous = self._heads.get(resource)
+        if previous and previous[0] == head:
+            return
+        now = time.monotonic()
+        if previous and previous[0] not in (resource_queue or ()):
+            held = now - previous[1]
+            average = self.hold_times.get(resource)
+            self.hold_times[resource] = held if average is None else average + HOLD_TIME_WEIGHT * (held - average)
+            self.hold_times.move_to_end(resource)
+            if len(self.hold_times) > DEFAULT_HOLD_TIMES_SIZE:
+                self.hold_times.popitem(last=False)
+        if head is None:
+            self._heads.pop(resource, None)
+        else:
+            self._heads[resource] = (head, now)
 
     def queue(self, resource: str, user_id: str, to_front=False) -> bool:
         """
         Adds a user_id to the queue for a resource.
 
         :returns: True if a change was made.
+        :raises ReservationLimitError: if the resource is new and there are already max_resources
+            resources, or the queue for the resource already has max_queue_len users
         """
         updated = False
+        resource = normalize_resource_name(resource)
         if resource and user_id:
-            resource_queue = self.resources[resource]
-            if user_id not in resource_queue:
-                resource_queue[user_id] = user_id
-                resource_queue.move_to_end(user_id, not to_front)
-                updated = True
+            with self._lock_for(resource):
+                resource_queue = self.resources.get(resource)
+                if resource_queue is None or user_id not in resource_queue:
+                    added = resource_queue is None
+                    if added:
+                        with self._lock:
+                            if not self._replaying:
+                                self._check_limits(resource, resource_queue)
+                            resource_queue = self.resources[resource] = ResourceQueue()
+                            # Noted along with adding the resource, so snapshots list resources in
+                            # the same order
+                            self._changed_resource(resource, True)
+                    elif not self._replaying:
+                        self._check_limits(resource, resource_queue)
+                    if to_front:
+                        resource_queue.appendleft(user_id)
+                    else:
+                        resource_queue.append(user_id)
+                    with self._lock:
+                        self.user_resources.setdefault(user_id, {})[resource] = None
+                        if not added:
+                            self._changed_resource(resource)
+                        self._track_head(resource)
+                    updated = True
+                    self._record(QUEUE, resource, user_id, int(to_front))
+        if updated:
+            self._compact_if_needed()
         return updated
 
+    def _check_limits(self, resource: str, resource_queue: Optional[ResourceQueue]) -> None:
+        if resource_queue is None:
+            if self.max_resources is not None and len(self.resources) >= self.max_resources:
+                raise ReservationLimitError(
+                    f'Cannot reserve *{resource}*: the limit of {self.max_resources} resources is reached'
+                )
+        elif self.max_queue_len is not None and len(resource_queue) >= self.max_queue_len:
+            raise ReservationLimitError(
+                f'Cannot queue for *{resource}*: the limit of {self.max_queue_len} users in a queue is reached'
+            )
+
+    def _unindex(self, resource: str, user_id: str) -> None:
+        """
+        Removes a resource from the resources of a user. Call with _lock held.
+        """
+        user_resources = self.user_resources.get(user_id)
+        if user_resources is not None:
+            user_resources.pop(resource, None)
+            if not user_resources:
+                del self.user_resources[user_id]
+
     def get_queue_len(self, resource: str) -> int:
         length = 0
-        if resource in self.resources:
-            length = len(self.resources[resource])
+        resource = normalize_resource_name(resource)
+        with self._lock_for(resource):
+            resource_queue = self.resources.get(resource)
+            if resource_queue is not None:
+                length = len(resource_queue)
         return length
 
+    def get_resource_count(self) -> int:
+        """
+        :return: the number of resources that have users queued for them
+        """
+        return len(self.resources)
+
+    def get_queued_count(self) -> int:
+        """
+        :return: the number of places taken in all the queues
+        """
+        with self._lock:
+            return sum(len(resource_queue) for resource_queue in self.resources.values())
+
     def get_user_id_at_front(self, resource: str) -> Optional[str]:
         user_id = None
-        ordered_dict = self.resources.get(resource)
-        if ordered_dict:
-            user_id = next(iter(self.resources[resource].values()))
+        resource = normalize_resource_name(resource)
+        with self._lock_for(resource):
+            resource_queue = self.resources.get(resource)
+            if resource_queue:
+                user_id = resource_queue.first()
         return user_id
 
+    def get_position(self, resource: str, user_id: str) -> Optional[int]:
+        """
+        Returns the position of a user in the queue for a resource.
+
+        :returns: the position, starting at 0 for the user at the front, or None if not queued
+        """
+        resource = normalize_resource_name(resource)
+        with self._lock_for(resource):
+            resource_queue = self.resources.get(resource)
+            if resource_queue is None:
+                return None
+            return resource_queue.position(user_id)
+
+    def get_expected_wait(self, resource: str, user_id: str) -> Optional[float]:
+        """
+        Estimates how long a user will wait to get to the front of the queue for a resource,
+        from how long users have held the resource so far.
+
+        :returns: the expected wait in seconds, or None if not queued or there is nothing to
+            estimate from yet
+        """
+        resource = normalize_resource_name(resource)
+        position = self.get_position(resource, user_id)
+        if position is None:
+            return None
+        if position == 0:
+            return 0.0
+        average = self.hold_times.get(resource)
+        if average is None:
+            return None
+        wait = position * average
+        head = self._heads.get(resource)
+        if head:
+            # The user at the front has already had some of their time
+            wait -= min(time.monotonic() - head[1], average)
+        return max(wait, 0.0)
+
     def remove(self, resource: str, user_id: str) -> bool:
         """
-        Removes a user_id from the queue for a resource.
+        Removes a user_id from the queue for a resource. The resource is dropped once its queue is empty.
 
         :returns: True if a change was made.
         """
         updated = False
+        resource = normalize_resource_name(resource)
         if resource and user_id:
-            resource_queue = self.resources[resource]
-            if user_id in resource_queue:
-                del resource_queue[user_id]
-                updated = True
+            with self._lock_for(resource):
+                resource_queue = self.resources.get(resource)
+                if resource_queue is not None and user_id in resource_queue:
+                    resource_queue.remove(user_id)
+                    dropped = not resource_queue
+                    with self._lock:
+                        if dropped:
+                            del self.resources[resource]
+                        self._unindex(resource, user_id)
+                        self._changed_resource(resource, dropped)
+                        self._track_head(resource)
+                    updated = True
+                    self._record(REMOVE, resource, user_id)
+        if updated:
+            self._compact_if_needed()
         return updated
 
     def remove_all(self, resource: str) -> bool:
@@ -80,18 +422,67 @@ class ResourceReservation:
         :returns: True if a change was made.
         """
         updated = False
-        if resource and resource in self.resources:
-            self.resources[resource] = OrderedDict()
-            updated = True
+        resource = normalize_resource_name(resource)
+        if resource:
+            with self._lock_for(resource):
+                if resource in self.resources:
+                    with self._lock:
+                        for user_id in self.resources.pop(resource):
+                            self._unindex(resource, user_id)
+                        self._changed_resource(resource, True)
+                        self._track_head(resource)
+                    updated = True
+                    self._record(REMOVE_ALL, resource)
+        if updated:
+            self._compact_if_needed()
         return updated
 
-    def get_resources(self) -> Dict[str, OrderedDictType[str, str]]:
+    def get_user_resources(self, user_id: str) -> List[str]:
+        """
+        Returns the resources a user is queued for.
+
+        :returns: the resource names, in the order the user was queued for them
         """
-        Returns all the reserved resources along with the user IDs in their queues.
+        with self._lock:
+            return list(self.user_resources.get(user_id, ()))
 
-        :returns: a dict keyed by resource name to the queued user IDs to the resource
+    def remove_user(self, user_id: str) -> List[str]:
         """
-        return self.resources
+        Removes a user_id from the queues of all resources.
+
+        :returns: the resources the user was removed from
+        """
+        return [resource for resource in self.get_user_resources(user_id) if self.remove(resource, user_id)]
+
+    def get_resources(self) -> Mapping[str, QueueSnapshot]:
+        """
+        Returns all the reserved resources along with the user IDs in their queues. The result is a
+        snapshot: it doesn't change as reservations are made, and is safe to read from any thread.
+
+        :returns: a read-only mapping keyed by resource name to the queued user IDs to the resource
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != self._version:
+            with self._snapshot_lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[0] != self._version:
+                    with self._lock:
+                        version = self._version
+                        changed, self._changed = self._changed, {}
+                    # Each queue is copied holding the lock of its resource only. Changes made
+                    # meanwhile are noted for the next snapshot, so none are missed.
+                    copies = []
+                    for resource, added_or_dropped in changed.items():
+                        with self._lock_for(resource):
+                            resource_queue = self.resources.get(resource)
+                            copies.append((resource, added_or_dropped, resource_queue and resource_queue.snapshot()))
+                    for resource, added_or_dropped, queue_snapshot in copies:
+                        if added_or_dropped:
+                            self._published.pop(resource, None)
+                        if queue_snapshot:
+                            self._published[resource] = queue_snapshot
+                    snapshot = self._snapshot = (version, MappingProxyType(dict(self._published)))
+        return snapshot[1]
 
 
 class ResourceReservationProcessor:
@@ -99,24 +490,128 @@ class ResourceReservationProcessor:
     Resource reservation processor that will maintain a queue of users for named resources.
     """
 
-    def __init__(self, user_store: UserStore) -> None:
-        self.reservations = ResourceReservation()
+    def __init__(
+        self,
+        user_store: UserStore,
+        reservations: ResourceReservation = None,
+        status_board_debounce: float = None,
+        namespaces: Any = None,
+        profiler: Profiler = PROFILER,
+        admin_user_ids: Iterable[str] = (),
+        send_queue: SendQueue = None,
+    ) -> None:
+        """
+        :param user_store: UserStore to get user names from
+        :param reservations: the reservations to manage (new, empty reservations if neither these
+            nor namespaces are provided)
+        :param status_board_debounce: if provided, enables the board command, with boards updated
+            this many seconds after a change
+        :param namespaces: if provided, the ReservationNamespaces to manage instead, each message
+            using the reservations of its channel or workspace
+        :param profiler: the profiler the profile command starts and stops
+        :param admin_user_ids: IDs of the users allowed to use admin commands. If provided, enables
+            the profile command.
+        :param send_queue: if provided, status boards are posted through this queue
+        """
+        if reservations is None and namespaces is None:
+            reservations = ResourceReservation()
+        self.reservations = reservations
+        self.namespaces = namespaces
         self.user_store = user_store
+        self.status_board_debounce = status_board_debounce
+        self.profiler = profiler
+        self.admin_user_ids = frozenset(admin_user_ids)
+        self.send_queue = send_queue
+        # Reservations -> resource -> (queue version, user generation, status line) of the last
+        # status line rendered
+        self._status_caches = {}
+        # Namespace key -> status board of the namespace
+        self._status_boards = {}
+        self._lock = threading.Lock()
 
         self.command_handlers = {
             'hello': HandlerEntry(method=self.hello, help_info='*hello* - prints hello back to you'),
-            'status': HandlerEntry(method=self.status, help_info='*status* - status of resources'),
-            'add': HandlerEntry(method=self.add, help_info='*add x* - adds you to the resource x'),
-            'remove': HandlerEntry(method=self.remove, help_info='*remove x* - removes you from resource x'),
-            'remove-all': HandlerEntry(method=self.remove_all, help_info='*remove-all x* - frees up resource x'),
+            'status': HandlerEntry(
+                method=self.status,
+                help_info='*status [x]* - status of resources, or only of x (end x with `*` to match a prefix)',
+                apply=self._apply_status,
+            ),
+            'add': HandlerEntry(
+                method=self.add,
+                help_info='*add x [y ...]* - adds you to the resources x, y, ...',
+                apply=self._apply_add,
+            ),
+            'remove': HandlerEntry(
+                method=self.remove,
+                help_info='*remove x [y ...]* - removes you from the resources x, y, ...',
+                apply=self._apply_remove,
+            ),
+            'remove-all': HandlerEntry(
+                method=self.remove_all,
+                help_info='*remove-all x [y ...]* - frees up the resources x, y, ...',
+                apply=self._apply_remove_all,
+            ),
+            'mine': HandlerEntry(
+                method=self.mine, help_info='*mine* - resources you are queued for', apply=self._apply_mine
+            ),
+            'position': HandlerEntry(
+                method=self.position,
+                help_info='*position x [y ...]* - your place in line for the resources x, y, ...',
+                apply=self._apply_position,
+            ),
+            'remove-me': HandlerEntry(
+                method=self.remove_me,
+                help_info='*remove-me* - removes you from all resources',
+                apply=self._apply_remove_me,
+            ),
             'help': HandlerEntry(method=self.help, help_info='*help* - this message')
         }
 
+        self.status_board = None
+        if status_board_debounce is not None:
+            if namespaces is None:
+                # Namespaces get a board of their own when first asked for one
+                self.status_board = StatusBoard(
+                    self._status_text, debounce=status_board_debounce, send_queue=send_queue
+                )
+                self.reservations.listeners.append(self.status_board.changed)
+            self.command_handlers['board'] = HandlerEntry(
+                method=self.board,
+                help_info='*board* - keeps a live status of resources in this channel (*board off* to stop)'
+            )
+        if self.admin_user_ids:
+            self.command_handlers['profile'] = HandlerEntry(
+                method=self.profile,
+                help_info='*profile [seconds] [memory]* - (admins only) profiles the bot (*profile stop* to stop)'
+            )
+
+    def _reservations_for(self, context_dict: Dict[str, Any]) -> ResourceReservation:
+        if self.namespaces is None:
+            return self.reservations
+        return self.namespaces.for_context(context_dict)
+
+    def _status_board_for(self, context_dict: Dict[str, Any]) -> StatusBoard:
+        if self.namespaces is None:
+            return self.status_board
+        key = self.namespaces.key_for(context_dict)
+        with self._lock:
+            status_board = self._status_boards.get(key)
+            if status_board is None:
+                reservations = self.namespaces.get(key)
+                status_board = StatusBoard(
+                    lambda: self._status_text(reservations),
+                    debounce=self.status_board_debounce,
+                    send_queue=self.send_queue,
+                )
+                reservations.listeners.append(status_board.changed)
+                self._status_boards[key] = status_board
+        return status_board
+
     def _user_name_for_id(self, user_id: str) -> str:
         if not user_id:
             raise ValueError('user_id is required')
-        user = self.user_store.get_cached_user_info(user_id) or {}
-        user_name = user.get('real_name') or user.get('name')
+        user = self.user_store.get_cached_user_info(user_id)
+        user_name = user and (user.real_name or user.name)
         return user_name or user_id
 
     @staticmethod
@@ -141,93 +636,368 @@ class ResourceReservationProcessor:
 
     def add(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
         """
-        A user (context_dict['user_id']) requested to be queued for a resource (params[0])
+        A user (context_dict['user_id']) requested to be queued for resources (params)
 
-        :param params: parameter map where resource name can be
+        :param params: parameter map where resource names can be
             obtained
         :param context_dict: context dictionary where user can be
             obtained
 
         :return: response messages
         """
-        responses = []
+        return self._apply_add(params, context_dict)()
+
+    def _apply_add(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
         user_id = context_dict['user_id']
-        if params:
-            resource = params[0]
-            if self.reservations.queue(resource, user_id):
+        queued = []
+        errors = []
+        up_now = []
+        for resource in self._resource_names(params):
+            try:
+                if reservations.queue(resource, user_id):
+                    queued.append(resource)
+                    if reservations.get_queue_len(resource) == 1:
+                        up_now.append(resource)
+            except ReservationLimitError as error:
+                errors.append(Response.broadcast_response(str(error)))
+
+        def respond() -> List[Response]:
+            responses = []
+            if queued:
                 user = self._user_name_for_id(user_id)
-                responses.append(
-                    Response.broadcast_response(f'{user} queued for resource *{resource}*')
-                )
-                if self.reservations.get_queue_len(resource) == 1:
-                    responses.append(
-                        Response.broadcast_response(self._compose_next_up_msg(resource, user_id))
-                    )
-        return responses
+                responses.append(Response.broadcast_response(f'{user} queued for {self._format_resources(queued)}'))
+            responses.extend(errors)
+            responses.extend(
+                Response.broadcast_response(self._compose_next_up_msg(resource, user_id)) for resource in up_now
+            )
+            return responses
+
+        return respond
+
+    @staticmethod
+    def _resource_names(params: List[str]) -> List[str]:
+        """
+        :return: the normalized resource names in params, without duplicates
+        """
+        return [resource for resource in dict.fromkeys(map(normalize_resource_name, params)) if resource]
+
+    @staticmethod
+    def _format_resources(resources: List[str]) -> str:
+        formatted = ', '.join(f'*{resource}*' for resource in resources)
+        return f'resources {formatted}' if len(resources) > 1 else f'resource {formatted}'
+
+    @staticmethod
+    def _matches(resource: str, patterns: List[str]) -> bool:
+        for pattern in patterns:
+            if pattern.endswith('*'):
+                if resource.startswith(pattern[:-1]):
+                    return True
+            elif resource == pattern:
+                return True
+        return False
+
+    def _status_lines(
+        self,
+        reservations: ResourceReservation,
+        patterns: List[str] = None,
+        all_resources: Mapping[str, QueueSnapshot] = None,
+    ) -> List[str]:
+        """
+        Renders a status line for each reserved resource. Lines are cached by the version of the
+        resource's queue and the generation of the users, so only resources whose queue or users
+        changed since the last call are rendered again.
+
+        :param reservations: the reservations to render
+        :param patterns: if provided, only resources named by one of these are included. A
+            pattern ending in * matches resources starting with the rest of it.
+        :param all_resources: if provided, the snapshot of the reservations to render instead of
+            the current one
+        :return: the status lines
+        """
+        if all_resources is None:
+            all_resources = reservations.get_resources()
+        resources = all_resources
+        if patterns:
+            patterns = [normalize_resource_name(pattern) for pattern in patterns]
+            resources = {
+                resource: queue for resource, queue in resources.items() if self._matches(resource, patterns)
+            }
+        generation = self.user_store.get_generation()
+        # Resource -> its line, starting with the cached lines that are still current
+        lines = {}
+        changed = []
+        # The cache is shared by the pipeline workers and the status board timers, so it is only
+        # touched with the lock held. Users are looked up with the lock released.
+        with self._lock:
+            cache = self._status_caches.setdefault(reservations, {})
+            for resource, queue in resources.items():
+                entry = cache.get(resource)
+                if entry and entry[:2] == (queue.version, generation):
+                    lines[resource] = entry[2]
+                else:
+                    changed.append((resource, queue))
+        if changed:
+            # Look up any users missing from the directory in one batch rather than one at a time
+            self.user_store.get_cached_user_infos(
+                user_id for _, queue in changed for user_id in queue
+            )
+            generation = self.user_store.get_generation()
+            for resource, queue in changed:
+                queued_users = ', '.join([
+                    self._user_name_for_id(user_id)
+                    for user_id in queue
+                ])
+                lines[resource] = f'*{resource}*: {queued_users}'
+        with self._lock:
+            for resource, queue in changed:
+                cache[resource] = (queue.version, generation, lines[resource])
+            if len(cache) > len(all_resources):
+                # Forget the lines of resources that were dropped
+                for resource in [resource for resource in cache if resource not in all_resources]:
+                    del cache[resource]
+        return [lines[resource] for resource in resources]
+
+    def _status_text(self, reservations: ResourceReservation = None) -> str:
+        if reservations is None:
+            reservations = self.reservations
+        return '\n'.join(self._status_lines(reservations)) or 'No resources are reserved.'
 
     def status(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
         """
-        A user has requested status of reserved resources.
+        A user has requested status of reserved resources, optionally only those named by params
+        (e.g. "printer" or "printer*").
+
+        :param params: parameter map where resource names or name prefixes can be obtained
+        :param context_dict: context dictionary where user can be obtained
+
+        :return: response messages
+        """
+        return self._apply_status(params, context_dict)()
+
+    def _apply_status(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
+        # Taken now, so that in a batch the status is as of this command
+        resources = reservations.get_resources()
+
+        def respond() -> List[Response]:
+            lines = self._status_lines(reservations, params, all_resources=resources)
+            if params and not lines:
+                return [Response.broadcast_response(f'No resources match {" ".join(params)}')]
+            return [Response.broadcast_response(line) for line in lines]
+
+        return respond
+
+    def board(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
+        """
+        A user requested a status board in the channel (context_dict['channel']), or to stop
+        updating it with "board off".
+
+        :param params: parameter map
+        :param context_dict: context dictionary where the channel and WebClient can be obtained
+
+        :return: response messages
+        """
+        channel = context_dict['channel']
+        status_board = self._status_board_for(context_dict)
+        if params and params[0].lower() == 'off':
+            if status_board.remove(channel):
+                return [Response.broadcast_response('Status board stopped')]
+            return []
+        status_board.add(channel, context_dict['web_client'])
+        return []
+
+    def profile(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
+        """
+        An admin (context_dict['user_id']) asked to profile the bot for a number of seconds
+        (params[0]), optionally tracing memory too ("memory"), or to stop profiling ("stop").
 
         :param params: parameter map
         :param context_dict: context dictionary where user can be obtained
 
         :return: response messages
         """
-        responses = []
-        for resource, queue in self.reservations.get_resources().items():
-            queued_users = ', '.join([
-                self._user_name_for_id(user_id)
-                for user_id in queue.keys()
-            ])
-            responses.append(
-                Response.broadcast_response(f'*{resource}*: {queued_users}')
-            )
-        return responses
+        if context_dict['user_id'] not in self.admin_user_ids:
+            return [Response.broadcast_response('Only admins can profile the bot')]
+        words = [param.lower() for param in params]
+        if 'stop' in words:
+            paths = self.profiler.stop()
+            if not paths:
+                return [Response.broadcast_response('Not profiling')]
+            return [Response.broadcast_response('Profiling stopped; results written to ' + ', '.join(paths))]
+
+        seconds = next((int(word) for word in words if word.isdigit()), DEFAULT_PROFILE_SECONDS)
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        memory = 'memory' in words
+        if not self.profiler.start(seconds, memory=memory):
+            return [Response.broadcast_response('Already profiling')]
+        return [Response.broadcast_response(
+            f'Profiling for {seconds} seconds{" with memory tracing" if memory else ""}; '
+            f'results will be written to {self.profiler.directory}'
+        )]
 
     def remove(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
         """
-        A user (context_dict['user']) is releasing a previously-held resource (params[0])
+        A user (context_dict['user']) is releasing previously-held resources (params)
 
-        :param params: parameter map where resource name can be obtained
+        :param params: parameter map where resource names can be obtained
         :param context_dict: context dictionary where user can be obtained
 
         :return: response messages
         """
-        responses = []
+        return self._apply_remove(params, context_dict)()
+
+    def _apply_remove(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
         user_id = context_dict['user_id']
-        if params:
-            resource = params[0]
-            head_of_queue = self.reservations.get_user_id_at_front(resource)
-            if self.reservations.remove(resource, user_id):
+        removed = []
+        next_ups = []
+        for resource in self._resource_names(params):
+            head_of_queue = reservations.get_user_id_at_front(resource)
+            if reservations.remove(resource, user_id):
+                removed.append(resource)
+                next_up = reservations.get_user_id_at_front(resource)
+                if next_up and next_up != head_of_queue:
+                    next_ups.append(Response.broadcast_response(self._compose_next_up_msg(resource, next_up)))
+
+        def respond() -> List[Response]:
+            responses = []
+            if removed:
                 user = self._user_name_for_id(user_id)
-                responses.append(Response.broadcast_response(f'{user} removed from resource *{resource}*'))
+                responses.append(Response.broadcast_response(f'{user} removed from {self._format_resources(removed)}'))
+            responses.extend(next_ups)
+            return responses
 
-                next_up = self.reservations.get_user_id_at_front(resource)
-                if next_up and next_up != head_of_queue:
-                    responses.append(
-                        Response.broadcast_response(self._compose_next_up_msg(resource, next_up))
-                    )
-        return responses
+        return respond
 
     def remove_all(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
         """
-        A user (context_dict['user']) is releasing all queued users from a resource (params[0]).
+        A user (context_dict['user']) is releasing all queued users from resources (params).
+
+        :param params: parameter map where resource names can be obtained
+        :param context_dict: context dictionary where user can be obtained
+
+        :return: response messages
+        """
+        return self._apply_remove_all(params, context_dict)()
+
+    def _apply_remove_all(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
+        user_id = context_dict['user_id']
+        removed = [resource for resource in self._resource_names(params) if reservations.remove_all(resource)]
+
+        def respond() -> List[Response]:
+            responses = []
+            if removed:
+                user = self._user_name_for_id(user_id)
+                responses.append(
+                    Response.broadcast_response(f'{user} removed *everyone* from {self._format_resources(removed)}')
+                )
+            return responses
+
+        return respond
+
+    def mine(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
+        """
+        A user (context_dict['user_id']) requested the resources they are queued for.
+
+        :param params: parameter map
+        :param context_dict: context dictionary where user can be obtained
+
+        :return: response messages
+        """
+        return self._apply_mine(params, context_dict)()
+
+    def _apply_mine(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
+        user_id = context_dict['user_id']
+        resources = []
+        for resource in reservations.get_user_resources(user_id):
+            if reservations.get_user_id_at_front(resource) == user_id:
+                resources.append(f'*{resource}* (up now)')
+            else:
+                resources.append(f'*{resource}*')
+
+        def respond() -> List[Response]:
+            user = self._user_name_for_id(user_id)
+            if resources:
+                return [Response.broadcast_response(f'{user} is queued for {", ".join(resources)}')]
+            return [Response.broadcast_response(f'{user} is not queued for any resource')]
+
+        return respond
+
+    def position(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
+        """
+        A user (context_dict['user_id']) requested their position in the queues for resources (params)
+
+        :param params: parameter map where resource names can be obtained
+        :param context_dict: context dictionary where user can be obtained
+
+        :return: response messages
+        """
+        return self._apply_position(params, context_dict)()
+
+    def _apply_position(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
+        user_id = context_dict['user_id']
+        # (resource, position, expected wait)
+        positions = []
+        for resource in self._resource_names(params):
+            position = reservations.get_position(resource, user_id)
+            wait = reservations.get_expected_wait(resource, user_id) if position else None
+            positions.append((resource, position, wait))
+
+        def respond() -> List[Response]:
+            responses = []
+            for resource, position, wait in positions:
+                user = self._user_name_for_id(user_id)
+                if position is None:
+                    message = f'{user} is not queued for resource *{resource}*'
+                elif position == 0:
+                    message = f'{user} is up now for resource *{resource}*'
+                else:
+                    wait_text = 'no wait estimate yet' if wait is None else f'expected wait {_format_duration(wait)}'
+                    message = f'{user} is {_ordinal(position + 1)} in line for resource *{resource}* ({wait_text})'
+                responses.append(Response.broadcast_response(message))
+            return responses
+
+        return respond
+
+    def remove_me(self, params: List[str], context_dict: Dict[str, Any]) -> List[Response]:
+        """
+        A user (context_dict['user_id']) is releasing every resource they are queued for.
 
         :param params: parameter map
         :param context_dict: context dictionary where user can be obtained
 
         :return: response messages
         """
-        responses = []
+        return self._apply_remove_me(params, context_dict)()
+
+    def _apply_remove_me(self, params: List[str], context_dict: Dict[str, Any]) -> Callable[[], List[Response]]:
+        reservations = self._reservations_for(context_dict)
         user_id = context_dict['user_id']
-        if params:
-            resource = params[0]
-            if self.reservations.remove_all(resource):
+        heads_of_queues = {
+            resource: reservations.get_user_id_at_front(resource)
+            for resource in reservations.get_user_resources(user_id)
+        }
+        resources = reservations.remove_user(user_id)
+        next_ups = []
+        for resource in resources:
+            next_up = reservations.get_user_id_at_front(resource)
+            if next_up and next_up != heads_of_queues[resource]:
+                next_ups.append(Response.broadcast_response(self._compose_next_up_msg(resource, next_up)))
+
+        def respond() -> List[Response]:
+            responses = []
+            if resources:
                 user = self._user_name_for_id(user_id)
-                responses.append(Response.broadcast_response(f'{user} removed *everyone* from resource *{resource}*'))
+                formatted_resources = ', '.join(f'*{resource}*' for resource in resources)
+                responses.append(Response.broadcast_response(f'{user} removed from resources {formatted_resources}'))
+                responses.extend(next_ups)
+            return responses
 
-        return responses
+        return respond
 
     def help(self, params, context_dict) -> List[Response]:
         """
@@ -243,7 +1013,7 @@ class ResourceReservationProcessor:
                 '\n'.join(
                     f'{handler_entry.help_info}'
                     for handler_entry in self.command_handlers.values()
-                )
+                ) + '\nSeparate commands with *;* to send several in one message'
             )
         ]
 
@@ -264,21 +1034,109 @@ class ResourceReservationProcessor:
                 handler = handler_entry[0]
         return handler
 
+    @profiled
     def process_message_text(self, message_tokens: List[str], context_dict: Dict) -> List[Response]:
         """
         Process a message text and return a ProcessResult or None if there is nothing processed.
+        The message can hold several commands separated by ; (e.g. "add printer; remove scanner").
 
         :param message_tokens: the message text tokens to process (e.g. ["add", "printer-1"])
         :param context_dict: the context dictionary with information about the environment/context of the message
             (e.g. the user that sent this message)
         :return: responses to send back
         """
+        commands = self._split_commands(message_tokens)
+        if len(commands) > MAX_COMMANDS_PER_MESSAGE:
+            message = f'Too many commands in one message (the limit is {MAX_COMMANDS_PER_MESSAGE})'
+            return [Response.broadcast_response(message)]
+        if len(commands) == 1 and len(commands[0]) <= 2 and commands[0][0].lower() not in MULTI_RESOURCE_COMMANDS:
+            # A single command on at most one resource needs no batch
+            return self._process_command(commands[0], context_dict)
+        # The commands are applied in order as one batch, without changes from other messages in
+        # between, so each read (e.g. status) sees exactly the changes made by the commands before
+        # it. Only the reads and changes are made holding the batch: users are looked up and
+        # responses built once it is done.
+        responders = [None] * len(commands)
+        applied = [i for i, command in enumerate(commands) if self._get_apply_method(command[0])]
+        if applied:
+            with self._reservations_for(context_dict).batch():
+                for i in applied:
+                    responders[i] = self._apply_command(commands[i], context_dict)
+        result = []
+        for command, respond in zip(commands, responders):
+            result.extend(self._process_command(command, context_dict, respond=respond))
+        return result
+
+    @staticmethod
+    def _split_commands(message_tokens: List[str]) -> List[List[str]]:
+        """
+        Splits message tokens into commands separated by ; (e.g. ["add", "a;", "remove", "b"] into
+        [["add", "a"], ["remove", "b"]]).
+        """
+        commands = [[]]
+        for token in message_tokens:
+            if ';' in token:
+                for i, part in enumerate(token.split(';')):
+                    if i:
+                        commands.append([])
+                    if part:
+                        commands[-1].append(part)
+            else:
+                commands[-1].append(token)
+        return [command for command in commands if command]
+
+    def _get_apply_method(self, command: str) -> Optional[Callable]:
+        handler_entry = self.command_handlers.get(command.lower()) if command else None
+        return handler_entry.apply if handler_entry else None
+
+    def _apply_command(self, command_tokens: List[str], context_dict: Dict) -> Callable[[], List[Response]]:
+        """
+        Makes the reads and changes of a command that reads or changes the reservations.
+
+        :return: a function building the responses to the command
+        """
+        command = command_tokens[0].lower()
+        start = time.perf_counter()
+        try:
+            respond = self._get_apply_method(command)(command_tokens[1:], context_dict)
+        except Exception:
+            COMMAND_ERRORS.inc(command)
+            raise
+        apply_seconds = time.perf_counter() - start
+
+        def timed_respond() -> List[Response]:
+            # Timed once, for both the changes and the responses
+            start = time.perf_counter()
+            try:
+                return respond()
+            except Exception:
+                COMMAND_ERRORS.inc(command)
+                raise
+            finally:
+                COMMAND_SECONDS.observe(apply_seconds + time.perf_counter() - start, command)
+
+        return timed_respond
+
+    def _process_command(
+        self,
+        command_tokens: List[str],
+        context_dict: Dict,
+        respond: Callable[[], List[Response]] = None,
+    ) -> List[Response]:
+        """
+        Runs a command.
+
+        :param respond: if provided, the reads and changes of the command were already made, and this
+            builds its responses
+        """
+        if respond:
+            return respond() or []
         result = []
-        if message_tokens:
-            command = message_tokens.pop(0)
-            handler = self._get_handler_method(command)
+        if command_tokens:
+            handler = self._get_handler_method(command_tokens[0])
             if handler:
-                responses = handler(message_tokens, context_dict)
+                with COMMAND_SECONDS.time(command_tokens[0].lower(), errors=COMMAND_ERRORS):
+                    responses = handler(command_tokens[1:], context_dict)
                 if responses:
                     result.extend(responses)
         return result
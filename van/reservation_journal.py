@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Iterable,
+    Mapping,
+)
+
+from van.logs import get_logger
+
+LOGGER = get_logger(__name__)
+
+# Seconds between fsyncs of the journal. Changes made within this window can be lost in a crash.
+DEFAULT_SYNC_INTERVAL = 0.05
+# Number of journal records after which the journal is compacted into a snapshot
+DEFAULT_COMPACT_EVERY = 10000
+
+QUEUE = 'q'
+REMOVE = 'r'
+REMOVE_ALL = 'ra'
+
+
+class _JournalSyncer:
+    """
+    Fsyncs the journals holding changes not yet on disk, from one thread shared by all journals.
+    The thread sleeps until a journal has such changes, so idle journals cost nothing however many
+    there are.
+    """
+
+    def __init__(self) -> None:
+        # Journals with changes to sync
+        self._pending = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, journal: 'ReservationJournal') -> None:
+        """
+        Syncs a journal once its sync_interval has passed since it was last synced.
+        """
+        with self._condition:
+            if journal in self._pending:
+                return
+            self._pending.add(journal)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ReservationJournal-sync', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                now = time.monotonic()
+                due = [journal for journal in self._pending if journal.sync_due_at() <= now]
+                if not due:
+                    self._condition.wait(min(journal.sync_due_at() for journal in self._pending) - now)
+                    continue
+                self._pending.difference_update(due)
+            for journal in due:
+                try:
+                    journal.sync()
+                except Exception:
+                    LOGGER.exception('Cannot sync journal %s', journal.journal_path)
+
+
+_SYNCER = _JournalSyncer()
+
+
+class ReservationJournal:
+    """
+    Durable storage for a ResourceReservation. Each change is appended to a journal file, and
+    the journal is periodically compacted into a snapshot of all the queues. On startup, the
+    snapshot and the journal records made after it are replayed.
+
+    Each record carries a sequence number, and the snapshot the number of the last record it
+    includes, so records are never applied twice even if a crash happens mid-compaction.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sync_interval: float = DEFAULT_SYNC_INTERVAL,
+        compact_every: int = DEFAULT_COMPACT_EVERY,
+    ) -> None:
+        """
+        :param directory: the directory to keep the journal and snapshot files in
+        :param sync_interval: seconds between fsyncs of the journal. 0 fsyncs every record.
+        :param compact_every: number of journal records after which to write a snapshot
+        """
+        if not directory:
+            raise ValueError('directory required')
+        os.makedirs(directory, exist_ok=True)
+        self.journal_path = os.path.join(directory, 'reservations.journal')
+        self.snapshot_path = os.path.join(directory, 'reservations.snapshot')
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+
+        self._seq = 0
+        self._records_since_snapshot = 0
+        self._file = None
+        self._dirty = False
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
+
+    def _load_snapshot(self, reservation: Any) -> int:
+        if not os.path.exists(self.snapshot_path):
+            return 0
+        with open(self.snapshot_path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        for resource, user_ids in snapshot['resources'].items():
+            for user_id in user_ids:
+                reservation.queue(resource, user_id)
+        return snapshot['seq']
+
+    def replay(self, reservation: Any) -> None:
+        """
+        Restores the reservations saved in the snapshot and journal, then opens the journal for
+        appending. Call this once, before any records are appended.
+
+        :param reservation: the (empty) ResourceReservation to restore the reservations into
+        """
+        snapshot_seq = self._load_snapshot(reservation)
+        self._seq = snapshot_seq
+        valid_length = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as journal_file:
+                for line in journal_file:
+                    try:
+                        seq, op, *args = json.loads(line)
+                    except ValueError:
+                        # A record cut short by a crash. Nothing after it was acknowledged.
+                        LOGGER.warning('Ignoring incomplete journal record at byte %s', valid_length)
+                        break
+                    valid_length += len(line)
+                    if seq <= snapshot_seq:
+                        continue
+                    if op == QUEUE:
+                        reservation.queue(args[0], args[1], to_front=bool(args[2]))
+                    elif op == REMOVE:
+                        reservation.remove(args[0], args[1])
+                    elif op == REMOVE_ALL:
+                        reservation.remove_all(args[0])
+                    self._seq = seq
+                    self._records_since_snapshot += 1
+
+        self._file = open(self.journal_path, 'a+b')
+        self._file.truncate(valid_length)
+        LOGGER.info('Replayed reservations up to record %s', self._seq)
+
+    def _sync(self) -> None:
+        """
+        Flushes the journal to disk. Call with _lock held.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def sync_due_at(self) -> float:
+        """
+        :return: when the journal is next due to be fsynced, in time.monotonic() seconds
+        """
+        return self._last_sync + self.sync_interval
+
+    def sync(self) -> None:
+        """
+        Flushes any changes not yet on disk.
+        """
+        with self._lock:
+            if self._dirty and self._file:
+                self._sync()
+
+    def append(self, op: str, *args: Any) -> None:
+        """
+        Appends a change to the journal. The journal is fsynced right away if it hasn't been in the
+        last sync_interval seconds, otherwise by the sync thread shared by all journals once it has.
+
+        :param op: the change (QUEUE, REMOVE or REMOVE_ALL)
+        :param args: the arguments of the change
+        """
+        with self._lock:
+            self._seq += 1
+            self._file.write(json.dumps([self._seq, op, *args], separators=(',', ':')).encode() + b'\n')
+            self._records_since_snapshot += 1
+            self._dirty = True
+            if time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+            else:
+                _SYNCER.schedule(self)
+
+    def needs_compaction(self) -> bool:
+        return self._records_since_snapshot >= self.compact_every
+
+    def compact(self, resources: Mapping[str, Iterable[str]]) -> None:
+        """
+        Writes a snapshot of all the queues and empties the journal.
+
+        :param resources: the queued user IDs keyed by resource name
+        """
+        with self._lock:
+            snapshot = {
+                'seq': self._seq,
+                'resources': {resource: list(user_ids) for resource, user_ids in resources.items()},
+            }
+            tmp_path = '{}.tmp'.format(self.snapshot_path)
+            with open(tmp_path, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file, separators=(',', ':'))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            self._file.seek(0)
+            self._file.truncate()
+            self._sync()
+            self._records_since_snapshot = 0
+
+    def close(self) -> None:
+        """
+        Flushes any pending changes to disk and closes the journal.
+        """
+        with self._lock:
+            if self._file:
+                self._sync()
+                self._file.close()
+                self._file = None
@@ -0,0 +1,95 @@
+import threading
+from enum import Enum
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+)
+
+from van.logs import get_logger
+from van.res_reservation import ResourceReservation
+
+LOGGER = get_logger(__name__)
+
+# Number of locks each namespace spreads its resources over. A namespace holds a team's resources,
+# so needs far fewer than a reservation shared by everyone.
+DEFAULT_NAMESPACE_LOCK_SHARDS = 8
+
+
+class NamespaceScope(Enum):
+    # Each channel has its own resources
+    CHANNEL = 'channel'
+    # All channels of a workspace share their resources
+    WORKSPACE = 'workspace'
+
+
+def _default_factory(key: str) -> ResourceReservation:
+    return ResourceReservation(lock_shards=DEFAULT_NAMESPACE_LOCK_SHARDS)
+
+
+class ReservationNamespaces:
+    """
+    Separate reservations for each channel or workspace, so that resources of the same name in
+    different teams' channels don't collide. Each namespace is a ResourceReservation of its own,
+    with its own locks, created the first time it is used.
+    """
+
+    def __init__(
+        self,
+        scope: NamespaceScope = NamespaceScope.CHANNEL,
+        factory: Callable[[str], ResourceReservation] = _default_factory,
+    ) -> None:
+        """
+        :param scope: whether namespaces are per channel or per workspace
+        :param factory: makes the reservations for a namespace, given its key (a channel or
+            workspace ID)
+        """
+        self.scope = scope
+        self.factory = factory
+        # Namespace key -> its reservations
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def key_for(self, context_dict: Dict[str, Any]) -> str:
+        """
+        Gets the key of the namespace a message belongs to.
+
+        :param context_dict: the context of the message, with its 'channel' and 'team'
+        :return: the namespace key
+        """
+        if self.scope is NamespaceScope.WORKSPACE:
+            return context_dict.get('team') or ''
+        return context_dict.get('channel') or ''
+
+    def get(self, key: str) -> ResourceReservation:
+        """
+        Gets the reservations of a namespace, creating them if needed.
+
+        :param key: the namespace key
+        :return: the reservations
+        """
+        reservations = self._namespaces.get(key)
+        if reservations is None:
+            with self._lock:
+                reservations = self._namespaces.get(key)
+                if reservations is None:
+                    LOGGER.debug('Creating reservation namespace %s', key)
+                    reservations = self._namespaces[key] = self.factory(key)
+        return reservations
+
+    def all(self) -> List[ResourceReservation]:
+        """
+        :return: the reservations of every namespace created so far
+        """
+        with self._lock:
+            return list(self._namespaces.values())
+
+    def for_context(self, context_dict: Dict[str, Any]) -> ResourceReservation:
+        """
+        Gets the reservations of the namespace a message belongs to.
+
+        :param context_dict: the context of the message
+        :return: the reservations
+        """
+        return self.get(self.key_for(context_dict))
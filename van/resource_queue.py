@@ -0,0 +1,204 @@
+import itertools
+from collections import OrderedDict
+from typing import (
+    Iterable,
+    Iterator,
+    KeysView,
+    Optional,
+    Tuple,
+)
+
+# Source of queue versions, shared by all queues so a queue that replaces another never reuses one
+_versions = itertools.count(1)
+
+
+class _FenwickTree:
+    """
+    Counts by index (1-based), with prefix sums and updates in O(log n). Indexes are added
+    by appending, so the tree grows as needed.
+    """
+    __slots__ = ('_tree',)
+
+    def __init__(self) -> None:
+        self._tree = [0]
+
+    def __len__(self) -> int:
+        return len(self._tree) - 1
+
+    def append(self, value: int) -> int:
+        """
+        Adds a new index with a count.
+
+        :return: the new index
+        """
+        index = len(self._tree)
+        # The node at an index holds the sum of the counts of the lowbit(index) indexes ending at it
+        self._tree.append(value + self.prefix_sum(index - 1) - self.prefix_sum(index - (index & -index)))
+        return index
+
+    def add(self, index: int, delta: int) -> None:
+        tree = self._tree
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def prefix_sum(self, index: int) -> int:
+        """
+        :return: the sum of the counts of indexes 1 to index
+        """
+        tree = self._tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+
+class QueueSnapshot:
+    """
+    An unchanging copy of the user IDs in a ResourceQueue, as of one version of the queue.
+    """
+    __slots__ = ('user_ids', 'version')
+
+    def __init__(self, user_ids: Tuple[str, ...], version: int) -> None:
+        self.user_ids = user_ids
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.user_ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.user_ids)
+
+    def __repr__(self) -> str:
+        return 'QueueSnapshot({!r}, version={})'.format(self.user_ids, self.version)
+
+    def first(self) -> Optional[str]:
+        return self.user_ids[0] if self.user_ids else None
+
+
+class ResourceQueue:
+    """
+    Queue of user IDs waiting for a resource. Users can be added at either end and removed from
+    anywhere in O(log n), and the position of a user in the queue is found in O(log n).
+
+    Users added to the back are numbered in increasing order, and users added to the front in
+    a separate increasing order, so that a user's position is the number of present users added
+    to the front after it (for users at the front) or the number of users at the front plus the
+    number of present users added to the back before it (for users at the back).
+    """
+    __slots__ = ('_entries', '_front', '_back', '_front_count', 'version')
+
+    def __init__(self, user_ids: Iterable[str] = ()) -> None:
+        # User ID -> (added to the front, index in the front or back tree), in queue order
+        self._entries = OrderedDict()
+        self._front = _FenwickTree()
+        self._back = _FenwickTree()
+        self._front_count = 0
+        # Changes whenever users are added or removed
+        self.version = next(_versions)
+        for user_id in user_ids:
+            self.append(user_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __repr__(self) -> str:
+        return 'ResourceQueue({!r})'.format(list(self._entries))
+
+    def keys(self) -> KeysView:
+        return self._entries.keys()
+
+    def append(self, user_id: str) -> bool:
+        """
+        Adds a user to the back of the queue.
+
+        :returns: True if the user was added, False if already in the queue
+        """
+        if user_id in self._entries:
+            return False
+        self._entries[user_id] = (False, self._back.append(1))
+        self.version = next(_versions)
+        return True
+
+    def appendleft(self, user_id: str) -> bool:
+        """
+        Adds a user to the front of the queue.
+
+        :returns: True if the user was added, False if already in the queue
+        """
+        if user_id in self._entries:
+            return False
+        self._entries[user_id] = (True, self._front.append(1))
+        self._entries.move_to_end(user_id, last=False)
+        self._front_count += 1
+        self.version = next(_versions)
+        return True
+
+    def remove(self, user_id: str) -> bool:
+        """
+        Removes a user from the queue.
+
+        :returns: True if the user was removed, False if not in the queue
+        """
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+        at_front, index = entry
+        if at_front:
+            self._front.add(index, -1)
+            self._front_count -= 1
+        else:
+            self._back.add(index, -1)
+        self.version = next(_versions)
+        if len(self._front) + len(self._back) > 2 * len(self._entries) + 64:
+            self._renumber()
+        return True
+
+    def _renumber(self) -> None:
+        """
+        Renumbers the users so the trees don't keep growing as users come and go.
+        """
+        user_ids = list(self._entries)
+        self._entries = OrderedDict()
+        self._front = _FenwickTree()
+        self._back = _FenwickTree()
+        self._front_count = 0
+        for user_id in user_ids:
+            self.append(user_id)
+
+    def snapshot(self) -> QueueSnapshot:
+        """
+        :returns: a copy of the queue that doesn't change as the queue does
+        """
+        return QueueSnapshot(tuple(self._entries), self.version)
+
+    def first(self) -> Optional[str]:
+        """
+        :returns: the user at the front of the queue, or None if the queue is empty
+        """
+        return next(iter(self._entries), None)
+
+    def position(self, user_id: str) -> Optional[int]:
+        """
+        Finds the position of a user in the queue.
+
+        :returns: the position, starting at 0 for the front of the queue, or None if the user
+            isn't in the queue
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        at_front, index = entry
+        if at_front:
+            return self._front_count - self._front.prefix_sum(index)
+        return self._front_count + self._back.prefix_sum(index) - 1
@@ -1,11 +1,20 @@
 from enum import Enum
 from typing import (
+    Iterable,
+    List,
     NamedTuple,
 )
 
 from slack import WebClient
 
 from van.logs import get_logger
+from van.metrics import (
+    REGISTRY,
+    SLACK_API_ERRORS,
+    SLACK_API_SECONDS,
+)
+from van.profiling import profiled
+from van.send_queue import SendQueue
 
 
 class Distribution(Enum):
@@ -24,27 +33,99 @@ class Response(NamedTuple):
 
 LOGGER = get_logger('van.responses')
 
+# Slack recommends keeping message text under 4,000 characters and truncates much longer messages
+MAX_MESSAGE_LENGTH = 4000
+
+# Time taken to post each response, or to queue it when posting through a SendQueue
+RESPOND_SECONDS = REGISTRY.histogram('van_respond_seconds', 'Time taken to post or queue a response')
+RESPOND_ERRORS = REGISTRY.counter('van_respond_errors_total', 'Responses that could not be posted or queued')
+
+
+def _split_message(message: str, max_length: int) -> List[str]:
+    """
+    Splits a message that is too long to post into parts, on line boundaries where possible.
+    """
+    parts = []
+    part = ''
+    for line in message.split('\n'):
+        while len(line) > max_length:
+            if part:
+                parts.append(part)
+                part = ''
+            parts.append(line[:max_length])
+            line = line[max_length:]
+        if part and len(part) + 1 + len(line) > max_length:
+            parts.append(part)
+            part = line
+        else:
+            part = '{}\n{}'.format(part, line) if part else line
+    if part:
+        parts.append(part)
+    return parts
+
+
+def coalesce_messages(messages: Iterable[str], max_length: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Joins messages, one per line, into as few posts as possible without going over the
+    maximum length of a post. The order of the messages is kept.
+
+    :param messages: the messages to join
+    :param max_length: the maximum length of a post
+    :return: the posts to make
+    """
+    posts = []
+    post = None
+    for message in messages:
+        if len(message) > max_length:
+            if post is not None:
+                posts.append(post)
+            *full_parts, post = _split_message(message, max_length)
+            posts.extend(full_parts)
+        elif post is None:
+            post = message
+        elif len(post) + 1 + len(message) > max_length:
+            posts.append(post)
+            post = message
+        else:
+            post = '{}\n{}'.format(post, message)
+    if post is not None:
+        posts.append(post)
+    return posts
+
 
 class Responder:
     """
     Responder of responses.
     """
-    def __init__(self, channel: str, web_client: WebClient) -> None:
+    def __init__(self, channel: str, web_client: WebClient, send_queue: SendQueue = None) -> None:
+        """
+        :param channel: the channel to respond in
+        :param web_client: the WebClient to post responses with
+        :param send_queue: if provided, responses are queued to be posted at the pace Slack
+            allows instead of being posted right away
+        """
         if not channel and not web_client:
             raise ValueError('Need channel and web_client')
         self.web_client = web_client
         self.channel = channel
+        self.send_queue = send_queue
 
     def _broadcast(self, message: str):
         """
         Broadcast a message to everyone
         """
-        self.web_client.chat_postMessage(
-            channel=self.channel,
-            text=message,
-            # thread_ts=data['ts']
-        )
+        with RESPOND_SECONDS.time(errors=RESPOND_ERRORS):
+            if self.send_queue:
+                self.send_queue.put(self.channel, self.web_client, message)
+            else:
+                with SLACK_API_SECONDS.time('chat.postMessage', errors=SLACK_API_ERRORS):
+                    self.web_client.chat_postMessage(
+                        channel=self.channel,
+                        text=message,
+                        # thread_ts=data['ts']
+                    )
 
+    @profiled
     def respond(self, response: Response) -> None:
         """
         Send out the response
@@ -53,4 +134,24 @@ class Responder:
             if response.distribution.value == Distribution.BROADCAST.value:
                 self._broadcast(response.message)
             else:
-                LOGGER.warning(f'No implementation for distribution {response.distribution} yet.')
+                LOGGER.warning('No implementation for distribution %s yet.', response.distribution)
+
+    @profiled
+    def respond_all(self, responses: Iterable[Response]) -> None:
+        """
+        Send out several responses, e.g. all the responses to one command. Consecutive broadcast
+        responses are combined into as few posts as Slack's message size allows.
+        """
+        broadcasts = []
+        for response in responses:
+            if not response:
+                continue
+            if response.distribution.value == Distribution.BROADCAST.value:
+                broadcasts.append(response.message)
+            else:
+                for post in coalesce_messages(broadcasts):
+                    self._broadcast(post)
+                broadcasts = []
+                self.respond(response)
+        for post in coalesce_messages(broadcasts):
+            self._broadcast(post)
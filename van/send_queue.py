@@ -0,0 +1,354 @@
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Tuple,
+)
+
+from slack.errors import SlackApiError
+
+from van.logs import get_logger
+from van.metrics import (
+    SLACK_API_ERRORS,
+    SLACK_API_SECONDS,
+)
+from van.profiling import profiled
+
+LOGGER = get_logger(__name__)
+
+# Slack allows about one message per second per channel, with short bursts over that
+DEFAULT_RATE = 1.0
+DEFAULT_BURST = 4
+# Maximum number of messages waiting to be posted
+DEFAULT_MAX_SIZE = 1000
+# Attempts to post a message before giving up on it
+DEFAULT_MAX_ATTEMPTS = 5
+# Seconds to wait before retrying a failed post, doubled on each attempt. Rate-limited posts are
+# retried after the Retry-After time given by Slack instead.
+DEFAULT_RETRY_BACKOFF = 1.0
+# Number of recent send latencies kept for stats()
+LATENCY_SAMPLES = 1000
+# Seconds between sweeps forgetting the rate limiting state of channels that have gone quiet
+PRUNE_INTERVAL = 60
+
+
+class OverflowPolicy(Enum):
+    # Refuse new messages while the queue is full
+    DROP_NEWEST = 1
+    # Make room for new messages by dropping the message that has waited longest
+    DROP_OLDEST = 2
+
+
+class _TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def ready_at(self, now: float) -> float:
+        self._refill(now)
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Outgoing:
+    __slots__ = ('channel', 'web_client', 'text', 'queued_at', 'attempts', 'on_posted')
+
+    def __init__(
+        self,
+        channel: str,
+        web_client: Any,
+        text: str,
+        queued_at: float,
+        on_posted: Callable[[Any], None] = None,
+    ) -> None:
+        self.channel = channel
+        self.web_client = web_client
+        self.text = text
+        self.queued_at = queued_at
+        self.attempts = 0
+        self.on_posted = on_posted
+
+
+def rate_limit_delay(error: SlackApiError) -> Optional[float]:
+    """
+    Gets the seconds Slack asked us to wait from a rate-limited response, or None if the error
+    isn't about rate limiting.
+    """
+    response = getattr(error, 'response', None)
+    if response is None or getattr(response, 'status_code', None) != 429:
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After') or headers.get('retry-after') or DEFAULT_RETRY_BACKOFF)
+    except ValueError:
+        return DEFAULT_RETRY_BACKOFF
+
+
+class SendQueue:
+    """
+    Outbound queue of messages to post to Slack. Posts to each channel are paced by a token
+    bucket, in the order they were queued. Rate-limited posts are retried once the Retry-After
+    time Slack gives has passed, and other failed posts with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_size: int = DEFAULT_MAX_SIZE,
+        overflow: OverflowPolicy = OverflowPolicy.DROP_NEWEST,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+        senders: int = 1,
+    ) -> None:
+        """
+        :param rate: messages per second to post to each channel
+        :param burst: messages that can be posted to a channel in a burst after it has been quiet
+        :param max_size: maximum number of messages waiting to be posted
+        :param overflow: what to do with messages queued while the queue is full
+        :param max_attempts: attempts to post a message before giving up on it
+        :param retry_backoff: seconds to wait before the first retry of a failed post
+        :param senders: number of threads posting messages
+        """
+        if rate <= 0 or burst < 1 or max_size < 1 or max_attempts < 1 or senders < 1:
+            raise ValueError('rate, burst, max_size, max_attempts and senders must be positive')
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.overflow = overflow
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+
+        self._lock = threading.Condition()
+        self._queues = {}
+        # Rate limiting state of channels posted to. Forgotten once a channel has gone quiet, since
+        # a channel without any starts with a full bucket and no pause.
+        self._buckets = {}
+        self._paused_until = {}
+        self._pruned_at = time.monotonic()
+        # Channels being posted to, which no other sender may post to meanwhile
+        self._busy = set()
+        self._size = 0
+        self._closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.retries = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+        self._senders = [
+            threading.Thread(target=self._send, name=f'SendQueue-sender-{i}', daemon=True)
+            for i in range(senders)
+        ]
+        for thread in self._senders:
+            thread.start()
+
+    @staticmethod
+    def _notify_posted(outgoing: _Outgoing, response: Any) -> None:
+        if outgoing.on_posted:
+            try:
+                outgoing.on_posted(response)
+            except Exception:
+                LOGGER.exception('Cannot handle the post to %s', outgoing.channel)
+
+    def _drop_oldest(self) -> None:
+        """
+        Drops the message that has waited longest, other than messages being posted. Call with _lock held.
+        """
+        channel = min(
+            (channel for channel, queue in self._queues.items() if queue and channel not in self._busy),
+            key=lambda channel: self._queues[channel][0].queued_at,
+            default=None,
+        )
+        if channel:
+            dropped = self._queues[channel].popleft()
+            if not self._queues[channel]:
+                del self._queues[channel]
+            self._size -= 1
+            self.dropped += 1
+            LOGGER.warning('Send queue full; dropped oldest message to %s', dropped.channel)
+            self._notify_posted(dropped, None)
+
+    def put(self, channel: str, web_client: Any, text: str, on_posted: Callable[[Any], None] = None) -> bool:
+        """
+        Queues a message to be posted.
+
+        :param channel: the channel to post to
+        :param web_client: the WebClient to post with
+        :param text: the message text
+        :param on_posted: if provided, called from a sender thread with the chat.postMessage response
+            once the message is posted, or with None if it is given up on
+        :return: True if the message was queued, False if it was dropped because the queue is full
+        """
+        with self._lock:
+            if self._size >= self.max_size:
+                if self.overflow is OverflowPolicy.DROP_OLDEST:
+                    self._drop_oldest()
+                if self._size >= self.max_size:
+                    self.dropped += 1
+                    LOGGER.warning('Send queue full; dropped message to %s', channel)
+                    return False
+            self._queues.setdefault(channel, deque()).append(
+                _Outgoing(channel, web_client, text, time.monotonic(), on_posted)
+            )
+            self._size += 1
+            self._lock.notify()
+        return True
+
+    def _prune(self, now: float) -> None:
+        """
+        Forgets the bucket and pause of every channel with nothing left to post, a full bucket
+        and no pause in effect. Call with _lock held.
+        """
+        for channel in [channel for channel in self._buckets if channel not in self._queues]:
+            if channel not in self._busy and self._buckets[channel].is_full(now):
+                if self._paused_until.get(channel, 0) <= now:
+                    del self._buckets[channel]
+                    self._paused_until.pop(channel, None)
+        self._pruned_at = now
+
+    def _next_channel(self, now: float) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Finds a channel with a message that can be posted now. Call with _lock held.
+
+        :return: the channel, or None and the seconds until a channel will be ready (None if
+            there is nothing to post)
+        """
+        ready_at = None
+        for channel, queue in self._queues.items():
+            if not queue or channel in self._busy:
+                continue
+            bucket = self._buckets.get(channel)
+            if bucket is None:
+                bucket = self._buckets[channel] = _TokenBucket(self.rate, self.burst, now)
+            channel_ready_at = max(bucket.ready_at(now), self._paused_until.get(channel, 0))
+            if channel_ready_at <= now:
+                return channel, None
+            if ready_at is None or channel_ready_at < ready_at:
+                ready_at = channel_ready_at
+        return None, None if ready_at is None else ready_at - now
+
+    @profiled
+    def _post(self, outgoing: _Outgoing) -> Any:
+        """
+        Posts a message. This is where responses are actually sent when they go through a
+        SendQueue, so it is profiled along with the rest of the send path.
+        """
+        with SLACK_API_SECONDS.time('chat.postMessage', errors=SLACK_API_ERRORS):
+            return outgoing.web_client.chat_postMessage(channel=outgoing.channel, text=outgoing.text)
+
+    def _send(self) -> None:
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed and not self._size and not self._busy:
+                        return
+                    now = time.monotonic()
+                    if now - self._pruned_at >= PRUNE_INTERVAL:
+                        self._prune(now)
+                    channel, wait = self._next_channel(now)
+                    if channel:
+                        break
+                    self._lock.wait(timeout=wait)
+                self._buckets[channel].take(now)
+                self._busy.add(channel)
+                outgoing = self._queues[channel].popleft()
+                self._size -= 1
+
+            delay = None
+            response = None
+            try:
+                response = self._post(outgoing)
+            except SlackApiError as e:
+                delay = rate_limit_delay(e)
+                if delay is None:
+                    delay = self.retry_backoff * 2 ** outgoing.attempts
+                    LOGGER.warning('Cannot post to %s: %s', channel, e)
+            except Exception:
+                LOGGER.exception('Cannot post to %s', channel)
+                delay = self.retry_backoff * 2 ** outgoing.attempts
+
+            if delay is None or outgoing.attempts + 1 >= self.max_attempts:
+                self._notify_posted(outgoing, response if delay is None else None)
+            with self._lock:
+                self._busy.discard(channel)
+                if delay is None:
+                    self.sent += 1
+                    self._latencies.append(time.monotonic() - outgoing.queued_at)
+                else:
+                    outgoing.attempts += 1
+                    if outgoing.attempts < self.max_attempts:
+                        self.retries += 1
+                        self._paused_until[channel] = time.monotonic() + delay
+                        self._queues[channel].appendleft(outgoing)
+                        self._size += 1
+                    else:
+                        self.dropped += 1
+                        LOGGER.error('Giving up posting to %s after %s attempts', channel, outgoing.attempts)
+                if not self._queues[channel]:
+                    del self._queues[channel]
+                self._lock.notify_all()
+
+    def depth(self) -> int:
+        """
+        :return: the number of messages waiting to be posted
+        """
+        return self._size
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Gets the queue depth, message counts and latencies (seconds from being queued to being
+        posted) of recently posted messages.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'depth': self._size,
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'retries': self.retries,
+            }
+        if latencies:
+            stats.update({
+                'latency_p50': latencies[len(latencies) // 2],
+                'latency_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'latency_max': latencies[-1],
+            })
+        return stats
+
+    def drain(self) -> None:
+        """
+        Waits until every message queued so far has been posted (or given up on).
+        """
+        with self._lock:
+            self._lock.wait_for(lambda: not self._size and not self._busy)
+
+    def close(self) -> None:
+        """
+        Drains the queue and stops its threads.
+        """
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        for thread in self._senders:
+            thread.join()
@@ -0,0 +1,218 @@
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Optional,
+)
+
+from slack import WebClient
+from slack.errors import SlackApiError
+
+from van.logs import get_logger
+from van.metrics import (
+    SLACK_API_ERRORS,
+    SLACK_API_SECONDS,
+)
+from van.responses import MAX_MESSAGE_LENGTH
+from van.send_queue import (
+    SendQueue,
+    rate_limit_delay,
+)
+
+LOGGER = get_logger(__name__)
+
+# Seconds to wait after a change before updating the boards, so a burst of changes makes one edit
+DEFAULT_DEBOUNCE = 2.0
+# Errors from chat.update meaning the board can never be updated again. Boards are kept, and
+# updated on the next change, after any other error.
+FATAL_UPDATE_ERRORS = frozenset((
+    'message_not_found',
+    'channel_not_found',
+    'is_archived',
+    'not_in_channel',
+    'cant_update_message',
+    'edit_window_closed',
+    'invalid_auth',
+    'account_inactive',
+    'token_revoked',
+))
+# Added to the end of a board cut short to fit in a message
+TRUNCATED_SUFFIX = '\n_(cut short: too many resources to show)_'
+
+
+def truncate_board(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> str:
+    """
+    Cuts a board short, on a line boundary where possible, so that it fits in a message.
+    """
+    if len(text) <= max_length:
+        return text
+    text = text[:max_length - len(TRUNCATED_SUFFIX)]
+    if '\n' in text:
+        text = text[:text.rindex('\n')]
+    return text + TRUNCATED_SUFFIX
+
+
+class _Board:
+    __slots__ = ('web_client', 'ts', 'stale', 'retry_at')
+
+    def __init__(self, web_client: WebClient) -> None:
+        self.web_client = web_client
+        # ts of the board message (None until it has been posted)
+        self.ts = None
+        # Whether the reservations changed since the board was last posted or updated
+        self.stale = False
+        # When Slack allows the board to be updated again after rate limiting it
+        self.retry_at = 0.0
+
+
+class StatusBoard:
+    """
+    Keeps one status message per channel, edited in place as the reservations change instead of
+    posting a new status each time. Boards that could not be updated are tried again on the next
+    change, or once Slack's Retry-After time has passed if Slack rate limited the update.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[], str],
+        debounce: float = DEFAULT_DEBOUNCE,
+        send_queue: SendQueue = None,
+    ) -> None:
+        """
+        :param render: returns the text of the status message
+        :param debounce: seconds to wait after a change before updating the boards
+        :param send_queue: if provided, boards are posted through this queue
+        """
+        self.render = render
+        self.debounce = debounce
+        self.send_queue = send_queue
+        # Channel -> board
+        self._boards = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, channel: str, web_client: WebClient) -> None:
+        """
+        Posts a board in a channel, replacing any board already in it.
+
+        :param channel: the channel to post the board in
+        :param web_client: the WebClient to post and update the board with
+        """
+        board = _Board(web_client)
+        with self._lock:
+            self._boards[channel] = board
+        text = truncate_board(self.render())
+        if self.send_queue:
+            def on_posted(response: Optional[Any]) -> None:
+                self._posted(channel, board, response)
+
+            if not self.send_queue.put(channel, web_client, text, on_posted=on_posted):
+                on_posted(None)
+            return
+        response = None
+        try:
+            with SLACK_API_SECONDS.time('chat.postMessage', errors=SLACK_API_ERRORS):
+                response = web_client.chat_postMessage(channel=channel, text=text)
+        finally:
+            self._posted(channel, board, response)
+
+    def _posted(self, channel: str, board: _Board, response: Optional[Any]) -> None:
+        with self._lock:
+            if self._boards.get(channel) is not board:
+                return
+            if response is None:
+                LOGGER.error('Cannot post status board in %s', channel)
+                del self._boards[channel]
+                return
+            board.ts = response.get('ts')
+            if board.stale:
+                self._schedule(self.debounce)
+
+    def remove(self, channel: str) -> bool:
+        """
+        Stops updating the board in a channel. The message is left as it is.
+
+        :return: True if there was a board in the channel
+        """
+        with self._lock:
+            return self._boards.pop(channel, None) is not None
+
+    def has_board(self, channel: str) -> bool:
+        return channel in self._boards
+
+    def _schedule(self, delay: float) -> None:
+        """
+        Updates the boards in a while, unless an update is already scheduled. Call with _lock held.
+        """
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self._update)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def changed(self, *args: Any) -> None:
+        """
+        Notes that the reservations changed. The boards are updated once `debounce` seconds after
+        the first change not yet shown, taking in every change made in the meantime.
+        """
+        with self._lock:
+            if self._boards:
+                for board in self._boards.values():
+                    board.stale = True
+                self._schedule(self.debounce)
+
+    def _update(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._timer = None
+            boards = [
+                (channel, board) for channel, board in self._boards.items()
+                if board.ts and board.stale and board.retry_at <= now
+            ]
+            for channel, board in boards:
+                board.stale = False
+        if boards:
+            try:
+                text = truncate_board(self.render())
+            except Exception:
+                LOGGER.exception('Cannot render status boards; retrying on the next change')
+                with self._lock:
+                    for channel, board in boards:
+                        board.stale = True
+                boards = []
+        for channel, board in boards:
+            try:
+                with SLACK_API_SECONDS.time('chat.update', errors=SLACK_API_ERRORS):
+                    board.web_client.chat_update(channel=channel, ts=board.ts, text=text)
+            except SlackApiError as e:
+                self._update_failed(channel, board, e)
+            except Exception:
+                LOGGER.exception('Cannot update status board in %s; retrying on the next change', channel)
+                with self._lock:
+                    board.stale = True
+
+        with self._lock:
+            retry_at = min(
+                (board.retry_at for board in self._boards.values() if board.stale and board.retry_at > now),
+                default=None,
+            )
+            if retry_at is not None:
+                # Catch up with the changes held back by rate limiting as soon as Slack allows
+                self._schedule(max(retry_at - time.monotonic(), self.debounce))
+
+    def _update_failed(self, channel: str, board: _Board, error: SlackApiError) -> None:
+        response = getattr(error, 'response', None)
+        code = response.get('error') if response is not None else None
+        with self._lock:
+            if code in FATAL_UPDATE_ERRORS:
+                LOGGER.warning('Cannot update status board in %s (%s); no longer updating it', channel, code)
+                if self._boards.get(channel) is board:
+                    del self._boards[channel]
+                return
+            board.stale = True
+            delay = rate_limit_delay(error)
+            if delay is not None:
+                board.retry_at = time.monotonic() + delay
+                LOGGER.info('Status board in %s rate limited; retrying in %ss', channel, delay)
+            else:
+                LOGGER.warning('Cannot update status board in %s (%s); retrying on the next change', channel, code)
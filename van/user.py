@@ -0,0 +1,40 @@
+import sys
+from typing import (
+    Dict,
+    NamedTuple,
+    Optional,
+)
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value else value
+
+
+class User(NamedTuple):
+    """
+    The parts of a Slack user that the bot uses.
+    """
+    id: str
+    name: Optional[str]
+    real_name: Optional[str]
+    is_bot: bool = False
+    # The full Slack payload for the user. Only kept when asked for, since it is many times bigger.
+    raw: Optional[Dict] = None
+
+    @classmethod
+    def from_member(cls, member: Dict, raw: bool = False) -> 'User':
+        """
+        Makes a User from a member of a users.list response (or the user of a users.info response).
+
+        :param member: the user info from Slack
+        :param raw: if True, the full user info is kept in the raw field
+        :return: the User
+        """
+        real_name = member.get('real_name') or (member.get('profile') or {}).get('real_name')
+        return cls(
+            id=_intern(member['id']),
+            name=_intern(member.get('name')),
+            real_name=_intern(real_name),
+            is_bot=bool(member.get('is_bot')),
+            raw=member if raw else None,
+        )
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+from typing import (
+    Iterable,
+    List,
+)
+
+from van.logs import get_logger
+from van.user import User
+
+LOGGER = get_logger(__name__)
+
+
+class UserSnapshot:
+    """
+    Compact on-disk copy of the user directory, kept in an SQLite file. Only the
+    fields the bot uses (id, name and real_name) are kept.
+    """
+
+    def __init__(self, path: str) -> None:
+        if not path:
+            raise ValueError('path required')
+        self.path = path
+
+    def save(self, users: Iterable[User]) -> bool:
+        """
+        Replaces the snapshot with the users provided. The new snapshot is written next to the
+        old one and then moved into place, so readers never see a partial snapshot.
+
+        :param users: the users to save
+        :return: True if the snapshot was saved
+        """
+        tmp_path = '{}.tmp'.format(self.path)
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            connection = sqlite3.connect(tmp_path)
+            try:
+                with connection:
+                    connection.execute(
+                        'CREATE TABLE users (id TEXT PRIMARY KEY, name TEXT, real_name TEXT) WITHOUT ROWID'
+                    )
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO users VALUES (?, ?, ?)',
+                        ((user.id, user.name, user.real_name) for user in users)
+                    )
+            finally:
+                connection.close()
+            os.replace(tmp_path, self.path)
+        except Exception:
+            LOGGER.exception('Cannot save user snapshot to %s', self.path)
+            return False
+        return True
+
+    def load(self) -> List[User]:
+        """
+        Loads the users from the snapshot.
+
+        :return: the users saved, or an empty list if there is no usable snapshot
+        """
+        users = []
+        if os.path.exists(self.path):
+            try:
+                connection = sqlite3.connect(self.path)
+                try:
+                    users = [
+                        User.from_member({'id': user_id, 'name': name, 'real_name': real_name})
+                        for user_id, name, real_name in connection.execute('SELECT id, name, real_name FROM users')
+                    ]
+                finally:
+                    connection.close()
+            except Exception:
+                LOGGER.exception('Cannot load user snapshot from %s', self.path)
+        return users
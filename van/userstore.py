@@ -1,15 +1,173 @@
+import bisect
+import itertools
+import threading
+import time
+from collections import OrderedDict
 from typing import (
     Dict,
+    Iterable,
+    Iterator,
     List,
     Optional,
+    Tuple,
 )
 
 from slack import WebClient
+from slack.errors import SlackApiError
 
 from van.logs import get_logger
+from van.metrics import (
+    REGISTRY,
+    SLACK_API_ERRORS,
+    SLACK_API_SECONDS,
+)
+from van.user import User
+from van.user_snapshot import UserSnapshot
 
 LOGGER = get_logger(__name__)
 
+# Number of members requested per users.list call. Slack recommends no more than 200.
+DEFAULT_PAGE_SIZE = 200
+# Seconds a loaded directory is served before it is refreshed in the background
+DEFAULT_TTL = 60 * 60
+# Seconds to wait before retrying a failed load. Doubles on each consecutive failure up to MAX_RETRY_BACKOFF.
+DEFAULT_RETRY_BACKOFF = 30
+MAX_RETRY_BACKOFF = 30 * 60
+# Seconds a user ID that users.info could not find is remembered as missing
+DEFAULT_MISSING_TTL = 5 * 60
+# Maximum number of missing user IDs remembered
+DEFAULT_MISSING_CACHE_SIZE = 1000
+
+# Time taken by each full load of the users from Slack, from the first page to the last user
+USER_LOAD_SECONDS = REGISTRY.histogram(
+    'van_user_load_seconds', 'Time taken to load the users from Slack', buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+USER_LOAD_ERRORS = REGISTRY.counter('van_user_load_errors_total', 'Loads of the users from Slack that failed')
+
+# Source of directory generations, shared by all directories so a new directory never reuses one
+_generations = itertools.count(1)
+
+
+class UserDirectory:
+    """
+    Users keyed by user ID, along with the indexes used to look them up by name.
+
+    Changes replace the ID lists in the indexes instead of editing them, so find() can run
+    alongside add() and remove(). find_by_prefix() cannot, and must be called with the lock
+    that guards the changes held.
+    """
+
+    def __init__(self, users: Iterable[User] = ()) -> None:
+        self.users = {}
+        # Name, real name and case-folded name to the IDs of the users having it, in the order added.
+        # Lookups go to the first ID, and to the next one if that user is removed or renamed.
+        self.by_name = {}
+        self.by_real_name = {}
+        self.by_folded_name = {}
+        # Sorted (case-folded name, user ID) pairs for prefix searches. Rebuilt on demand after adds.
+        self._prefix_index = []
+        self._prefix_index_dirty = False
+        # Changes whenever a user is added or removed, so anything rendered from the users can
+        # tell when it needs to be rendered again
+        self.generation = next(_generations)
+        for user in users:
+            self.add(user)
+
+    def _index_keys(self, user: User) -> Iterator[Tuple[str, Dict[str, List[str]]]]:
+        for key, index in ((user.name, self.by_name), (user.real_name, self.by_real_name)):
+            if key:
+                yield key, index
+                yield key.casefold(), self.by_folded_name
+
+    def add(self, user: User) -> None:
+        """
+        Adds a user to the directory and its indexes, replacing any user with the same ID. The
+        generation only changes if the user's name or real name did.
+        """
+        user_id = user.id
+        current = self.users.get(user_id)
+        if current is not None:
+            if (current.name, current.real_name) == (user.name, user.real_name):
+                # E.g. a status or profile edit: nothing indexed or rendered changed
+                self.users[user_id] = user
+                return
+            self.remove(user_id)
+        self.users[user_id] = user
+        for key, index in self._index_keys(user):
+            user_ids = index.get(key, [])
+            if user_id not in user_ids:
+                index[key] = user_ids + [user_id]
+        self._prefix_index_dirty = True
+        self.generation = next(_generations)
+
+    def remove(self, user_id: str) -> Optional[User]:
+        """
+        Removes a user from the directory and its indexes.
+
+        :return: the user removed or None
+        """
+        user = self.users.pop(user_id, None)
+        if user:
+            for key, index in self._index_keys(user):
+                user_ids = index.get(key)
+                if user_ids and user_id in user_ids:
+                    user_ids = [other_id for other_id in user_ids if other_id != user_id]
+                    if user_ids:
+                        index[key] = user_ids
+                    else:
+                        del index[key]
+            self._prefix_index_dirty = True
+            self.generation = next(_generations)
+        return user
+
+    def _find_id(self, index: Dict[str, List[str]], key: str) -> Optional[str]:
+        user_ids = index.get(key)
+        return user_ids[0] if user_ids else None
+
+    def find(self, user_name: str) -> Optional[User]:
+        """
+        Finds a user by name or real name, falling back to a case-insensitive match.
+
+        :param user_name: the name to look up
+        :return: the user found or None
+        """
+        user_id = (
+            self._find_id(self.by_name, user_name)
+            or self._find_id(self.by_real_name, user_name)
+            or self._find_id(self.by_folded_name, user_name.casefold())
+        )
+        return self.users.get(user_id) if user_id else None
+
+    def find_by_prefix(self, prefix: str, limit: int = 10) -> List[User]:
+        """
+        Finds users whose name or real name starts with a prefix, ignoring case.
+
+        :param prefix: the start of the name to look up
+        :param limit: the maximum number of users to return
+        :return: the users found in order of name
+        """
+        if self._prefix_index_dirty:
+            self._prefix_index = sorted(
+                (folded_name, user_id)
+                for folded_name, user_ids in self.by_folded_name.items()
+                for user_id in user_ids
+            )
+            self._prefix_index_dirty = False
+        prefix = prefix.casefold()
+        found = []
+        found_ids = set()
+        index = self._prefix_index
+        position = bisect.bisect_left(index, (prefix,))
+        while position < len(index) and len(found) < limit:
+            folded_name, user_id = index[position]
+            if not folded_name.startswith(prefix):
+                break
+            if user_id not in found_ids:
+                found_ids.add(user_id)
+                found.append(self.users[user_id])
+            position += 1
+        return found
+
 
 class UserStore:
     """
@@ -17,26 +175,214 @@ class UserStore:
     implementation and data source.
     """
 
-    def __init__(self, web_client: WebClient) -> None:
-        self.users = {}
+    def __init__(
+        self,
+        web_client: WebClient,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        ttl: float = DEFAULT_TTL,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+        missing_ttl: float = DEFAULT_MISSING_TTL,
+        missing_cache_size: int = DEFAULT_MISSING_CACHE_SIZE,
+        snapshot: UserSnapshot = None,
+        raw: bool = False,
+    ) -> None:
+        self._directory = UserDirectory()
 
         if not web_client:
             raise ValueError('WebClient required')
+        if page_size < 1:
+            raise ValueError('page_size must be positive')
         self.web_client = web_client
+        self.page_size = page_size
+        self.ttl = ttl
+        self.retry_backoff = retry_backoff
+        self.missing_ttl = missing_ttl
+        self.missing_cache_size = missing_cache_size
+        # On-disk copy of the users to serve from at startup while the users are loaded from Slack
+        self.snapshot = snapshot
+        # Whether to keep the full Slack payload of each user in User.raw
+        self.raw = raw
+
+        # Users still to be pulled from an in-progress load (None when no load is in progress)
+        self._pending_users = None
+        # When the cache is due for a refresh (None until the first load has been attempted)
+        self._expires_at = None
+        self._failures = 0
+        self._refresh_thread = None
+        # Users updated while a refresh is in progress, to be reapplied to the refreshed users
+        self._refresh_updates = None
+        # Serializes loads so that concurrent misses share one in-flight load
+        self._lock = threading.RLock()
+
+        # Users not in the directory that users.info could not find either: user ID -> when to forget it
+        self._missing = OrderedDict()
+        # User IDs to look up with users.info, and the events their requesters are waiting on
+        self._lookup_queue = []
+        self._lookups = {}
+        self._lookup_leader = False
+        self._lookup_lock = threading.Lock()
+
+    @property
+    def users(self) -> Dict[str, User]:
+        return self._directory.users
 
-    def _load_users(self) -> List[Dict]:
+    @users.setter
+    def users(self, users: Dict[str, User]) -> None:
+        self._directory = UserDirectory(users.values())
+
+    def _to_user(self, member: Dict) -> User:
+        return User.from_member(member, raw=self.raw)
+
+    def _load_user_pages(self) -> Iterator[List[Dict]]:
         """
-        Load all user infos from Slack and return the results.
+        Load user infos from Slack one page at a time, following the response cursor
+        until Slack reports there are no more pages.
 
         :raises Exception: if errors occurred
         """
+        cursor = None
+        while True:
+            params = {'limit': self.page_size}
+            if cursor:
+                params['cursor'] = cursor
+            try:
+                with SLACK_API_SECONDS.time('users.list', errors=SLACK_API_ERRORS):
+                    api_call = self.web_client.api_call('users.list', http_verb='GET', params=params)
+            except Exception:
+                LOGGER.exception('Cannot get users')
+                raise
+            if not api_call.get('ok'):
+                SLACK_API_ERRORS.inc('users.list')
+                LOGGER.error('Cannot get users: %s', api_call.get('error'))
+                raise RuntimeError('users.list failed')
+            yield api_call.get('members') or []
+
+            cursor = (api_call.get('response_metadata') or {}).get('next_cursor')
+            if not cursor:
+                return
+
+    def _load_users(self) -> Iterator[Dict]:
+        """
+        Load all user infos from Slack, yielding each user as soon as the page containing
+        it has arrived.
+
+        :raises Exception: if errors occurred
+        """
+        start = time.perf_counter()
         try:
-            api_call = self.web_client.api_call('users.list')
-            if api_call.get('ok'):
-                return api_call.get('members')
+            for page in self._load_user_pages():
+                yield from page
         except Exception:
-            LOGGER.exception('Cannot get users')
+            USER_LOAD_ERRORS.inc()
             raise
+        USER_LOAD_SECONDS.observe(time.perf_counter() - start)
+
+    def _load_succeeded(self) -> None:
+        self._failures = 0
+        self._expires_at = time.monotonic() + self.ttl
+
+    def _load_failed(self) -> None:
+        self._failures += 1
+        backoff = min(self.retry_backoff * 2 ** (self._failures - 1), MAX_RETRY_BACKOFF)
+        LOGGER.warning('User load failed %s time(s) in a row; retrying in %ss', self._failures, backoff)
+        self._expires_at = time.monotonic() + backoff
+
+    def _is_stale(self) -> bool:
+        return self._expires_at is not None and time.monotonic() >= self._expires_at
+
+    def _fill_users(self, until_user_id: str = None) -> None:
+        """
+        Pull users from the (possibly in-progress) initial load into the cache. Only the very first
+        load runs inline; every later load is a background refresh.
+
+        :param until_user_id: if provided, stop pulling as soon as this user has been cached.
+            The rest of the load is resumed by the next call.
+        """
+        with self._lock:
+            if until_user_id and until_user_id in self.users:
+                # Loaded by another caller while we waited for the lock
+                return
+            if self._pending_users is None:
+                if self.users or self._expires_at is not None or self._load_snapshot():
+                    return
+                self._pending_users = iter(self._load_users())
+
+            try:
+                for member in self._pending_users:
+                    user = self._to_user(member)
+                    self._directory.add(user)
+                    if until_user_id and user.id == until_user_id:
+                        return
+            except Exception:
+                LOGGER.warning('User load stopped after %s users', len(self.users))
+                self._load_failed()
+            else:
+                self._load_succeeded()
+                if self.snapshot:
+                    threading.Thread(
+                        target=self.snapshot.save,
+                        args=(list(self.users.values()),),
+                        name='UserStore-snapshot',
+                        daemon=True,
+                    ).start()
+            self._pending_users = None
+
+    def _load_snapshot(self) -> bool:
+        """
+        Serves the users from the on-disk snapshot, if there is one. The snapshot is immediately
+        considered stale, so that it gets reconciled with Slack in the background.
+
+        :return: True if users were loaded from the snapshot
+        """
+        users = self.snapshot.load() if self.snapshot else []
+        if users:
+            LOGGER.info('Loaded %s users from snapshot %s', len(users), self.snapshot.path)
+            self._directory = UserDirectory(users)
+            self._expires_at = time.monotonic()
+        return bool(users)
+
+    def _refresh(self) -> None:
+        with self._lock:
+            self._refresh_updates = []
+        try:
+            directory = UserDirectory(self._to_user(member) for member in self._load_users())
+        except Exception:
+            with self._lock:
+                self._refresh_updates = None
+                self._load_failed()
+        else:
+            with self._lock:
+                for user in self._refresh_updates:
+                    directory.add(user)
+                self._refresh_updates = None
+                self._directory = directory
+                self._load_succeeded()
+                users = list(directory.users.values())
+            if self.snapshot:
+                self.snapshot.save(users)
+
+    def refresh(self, wait: bool = False) -> None:
+        """
+        Reloads all users from Slack in a background thread. The cache is replaced only once the
+        load completes, so readers keep being served the current users meanwhile. If a refresh is
+        already in progress, no new one is started.
+
+        :param wait: if True, block until the refresh is done
+        """
+        with self._lock:
+            thread = self._refresh_thread
+            if not (thread and thread.is_alive()):
+                thread = threading.Thread(target=self._refresh, name='UserStore-refresh', daemon=True)
+                self._refresh_thread = thread
+                thread.start()
+        if wait:
+            thread.join()
+
+    def _get_directory(self, until_user_id: str = None) -> UserDirectory:
+        self._fill_users(until_user_id=until_user_id)
+        if self._is_stale():
+            self.refresh()
+        return self._directory
 
     def lookup_user_info(self, user_id: str) -> Optional[Dict]:
         """
@@ -48,46 +394,210 @@ class UserStore:
         """
         user_info = None
         try:
-            user_info = self.web_client.users_info(user=user_id)
+            with SLACK_API_SECONDS.time('users.info', errors=SLACK_API_ERRORS):
+                user_info = self.web_client.users_info(user=user_id)
+        except SlackApiError as e:
+            response = getattr(e, 'response', None)
+            if response is not None and response.get('error') == 'user_not_found':
+                # E.g. a user of another workspace in a shared channel
+                LOGGER.info('User %s not found', user_id)
+            else:
+                LOGGER.exception('Cannot get user info for %s', user_id)
         except Exception:
-            LOGGER.exception('Cannot get user info for {}'.format(user_id))
+            LOGGER.exception('Cannot get user info for %s', user_id)
         return user_info
 
-    def get_users(self) -> Dict[str, Dict]:
-        # Expire this periodically?
-        if not self.users:
+    def _is_known_missing(self, user_id: str) -> bool:
+        """
+        Checks whether users.info recently could not find a user. Call with _lookup_lock held.
+        """
+        expires_at = self._missing.get(user_id)
+        if expires_at is None:
+            return False
+        if time.monotonic() < expires_at:
+            self._missing.move_to_end(user_id)
+            return True
+        del self._missing[user_id]
+        return False
+
+    def _remember_missing(self, user_id: str) -> None:
+        """
+        Remembers that users.info could not find a user. Call with _lookup_lock held.
+        """
+        self._missing[user_id] = time.monotonic() + self.missing_ttl
+        self._missing.move_to_end(user_id)
+        while len(self._missing) > self.missing_cache_size:
+            self._missing.popitem(last=False)
+
+    def _run_lookups(self) -> None:
+        """
+        Looks up queued user IDs with users.info until the queue is empty, including IDs queued
+        by other threads while this runs. Users found are added to the directory. If a lookup
+        raises, every user ID still waiting is released before the error is passed on.
+        """
+        while True:
+            with self._lookup_lock:
+                batch, self._lookup_queue = self._lookup_queue, []
+                if not batch:
+                    self._lookup_leader = False
+                    return
+            for position, user_id in enumerate(batch):
+                user = None
+                try:
+                    response = self.lookup_user_info(user_id)
+                    if response and response.get('ok') and response.get('user'):
+                        user = self._to_user(response.get('user'))
+                    if user:
+                        self._add_user(user)
+                except Exception:
+                    with self._lookup_lock:
+                        for waiting_user_id in batch[position:] + self._lookup_queue:
+                            self._lookups.pop(waiting_user_id).set()
+                        self._lookup_queue = []
+                    raise
+                with self._lookup_lock:
+                    if not user:
+                        self._remember_missing(user_id)
+                    self._lookups.pop(user_id).set()
+
+    def _look_up_missing_users(self, user_ids: Iterable[str]) -> None:
+        """
+        Looks up users that are not in the directory with users.info. Misses from concurrent
+        callers are merged into one batch: the first caller looks up every queued user ID while
+        the others wait for theirs. Each user ID is looked up at most once at a time, and IDs
+        that could not be found are not looked up again for `missing_ttl` seconds.
+
+        :param user_ids: the user IDs to look up
+        """
+        events = []
+        with self._lookup_lock:
+            for user_id in user_ids:
+                if self._is_known_missing(user_id):
+                    continue
+                event = self._lookups.get(user_id)
+                if event is None:
+                    event = self._lookups[user_id] = threading.Event()
+                    self._lookup_queue.append(user_id)
+                events.append(event)
+            lead = bool(events) and not self._lookup_leader
+            if lead:
+                self._lookup_leader = True
+
+        if lead:
             try:
-                users = self._load_users()
-                self.users = {user['id']: user for user in users}
+                self._run_lookups()
             except Exception:
-                pass
-        return self.users
+                with self._lookup_lock:
+                    self._lookup_leader = False
+                raise
+        for event in events:
+            event.wait()
+
+    def _add_user(self, user: User) -> None:
+        """
+        Adds or updates a user in the directory, and in the directory of any refresh in progress.
+        """
+        with self._lock:
+            self._directory.add(user)
+            if self._refresh_updates is not None:
+                self._refresh_updates.append(user)
+
+    def update_user(self, member: Dict) -> None:
+        """
+        Adds or updates a single user in place, e.g. as reported by a user_change or team_join event.
+
+        :param member: the user info, as found in users.list or users.info
+        """
+        if member and member.get('id'):
+            user = self._to_user(member)
+            self._add_user(user)
+            with self._lookup_lock:
+                self._missing.pop(user.id, None)
+
+    def get_users(self) -> Dict[str, User]:
+        """
+        Gets all users keyed by user ID. The first call loads the users from Slack. After that, the
+        users are refreshed in the background every `ttl` seconds.
+
+        :return: the users keyed by user ID
+        """
+        return self._get_directory().users
+
+    def get_generation(self) -> int:
+        """
+        Gets the generation of the users. It changes whenever users are added, renamed or
+        removed, including when the users are refreshed.
+
+        :return: the generation
+        """
+        return self._get_directory().generation
 
-    def get_cached_user_info(self, user_id: str) -> Optional[Dict]:
+    def get_cached_user_info(self, user_id: str) -> Optional[User]:
         """
-        Gets the user information dict for a user ID. Once this is called,
+        Gets the user information for a user ID. Once this is called,
         the information is cached.
 
+        If the users are still being loaded, only as many pages as needed to find the
+        user are pulled in. Users not in the loaded directory (e.g. users that joined
+        since it was loaded) are looked up individually.
+
         :param user_id: the user ID to get user info for
         :param slack_client: the Slack client to use to talk to Slack
-        :return: acquired user info dict or None
+        :return: acquired user info or None
+        """
+        user = self.users.get(user_id)
+        if user is None or self._is_stale():
+            user = self._get_directory(until_user_id=user_id).users.get(user_id)
+        if user is None and user_id:
+            self._look_up_missing_users([user_id])
+            user = self.users.get(user_id)
+        return user
+
+    def get_cached_user_infos(self, user_ids: Iterable[str]) -> Dict[str, User]:
         """
-        return self.get_users().get(user_id)
+        Gets the user information for several user IDs at once. Users not in the
+        loaded directory are looked up together in one batch.
 
-    def search_for_user(self, user_name: str) -> Optional[Dict]:
+        :param user_ids: the user IDs to get user info for
+        :return: acquired user info keyed by user ID. User IDs that cannot be
+            found are left out.
+        """
+        user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id]
+        users = self._get_directory().users
+        missing = [user_id for user_id in user_ids if user_id not in users]
+        if missing:
+            self._look_up_missing_users(missing)
+            users = self.users
+        return {user_id: users[user_id] for user_id in user_ids if user_id in users}
+
+    def search_for_user(self, user_name: str) -> Optional[User]:
         """
         Consults the underlying implementation/store for user info given a user name.
+        An exact match on the name or real name is preferred over a case-insensitive one.
+
         :param user_name: the user name look up user info for
-        :param slack_client: the Slack client to use to talk to Slack
         :return: the user info found or None
         :raises Exception:
         """
         user = None
-        users = self.get_users()
-        if users:
-            user = next((
-                user
-                for _, user in users.items()
-                if user['name'] == user_name or user['real_name'] == user_name
-            ), None)
+        if user_name:
+            user = self._get_directory().find(user_name)
         return user
+
+    def search_for_users_by_prefix(self, prefix: str, limit: int = 10) -> List[User]:
+        """
+        Consults the underlying implementation/store for users whose name or real name
+        starts with a prefix, ignoring case.
+
+        :param prefix: the start of the user name to look up
+        :param limit: the maximum number of users to return
+        :return: the users found (can be empty)
+        """
+        users = []
+        if prefix:
+            directory = self._get_directory()
+            # The prefix index is rebuilt from the name indexes, which update_user() and
+            # users.info lookups change in place
+            with self._lock:
+                users = directory.find_by_prefix(prefix, limit=limit)
+        return users
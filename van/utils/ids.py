@@ -1,6 +1,7 @@
 from slack.web.client import WebClient
 
 from van import logs
+from van.userstore import UserStore
 
 
 logs.init_logging()
@@ -10,27 +11,17 @@ LOGGER = logs.get_logger(__name__)
 def _get_users(bot_token):
     users = []
     if bot_token:
-        try:
-            slack_client = WebClient(token=bot_token)
-
-            api_call = slack_client.api_call('users.list')
-            if api_call.get('ok'):
-                users = api_call.get('members')
-        except Exception:
-            LOGGER.exception('Cannot get users')
+        users = list(UserStore(WebClient(token=bot_token)).get_users().values())
     return users
 
 
 def print_user_ids(bot_token, filter_for_bot=True):
     if bot_token:
         for user in _get_users(bot_token):
-            if user['is_bot'] or not filter_for_bot:
-                LOGGER.info('ID for "{name}"/"{real_name}" (bot: {is_bot}) is {id}'.format(
-                    name=user['name'],
-                    real_name=user['real_name'],
-                    is_bot=user['is_bot'],
-                    id=user.get('id'),
-                ))
+            if user.is_bot or not filter_for_bot:
+                LOGGER.info(
+                    'ID for "%s"/"%s" (bot: %s) is %s', user.name, user.real_name, user.is_bot, user.id
+                )
     else:
         LOGGER.warning('Need to set BOT_API_TOKEN env var')
 
@@ -38,7 +29,7 @@ def print_user_ids(bot_token, filter_for_bot=True):
 def find_user_id(bot_token, user_name_to_look_up):
     user_id = None
     if bot_token and user_name_to_look_up:
-        user = next((user for user in _get_users(bot_token) if user.get('name') == user_name_to_look_up), None)
+        user = next((user for user in _get_users(bot_token) if user.name == user_name_to_look_up), None)
         if user:
-            user_id = user['id']
+            user_id = user.id
     return user_id